@@ -8,6 +8,10 @@ from routes.users import users_bp
 from routes.chat import chat_bp
 from routes.referrals import referrals_bp
 from routes.upload import upload_bp
+from presence import presence
+from event_bus import event_bus
+from chat_events import chat_events
+import event_handlers  # Registers the event bus consumers
 
 def create_app():
     """Application factory for Flask app"""
@@ -18,6 +22,9 @@ def create_app():
     db.init_app(app)
     jwt = JWTManager(app)
     CORS(app)  # Enable CORS for all routes
+    presence.init_app(app)  # Batched last_active writes (see presence.py)
+    event_bus.init_app(app)
+    chat_events.init_app(app)  # Caps open streams (see chat_events.py)
     
     # Register blueprints
     app.register_blueprint(auth_bp)
@@ -76,9 +83,13 @@ def create_app():
     def reset_database():
         """WARNING: Deletes ALL data from database!"""
         try:
-            from models import User, Referral, Chat, Message, Match
+            from models import User, Referral, Chat, Message, Match, UserNameToken, ReferralClosure, MessageArchive, DeletionJob
             
             # Delete all records
+            UserNameToken.query.delete()
+            ReferralClosure.query.delete()
+            MessageArchive.query.delete()
+            DeletionJob.query.delete()
             Message.query.delete()
             Chat.query.delete()
             Match.query.delete()
@@ -104,6 +115,8 @@ def create_app():
             import os
             from models import User
             from encryption import encryption_service
+            from name_index import update_name_index
+            from referral_index import add_user_to_closure
             from flask_jwt_extended import create_access_token
             
             data = request.get_json()
@@ -142,6 +155,9 @@ def create_app():
             )
             
             db.session.add(user)
+            db.session.flush()
+            update_name_index(user.id, data['full_name'])
+            add_user_to_closure(user.id)
             db.session.commit()
             
             return jsonify({
@@ -199,6 +215,8 @@ def create_app():
             # Check if table exists first
             inspector = inspect(db.engine)
             if 'users' in inspector.get_table_names():
+                recount_referrals = False
+                
                 # Check if columns exist
                 columns = [col['name'] for col in inspector.get_columns('users')]
                 print(f"[MIGRATION] Existing columns in users table: {columns}")  # Debug log
@@ -276,6 +294,62 @@ def create_app():
                 else:
                     print("ℹ️  Migration: 'is_suspended' column already exists")
                 
+                # Add deletion tombstone column if missing
+                if 'deleted_at' not in columns:
+                    try:
+                        db.session.execute(text("""
+                            ALTER TABLE users 
+                            ADD COLUMN deleted_at TIMESTAMP;
+                        """))
+                        db.session.commit()
+                        print("✅ Migration: Added 'deleted_at' column to users table")
+                    except Exception as migration_error:
+                        print(f"❌ Migration ERROR adding 'deleted_at': {migration_error}")
+                        import traceback
+                        traceback.print_exc()
+                        db.session.rollback()
+                else:
+                    print("ℹ️  Migration: 'deleted_at' column already exists")
+                
+                # Add unread total column if missing (computed with the chat state below)
+                recount_unread = False
+                if 'unread_messages_count' not in columns:
+                    try:
+                        db.session.execute(text("""
+                            ALTER TABLE users 
+                            ADD COLUMN unread_messages_count INTEGER NOT NULL DEFAULT 0;
+                        """))
+                        db.session.commit()
+                        recount_unread = True
+                        print("✅ Migration: Added 'unread_messages_count' column to users table")
+                    except Exception as migration_error:
+                        print(f"❌ Migration ERROR adding 'unread_messages_count': {migration_error}")
+                        import traceback
+                        traceback.print_exc()
+                        db.session.rollback()
+                else:
+                    print("ℹ️  Migration: 'unread_messages_count' column already exists")
+                
+                # Add referral counter columns if missing, then compute them
+                if 'direct_referrals' not in columns or 'subtree_size' not in columns:
+                    try:
+                        for column_name in ('direct_referrals', 'subtree_size'):
+                            if column_name not in columns:
+                                db.session.execute(text(f"""
+                                    ALTER TABLE users 
+                                    ADD COLUMN {column_name} INTEGER NOT NULL DEFAULT 0;
+                                """))
+                        db.session.commit()
+                        recount_referrals = True
+                        print("✅ Migration: Added referral counter columns to users table")
+                    except Exception as migration_error:
+                        print(f"❌ Migration ERROR adding referral counter columns: {migration_error}")
+                        import traceback
+                        traceback.print_exc()
+                        db.session.rollback()
+                else:
+                    print("ℹ️  Migration: referral counter columns already exist")
+                
                 # Create blocks table if it doesn't exist
                 if 'blocks' not in inspector.get_table_names():
                     try:
@@ -297,6 +371,134 @@ def create_app():
                         db.session.rollback()
                 else:
                     print("ℹ️  Migration: 'blocks' table already exists")
+                
+                # Index referrals by referrer (children lookups in the referral tree)
+                try:
+                    db.session.execute(text("""
+                        CREATE INDEX IF NOT EXISTS ix_referrals_referrer_id
+                        ON referrals(referrer_id);
+                    """))
+                    db.session.commit()
+                except Exception as migration_error:
+                    print(f"❌ Migration ERROR creating referrals referrer index: {migration_error}")
+                    db.session.rollback()
+                
+                # Index messages by (chat_id, id) for keyset reads of a chat
+                try:
+                    db.session.execute(text("""
+                        CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id
+                        ON messages(chat_id, id);
+                    """))
+                    db.session.commit()
+                except Exception as migration_error:
+                    print(f"❌ Migration ERROR creating messages chat index: {migration_error}")
+                    db.session.rollback()
+                
+                # Index mutual matches by (user_id, created_at) for keyset pages of /users/matches
+                try:
+                    db.session.execute(text("""
+                        CREATE INDEX IF NOT EXISTS idx_matches_user_mutual_created
+                        ON matches(user_id, is_mutual, created_at);
+                    """))
+                    db.session.commit()
+                except Exception as migration_error:
+                    print(f"❌ Migration ERROR creating matches index: {migration_error}")
+                    db.session.rollback()
+
+                # Partition messages by month (PostgreSQL): convert while still empty, keep partitions ahead
+                try:
+                    from message_partitions import is_postgres, is_partitioned, ensure_partitions, convert_to_partitioned
+                    if is_postgres():
+                        if not is_partitioned():
+                            if db.session.execute(text("SELECT 1 FROM messages LIMIT 1")).first() is None:
+                                convert_to_partitioned()
+                                print("✅ Migration: Converted empty 'messages' table to monthly partitions")
+                            else:
+                                print("ℹ️  Migration: 'messages' is not partitioned - run partition_messages.py when idle")
+                        else:
+                            failed = ensure_partitions()
+                            if failed:
+                                print(f"❌ Migration ERROR creating message partitions: {', '.join(failed)}")
+                        db.session.commit()
+                except Exception as migration_error:
+                    print(f"❌ Migration ERROR partitioning messages: {migration_error}")
+                    import traceback
+                    traceback.print_exc()
+                    db.session.rollback()
+                
+                # Full-text index for message search (PostgreSQL)
+                try:
+                    from message_search import ensure_search_index
+                    ensure_search_index()
+                    db.session.commit()
+                except Exception as migration_error:
+                    print(f"❌ Migration ERROR creating message search index: {migration_error}")
+                    db.session.rollback()
+
+                # Build the referral closure index if it is empty (first deploy)
+                try:
+                    from models import User, ReferralClosure
+                    from referral_index import build_closure, recompute_referral_counters
+                    if ReferralClosure.query.first() is None and User.query.first() is not None:
+                        written = build_closure()
+                        db.session.commit()
+                        recount_referrals = True
+                        print(f"✅ Migration: Built referral closure index ({written} rows)")
+                    if recount_referrals:
+                        recompute_referral_counters()
+                        db.session.commit()
+                        print("✅ Migration: Recomputed referral counters")
+                except Exception as migration_error:
+                    print(f"❌ Migration ERROR building referral closure index: {migration_error}")
+                    import traceback
+                    traceback.print_exc()
+                    db.session.rollback()
+
+                # Add denormalized chat state columns if missing, then backfill them
+                if 'chats' in inspector.get_table_names():
+                    chat_columns = [col['name'] for col in inspector.get_columns('chats')]
+                    chat_state_columns = {
+                        'last_message_id': 'INTEGER',
+                        'last_message_sender_id': 'INTEGER',
+                        'last_message_preview': 'VARCHAR(200)',
+                        'user1_unread_count': 'INTEGER NOT NULL DEFAULT 0',
+                        'user2_unread_count': 'INTEGER NOT NULL DEFAULT 0',
+                        'user1_last_read_message_id': 'INTEGER NOT NULL DEFAULT 0',
+                        'user2_last_read_message_id': 'INTEGER NOT NULL DEFAULT 0',
+                        'deleted_at': 'TIMESTAMP'
+                    }
+                    missing_columns = [name for name in chat_state_columns if name not in chat_columns]
+                    try:
+                        for column_name in missing_columns:
+                            db.session.execute(text(f"""
+                                ALTER TABLE chats
+                                ADD COLUMN {column_name} {chat_state_columns[column_name]};
+                            """))
+                        db.session.execute(text("""
+                            CREATE INDEX IF NOT EXISTS idx_chats_user1_last_message
+                            ON chats(user1_id, last_message_at);
+                        """))
+                        db.session.execute(text("""
+                            CREATE INDEX IF NOT EXISTS idx_chats_user2_last_message
+                            ON chats(user2_id, last_message_at);
+                        """))
+                        if missing_columns:
+                            from chat_state import recompute_chat_state, backfill_read_watermarks
+                            if 'user1_last_read_message_id' in missing_columns:
+                                backfill_read_watermarks()
+                            recompute_chat_state()
+                            recount_unread = True
+                            print("✅ Migration: Added chat state columns to chats table")
+                        if recount_unread:
+                            from chat_state import recompute_unread_totals
+                            recompute_unread_totals()
+                            print("✅ Migration: Recomputed unread totals")
+                        db.session.commit()
+                    except Exception as migration_error:
+                        print(f"❌ Migration ERROR adding chat state columns: {migration_error}")
+                        import traceback
+                        traceback.print_exc()
+                        db.session.rollback()
             else:
                 # Table doesn't exist yet, db.create_all() will create it with all columns
                 print("ℹ️  Users table doesn't exist yet, will be created with all columns")
@@ -308,6 +510,28 @@ def create_app():
             traceback.print_exc()
             db.session.rollback()
     
+        # Load this worker's in-memory referral forest
+        try:
+            from referral_graph import referral_forest
+            referral_forest.refresh(force=True)
+            print("✅ Loaded referral forest snapshot")
+        except Exception as e:
+            print(f"⚠️  Referral forest load failed (will retry on first use): {e}")
+            db.session.rollback()
+
+        # Resume background deletions interrupted by a restart
+        try:
+            from models import DeletionJob
+            from deletion_jobs import requeue_jobs, deletion_worker
+            requeue_jobs()
+            db.session.commit()
+            if DeletionJob.query.filter_by(status='pending').first() is not None:
+                deletion_worker.notify(app)
+                print("✅ Resumed pending deletion jobs")
+        except Exception as e:
+            print(f"⚠️  Could not resume deletion jobs: {e}")
+            db.session.rollback()
+
     return app
 
 # Create app instance for gunicorn
@@ -0,0 +1,37 @@
+"""
+Archive old chat messages to cold storage (see message_archive.py)
+Run daily (e.g. cron): creates upcoming monthly partitions, then archives
+every month older than MESSAGE_ARCHIVE_AFTER_MONTHS
+"""
+from app import create_app
+from models import db
+from message_partitions import is_partitioned, ensure_partitions
+from message_archive import months_to_archive, archive_month
+
+def archive_messages():
+    app = create_app()
+    
+    with app.app_context():
+        if is_partitioned():
+            failed = ensure_partitions()
+            if failed:
+                print(f"❌ Could not create partitions: {', '.join(failed)}")
+            else:
+                print("✅ Monthly partitions are in place")
+        
+        months = months_to_archive()
+        if not months:
+            print("ℹ️  Nothing to archive")
+            return
+        
+        for month in months:
+            try:
+                archived = archive_month(month)
+                print(f"✅ Archived {month:%Y-%m}: {archived} messages")
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Archiving {month:%Y-%m} failed: {e}")
+                break
+
+if __name__ == '__main__':
+    archive_messages()
@@ -3,6 +3,9 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required
 from models import db, User, Referral
 from encryption import encryption_service
+from name_index import update_name_index
+from referral_index import add_user_to_closure
+from referral_graph import referral_forest
 from utils import get_current_user_id
 import cloudinary
 import os
@@ -106,6 +109,9 @@ def register():
         db.session.add(new_user)
         db.session.flush()  # Get the new_user.id
         
+        # Index the name for search
+        update_name_index(new_user.id, data['full_name'])
+        
         # Create referral record
         referral = Referral(
             referrer_id=referrer.id,
@@ -114,8 +120,15 @@ def register():
         )
         
         db.session.add(referral)
+        
+        # Add the new user to the referral tree index
+        add_user_to_closure(new_user.id, referrer.id)
+        
         db.session.commit()
         
+        # Keep this worker's in-memory referral forest current
+        referral_forest.add_referral(new_user.id, referrer.id)
+        
         # Create access token (identity must be string)
         access_token = create_access_token(identity=str(new_user.id))
         
@@ -155,7 +168,7 @@ def login():
         # Find user by email hash
         user = User.query.filter_by(email_hash=email_hash).first()
         
-        if not user:
+        if not user or user.deleted_at is not None:
             print(f"[LOGIN DEBUG] ❌ User not found for email: {email_normalized}")
             return jsonify({'error': 'Invalid email or password'}), 401
         
@@ -212,7 +225,7 @@ def get_current_user():
         current_user_id = get_current_user_id()
         user = User.query.get(current_user_id)
         
-        if not user:
+        if not user or user.deleted_at is not None:
             return jsonify({'error': 'User not found'}), 404
         
         # Prepare user data with decrypted fields
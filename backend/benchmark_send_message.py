@@ -0,0 +1,92 @@
+"""
+Benchmark /chat/send throughput with and without group commit
+Creates temporary users and chats, sends messages from concurrent threads and
+prints messages per second for each mode, then deletes everything it created.
+Run against a scratch database: python benchmark_send_message.py [threads] [messages_per_thread]
+"""
+import sys
+import threading
+import time
+import bcrypt
+from flask_jwt_extended import create_access_token
+from app import create_app
+from models import db, User, Chat, Message
+from encryption import encryption_service
+
+PASSWORD_HASH = bcrypt.hashpw(b'benchmark', bcrypt.gensalt()).decode('utf-8')
+
+
+def create_users(count):
+    """Create throwaway users (no referrals, not searchable) and return their ids"""
+    users = []
+    for i in range(count):
+        email = f"benchmark-{time.time_ns()}-{i}@example.invalid"
+        user = User(
+            email_hash=encryption_service.hash_email(email),
+            email_encrypted=encryption_service.encrypt(email),
+            full_name_encrypted=encryption_service.encrypt(f"Benchmark {i}"),
+            password_hash=PASSWORD_HASH
+        )
+        db.session.add(user)
+        users.append(user)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def run(app, tokens, recipient_ids, messages_per_thread):
+    """Send from one thread per sender; returns (messages sent, seconds, failures)"""
+    failures = []
+
+    def worker(token, recipient_id):
+        client = app.test_client()
+        headers = {'Authorization': f'Bearer {token}'}
+        for i in range(messages_per_thread):
+            response = client.post('/chat/send', json={'recipient_id': recipient_id, 'content': f'benchmark {i}'},
+                                   headers=headers)
+            if response.status_code != 201:
+                failures.append(response.get_json())
+
+    threads = [threading.Thread(target=worker, args=args) for args in zip(tokens, recipient_ids)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return len(threads) * messages_per_thread - len(failures), elapsed, failures
+
+
+def benchmark_send_message(threads=16, messages_per_thread=50):
+    app = create_app()
+
+    with app.app_context():
+        # Each thread is a sender; pairs of senders share a recipient
+        sender_ids = create_users(threads)
+        recipient_ids = create_users(max(threads // 2, 1))
+        targets = [recipient_ids[i % len(recipient_ids)] for i in range(threads)]
+        tokens = [create_access_token(identity=str(user_id)) for user_id in sender_ids]
+        all_ids = sender_ids + recipient_ids
+
+        try:
+            for group_commit in (False, True):
+                app.config['CHAT_GROUP_COMMIT'] = group_commit
+                sent, elapsed, failures = run(app, tokens, targets, messages_per_thread)
+                mode = 'group commit' if group_commit else 'per-request commit'
+                print(f"{mode:>20}: {sent} messages in {elapsed:.2f}s = {sent / elapsed:.0f} msg/s"
+                      f" ({len(failures)} failed)")
+                if failures:
+                    print(f"  first failure: {failures[0]}")
+        finally:
+            chats = Chat.query.filter(Chat.user1_id.in_(all_ids) | Chat.user2_id.in_(all_ids))
+            chat_ids = [chat.id for chat in chats]
+            Message.query.filter(Message.chat_id.in_(chat_ids)).delete(synchronize_session=False)
+            Chat.query.filter(Chat.id.in_(chat_ids)).delete(synchronize_session=False)
+            User.query.filter(User.id.in_(all_ids)).delete(synchronize_session=False)
+            db.session.commit()
+            print("Cleaned up benchmark data")
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    benchmark_send_message(*args)
@@ -0,0 +1,111 @@
+"""
+Cached per-user block sets.
+
+Every endpoint that filters by blocks used to query the blocks table itself
+(search twice per call, profile once more). A BlockSet holds both
+directions for one user as sorted int arrays, loaded in one query:
+the users they blocked and the users who blocked them. Membership is a
+binary search.
+
+Sets are cached per process (LRU, at most MAX_ENTRIES users) and dropped
+on user_blocked / user_unblocked events for both users involved (see
+event_handlers.py). With the postgres event bus this happens in every
+worker. Entries also expire after TTL_SECONDS, in case an event is lost.
+"""
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+import heapq
+import threading
+import time
+from sqlalchemy import select, literal, union_all
+from models import db, Block
+
+# Users whose block sets are kept per process
+MAX_ENTRIES = 10000
+
+# Upper bound on staleness if an invalidation event is missed
+TTL_SECONDS = 300
+
+
+def _contains(ids, user_id):
+    index = bisect_left(ids, user_id)
+    return index < len(ids) and ids[index] == user_id
+
+
+class BlockSet:
+    """Blocks of one user in both directions, as sorted id arrays"""
+
+    def __init__(self, blocked, blocked_by):
+        self.blocked = array('i', sorted(blocked))  # Users this user blocked
+        self.blocked_by = array('i', sorted(blocked_by))  # Users who blocked this user
+
+    def blocks(self, other_user_id):
+        """Whether this user blocked other_user_id"""
+        return _contains(self.blocked, other_user_id)
+
+    def is_blocked_by(self, other_user_id):
+        return _contains(self.blocked_by, other_user_id)
+
+    def __contains__(self, other_user_id):
+        """Blocked in either direction"""
+        return self.blocks(other_user_id) or self.is_blocked_by(other_user_id)
+
+    def __len__(self):
+        return len(self.blocked) + len(self.blocked_by)
+
+    def ids(self):
+        """Sorted ids blocked in either direction (no duplicates)"""
+        return list(dict.fromkeys(heapq.merge(self.blocked, self.blocked_by)))
+
+
+class BlockCache:
+    """LRU of BlockSets by user id"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # user_id -> (BlockSet, loaded_at)
+        self.version = 0  # Bumped by every invalidation, so a load racing one isn't cached
+
+    def _load(self, user_id):
+        rows = db.session.execute(union_all(
+            select(Block.blocked_id, literal(True)).where(Block.blocker_id == user_id),
+            select(Block.blocker_id, literal(False)).where(Block.blocked_id == user_id)
+        )).all()
+        return BlockSet(
+            [other_id for other_id, by_user in rows if by_user],
+            [other_id for other_id, by_user in rows if not by_user]
+        )
+
+    def get(self, user_id):
+        """The user's BlockSet (one query on a miss)"""
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[1] < TTL_SECONDS:
+                self.entries.move_to_end(user_id)
+                return entry[0]
+            version = self.version
+
+        block_set = self._load(user_id)
+        with self.lock:
+            if version != self.version:
+                return block_set
+            self.entries[user_id] = (block_set, time.monotonic())
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > MAX_ENTRIES:
+                self.entries.popitem(last=False)
+        return block_set
+
+    def is_blocked(self, user_id, other_user_id):
+        """Whether the two users blocked each other in either direction"""
+        return other_user_id in self.get(user_id)
+
+    def invalidate(self, *user_ids):
+        with self.lock:
+            self.version += 1
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+
+# Singleton instance (one per worker process)
+block_cache = BlockCache()
@@ -0,0 +1,42 @@
+"""
+Build the name search blind index for existing users
+Run once after deploying name search, or after rotating NAME_INDEX_KEY
+"""
+from app import create_app
+from models import db, User
+from encryption import encryption_service
+from name_index import update_name_index
+
+BATCH_SIZE = 500
+
+def build_name_index():
+    app = create_app()
+
+    with app.app_context():
+        print("Building name index for existing users...")
+
+        indexed = 0
+        failed = 0
+        last_id = 0
+        while True:
+            users = User.query.filter(User.id > last_id).order_by(User.id).limit(BATCH_SIZE).all()
+            if not users:
+                break
+
+            for user in users:
+                try:
+                    full_name = encryption_service.decrypt(user.full_name_encrypted)
+                    update_name_index(user.id, full_name)
+                    indexed += 1
+                except Exception as e:
+                    print(f"❌ Error indexing user {user.id}: {e}")
+                    failed += 1
+
+            last_id = users[-1].id
+            db.session.commit()
+            print(f"  ...indexed up to user {last_id}")
+
+        print(f"✅ Name index built: {indexed} users indexed, {failed} failed")
+
+if __name__ == '__main__':
+    build_name_index()
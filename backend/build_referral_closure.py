@@ -0,0 +1,26 @@
+"""
+Rebuild the referral closure index (referral_closure table) from the referrals table
+Runs automatically on first startup; run manually to repair the index
+"""
+from app import create_app
+from models import db
+from referral_index import build_closure, recompute_referral_counters
+
+def rebuild_referral_closure():
+    app = create_app()
+    
+    with app.app_context():
+        print("Rebuilding referral closure index...")
+        
+        try:
+            written = build_closure()
+            recompute_referral_counters()
+            db.session.commit()
+            print(f"✅ Referral closure index rebuilt ({written} rows)")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Rebuild failed: {e}")
+
+if __name__ == '__main__':
+    rebuild_referral_closure()
@@ -0,0 +1,92 @@
+"""
+In-process broker for chat push events (server-sent events).
+
+Each open /chat/stream connection subscribes a bounded queue for its user;
+chat routes publish events to a user's queues after committing. The broker
+only reaches streams open in its own worker process; events published
+through the event bus (event_bus.py) are fanned out to every process's
+broker by event_handlers.py. Clients fall back to polling whenever the
+stream is down.
+
+Every open stream holds a worker thread, so the broker admits at most
+max_streams streams per process (and MAX_STREAMS_PER_USER per user);
+subscribe() refuses the rest, and those clients poll until a slot frees up.
+"""
+import json
+import queue
+import threading
+
+# Events buffered per connection before it is considered stuck
+QUEUE_SIZE = 100
+
+# Open streams (tabs) per user; more tabs poll
+MAX_STREAMS_PER_USER = 5
+
+
+class ChatEventBroker:
+    """Fan-out of chat events to the open streams of each user"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}  # user_id -> set of queues
+        self.stream_count = 0
+        self.max_streams = None  # None means unlimited
+
+    def init_app(self, app):
+        """Cap open streams at STREAM_MAX_CONNECTIONS"""
+        self.max_streams = app.config.get('STREAM_MAX_CONNECTIONS')
+
+    def subscribe(self, user_id):
+        """Register a new stream for a user, returns the queue to read events from (None when at capacity)"""
+        events = queue.Queue(maxsize=QUEUE_SIZE)
+        with self.lock:
+            if self.max_streams is not None and self.stream_count >= self.max_streams:
+                return None
+            streams = self.subscribers.setdefault(user_id, set())
+            if len(streams) >= MAX_STREAMS_PER_USER:
+                return None
+            streams.add(events)
+            self.stream_count += 1
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self.lock:
+            streams = self.subscribers.get(user_id)
+            if streams is None or events not in streams:
+                return
+            streams.discard(events)
+            self.stream_count -= 1
+            if not streams:
+                del self.subscribers[user_id]
+
+    def is_connected(self, user_id):
+        """Whether the user has at least one open stream in this process"""
+        with self.lock:
+            return user_id in self.subscribers
+
+    def publish(self, user_id, event_type, data):
+        """Send an event to every open stream of a user (never blocks)"""
+        with self.lock:
+            streams = list(self.subscribers.get(user_id, ()))
+
+        for events in streams:
+            try:
+                events.put_nowait((event_type, data))
+            except queue.Full:
+                # Client isn't keeping up - drop its backlog and ask it to reload
+                with events.mutex:
+                    events.queue.clear()
+                events.put_nowait(('resync', {}) if event_type != 'close' else (event_type, data))
+
+    def disconnect(self, user_id):
+        """Ask every open stream of a user to close"""
+        self.publish(user_id, 'close', {})
+
+
+def format_event(event_type, data):
+    """Serialize one event in text/event-stream format"""
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+# Singleton instance (one per worker process)
+chat_events = ChatEventBroker()
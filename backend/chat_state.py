@@ -0,0 +1,178 @@
+"""
+Denormalized chat state: last message and per-participant unread counts.
+
+Chats carry a copy of their last message (id, sender, preview), one read
+watermark (last read message id) and one unread counter per participant, so
+the conversations list never has to look into the messages table and marking
+a chat read only updates the chat row. send_message and mark-as-read keep
+them current; the recompute function rebuilds the rest from the watermarks
+and the messages table. Counters only change in SQL (increments on send, a
+reset under the row lock on read), so concurrent sends and reads don't lose
+updates.
+
+Each user also has a total (users.unread_messages_count) kept in step with
+their per-chat counters, so the unread badge is a primary key read. Marking a
+chat read subtracts the count it reset from the reader's total.
+"""
+from sqlalchemy import select, func, update, and_, false
+from sqlalchemy.orm.attributes import set_committed_value
+from models import db, User, Chat, Message
+
+PREVIEW_LENGTH = 200
+
+
+def record_message(chat, message):
+    """Update a chat after adding a message (message must be flushed so it has an id)"""
+    chat.last_message_id = message.id
+    chat.last_message_sender_id = message.sender_id
+    chat.last_message_preview = message.content[:PREVIEW_LENGTH]
+    chat.last_message_at = message.sent_at
+
+    # Increment in SQL so concurrent sends don't lose updates
+    if message.sender_id == chat.user1_id:
+        recipient_id = chat.user2_id
+        chat.user2_unread_count = Chat.user2_unread_count + 1
+    else:
+        recipient_id = chat.user1_id
+        chat.user1_unread_count = Chat.user1_unread_count + 1
+    _add_to_unread_total(recipient_id, 1)
+
+
+def _add_to_unread_total(user_id, delta):
+    db.session.execute(
+        update(User).where(User.id == user_id)
+        .values(unread_messages_count=User.unread_messages_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def mark_chat_read(chat, user_id):
+    """
+    Move a participant's read watermark to the chat's last message and reset
+    their unread count - one locked re-read and one row update, or nothing if
+    `chat` shows them caught up. The counts are re-read under the row lock
+    because `chat` may be older than a message committed since it was loaded.
+    Returns the number of messages that became read.
+    """
+    if chat.last_read_message_id_for(user_id) >= (chat.last_message_id or 0) and not chat.unread_count_for(user_id):
+        return 0
+
+    prefix = 'user1' if user_id == chat.user1_id else 'user2'
+    watermark_column = f'{prefix}_last_read_message_id'
+    count_column = f'{prefix}_unread_count'
+
+    current = db.session.execute(
+        select(Chat.last_message_id, getattr(Chat, count_column)).where(Chat.id == chat.id).with_for_update()
+    ).first()
+    if current is None:
+        return 0
+    last_message_id, unread = current[0] or 0, current[1] or 0
+
+    db.session.execute(
+        update(Chat).where(Chat.id == chat.id)
+        .values({watermark_column: last_message_id, count_column: 0})
+        .execution_options(synchronize_session=False)
+    )
+    # Reflect the write on the loaded object without marking it dirty
+    set_committed_value(chat, 'last_message_id', current[0])
+    set_committed_value(chat, watermark_column, last_message_id)
+    set_committed_value(chat, count_column, 0)
+
+    # Subtract what was actually unread under the lock, so the total stays the sum of the counters
+    if unread:
+        _add_to_unread_total(user_id, -unread)
+    return unread
+
+
+def forget_chats(chats):
+    """
+    Take the unread counts of chats about to be deleted off their participants'
+    totals (counts re-read under the row locks, like mark_chat_read)
+    """
+    if not chats:
+        return
+    rows = db.session.execute(
+        select(Chat.user1_id, Chat.user2_id, Chat.user1_unread_count, Chat.user2_unread_count)
+        .where(Chat.id.in_([chat.id for chat in chats])).order_by(Chat.id).with_for_update()
+    ).all()
+    for user1_id, user2_id, user1_unread, user2_unread in rows:
+        for user_id, unread in ((user1_id, user1_unread), (user2_id, user2_unread)):
+            if unread:
+                _add_to_unread_total(user_id, -unread)
+
+
+def recompute_chat_state():
+    """Rebuild last message and unread counts of every chat from the messages table"""
+    last_message_id = select(func.max(Message.id)).where(Message.chat_id == Chat.id).scalar_subquery()
+    db.session.execute(
+        update(Chat).values(last_message_id=last_message_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    def last_message(column):
+        return select(column).where(Message.id == Chat.last_message_id).scalar_subquery()
+
+    db.session.execute(
+        update(Chat).values(
+            last_message_sender_id=last_message(Message.sender_id),
+            last_message_preview=last_message(func.substr(Message.content, 1, PREVIEW_LENGTH))
+        ).execution_options(synchronize_session=False)
+    )
+
+    def unread_for(user_column, watermark_column):
+        return select(func.count(Message.id)).where(and_(
+            Message.chat_id == Chat.id,
+            Message.sender_id != user_column,
+            Message.id > watermark_column
+        )).scalar_subquery()
+
+    db.session.execute(
+        update(Chat).values(
+            user1_unread_count=unread_for(Chat.user1_id, Chat.user1_last_read_message_id),
+            user2_unread_count=unread_for(Chat.user2_id, Chat.user2_last_read_message_id)
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def backfill_read_watermarks():
+    """
+    One-off: derive read watermarks from the legacy Message.is_read flags.
+    A participant has read everything before their oldest unread message
+    (or the whole chat if nothing is unread).
+    """
+    def watermark_for(user_column):
+        first_unread = select(func.min(Message.id)).where(and_(
+            Message.chat_id == Chat.id,
+            Message.sender_id != user_column,
+            Message.is_read == false()
+        )).scalar_subquery()
+        last_message = select(func.max(Message.id)).where(Message.chat_id == Chat.id).scalar_subquery()
+        return func.coalesce(first_unread - 1, last_message, 0)
+
+    db.session.execute(
+        update(Chat).values(
+            user1_last_read_message_id=watermark_for(Chat.user1_id),
+            user2_last_read_message_id=watermark_for(Chat.user2_id)
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def get_unread_total(user_id):
+    """Total unread messages of a user across all chats - a primary key read"""
+    total = db.session.query(User.unread_messages_count).filter(User.id == user_id).scalar()
+    return total or 0
+
+
+def recompute_unread_totals():
+    """Recompute every user's unread total from the per-chat unread counts"""
+    as_user1 = select(func.coalesce(func.sum(Chat.user1_unread_count), 0)).where(
+        Chat.user1_id == User.id
+    ).scalar_subquery()
+    as_user2 = select(func.coalesce(func.sum(Chat.user2_unread_count), 0)).where(
+        Chat.user2_id == User.id
+    ).scalar_subquery()
+
+    db.session.execute(
+        update(User).values(unread_messages_count=as_user1 + as_user2)
+        .execution_options(synchronize_session=False)
+    )
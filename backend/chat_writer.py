@@ -0,0 +1,177 @@
+"""
+Group commit for chat messages (optional, enable with CHAT_GROUP_COMMIT=true).
+
+Instead of committing each message in its own request, /chat/send hands the
+message to one writer thread per worker process. The writer collects the
+sends that arrive within GROUP_COMMIT_WINDOW_MS (up to GROUP_COMMIT_MAX_BATCH
+messages), saves them in a single transaction and then acknowledges every
+request with its saved message. If a batch fails, it is retried one message
+per transaction so a bad message only fails its own request.
+
+A request that times out withdraws its message if the writer hasn't picked
+it up yet, so a timeout error always means the message was not saved and
+the client can safely retry. Once picked up, the request waits up to
+ACK_TIMEOUT more for the batch's outcome; if none arrives (or the writer
+fails without reporting one) it gets CommitOutcomeUnknown instead.
+"""
+import queue
+import threading
+import time
+from datetime import datetime
+from models import db, Chat, Message
+from chat_state import record_message
+
+# How long a request may wait for its batch to be committed
+ACK_TIMEOUT = 10.0
+
+OUTCOME_UNKNOWN = 'Message may or may not have been sent - reload the chat before retrying'
+
+
+class CommitOutcomeUnknown(Exception):
+    """A claimed message whose commit wasn't confirmed or refused in time"""
+
+
+class PendingMessage:
+    """A message waiting for the writer, with its acknowledgement"""
+
+    def __init__(self, chat_id, sender_id, content):
+        self.chat_id = chat_id
+        self.sender_id = sender_id
+        self.content = content
+        self.sent_at = datetime.utcnow()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.state_lock = threading.Lock()
+        self.claimed = False  # Picked up by the writer
+        self.cancelled = False  # Withdrawn by the request after ACK_TIMEOUT
+
+    def claim(self):
+        """Called by the writer before saving; False if the request already gave up"""
+        with self.state_lock:
+            if self.cancelled:
+                return False
+            self.claimed = True
+            return True
+
+    def wait(self, timeout=ACK_TIMEOUT):
+        """Block until committed; returns the message dict or raises the write error"""
+        if not self.done.wait(timeout):
+            with self.state_lock:
+                if not self.claimed:
+                    self.cancelled = True
+                    raise TimeoutError('Message was not sent in time, try again')
+            # Already being written - its commit decides, if it reports in time
+            if not self.done.wait(timeout):
+                raise CommitOutcomeUnknown(OUTCOME_UNKNOWN)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class GroupCommitWriter:
+    """Single writer thread that commits queued messages in batches"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.thread = None
+        self.app = None
+
+    def _ensure_started(self, app):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.app = app
+            self.thread = threading.Thread(target=self._run, name='chat-group-commit', daemon=True)
+            self.thread.start()
+
+    def send(self, app, chat_id, sender_id, content):
+        """Queue a message for the next batch and wait for it to be committed"""
+        self._ensure_started(app)
+        item = PendingMessage(chat_id, sender_id, content)
+        self.pending.put(item)
+        return item.wait()
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            window = self.app.config.get('GROUP_COMMIT_WINDOW_MS', 5) / 1000.0
+            max_batch = self.app.config.get('GROUP_COMMIT_MAX_BATCH', 100)
+            deadline = time.monotonic() + window
+            while len(batch) < max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            batch = [item for item in batch if item.claim()]
+            if not batch:
+                continue
+
+            with self.app.app_context():
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    print(f"[CHAT WRITER] Batch of {len(batch)} failed without an outcome: {e}")
+                finally:
+                    # Never leave a request waiting on an item the writer dropped
+                    for item in batch:
+                        if not item.done.is_set():
+                            item.error = CommitOutcomeUnknown(OUTCOME_UNKNOWN)
+                            item.done.set()
+                    try:
+                        db.session.remove()
+                    except Exception as e:
+                        print(f"[CHAT WRITER] Session cleanup failed: {e}")
+
+    def _save(self, item):
+        """Insert one message and update its chat state (inside the open transaction)"""
+        chat = Chat.query.get(item.chat_id)
+        if chat is None:
+            raise LookupError('Chat not found')
+
+        message = Message(
+            chat_id=item.chat_id,
+            sender_id=item.sender_id,
+            content=item.content,
+            sent_at=item.sent_at
+        )
+        db.session.add(message)
+        db.session.flush()
+
+        record_message(chat, message)
+        # Flush so the next message to the same chat in this batch increments the new count
+        db.session.flush()
+        return message.to_dict(chat)
+
+    def _write(self, batch):
+        try:
+            results = [self._save(item) for item in batch]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[CHAT WRITER] Batch of {len(batch)} failed, retrying one by one: {e}")
+            self._write_one_by_one(batch)
+            return
+
+        for item, result in zip(batch, results):
+            item.result = result
+            item.done.set()
+
+    def _write_one_by_one(self, batch):
+        for item in batch:
+            try:
+                item.result = self._save(item)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                item.error = e
+            item.done.set()
+
+
+# Singleton instance (one per worker process)
+chat_writer = GroupCommitWriter()
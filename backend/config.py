@@ -16,6 +16,23 @@ class Config:
     
     # Encryption
     ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')
+    NAME_INDEX_KEY = os.getenv('NAME_INDEX_KEY')  # Blind index key (derived from ENCRYPTION_KEY if unset)
+    
+    # Chat group commit (see chat_writer.py)
+    CHAT_GROUP_COMMIT = os.getenv('CHAT_GROUP_COMMIT', 'False').lower() == 'true'
+    GROUP_COMMIT_WINDOW_MS = int(os.getenv('GROUP_COMMIT_WINDOW_MS', '5'))
+    GROUP_COMMIT_MAX_BATCH = int(os.getenv('GROUP_COMMIT_MAX_BATCH', '100'))
+    
+    # Open /chat/stream connections per worker process; each holds a gunicorn thread, so keep this
+    # well below --threads (the rest serve the API). Clients over the cap poll instead.
+    STREAM_MAX_CONNECTIONS = int(os.getenv('STREAM_MAX_CONNECTIONS', '32'))
+    
+    # Domain event delivery: 'memory' (single process) or 'postgres' (LISTEN/NOTIFY across workers), see event_bus.py
+    EVENT_BUS_BACKEND = os.getenv('EVENT_BUS_BACKEND', 'memory')
+    
+    # Message archive (see message_archive.py)
+    MESSAGE_ARCHIVE_DIR = os.getenv('MESSAGE_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'message_archive'))
+    MESSAGE_ARCHIVE_AFTER_MONTHS = int(os.getenv('MESSAGE_ARCHIVE_AFTER_MONTHS', '12'))
     
     # Flask
     SECRET_KEY = os.getenv('JWT_SECRET_KEY')  # For session management
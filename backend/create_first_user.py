@@ -6,6 +6,8 @@ import bcrypt
 from app import create_app
 from models import db, User
 from encryption import encryption_service
+from name_index import update_name_index
+from referral_index import add_user_to_closure
 
 def create_first_user():
     app = create_app()
@@ -42,6 +44,9 @@ def create_first_user():
         )
         
         db.session.add(user)
+        db.session.flush()
+        update_name_index(user.id, full_name)
+        add_user_to_closure(user.id)
         db.session.commit()
         
         print(f"\n✅ First user created successfully!")
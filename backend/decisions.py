@@ -0,0 +1,97 @@
+"""
+Batched like/pass/block decisions for swipe-style browsing.
+
+A client collects decisions locally and sends them in one request. They are
+applied in one transaction with one bulk statement per kind instead of
+one request per like. When a batch holds several decisions for the same
+user, the last one wins and the earlier ones are reported as superseded.
+
+- like: removes an earlier pass and likes the user (see likes.py)
+- pass: removes an earlier like and records the pass
+- block: removes an earlier like and blocks the user, like POST /users/block
+"""
+from datetime import datetime
+from models import db, User, Match, Pass, Block
+from likes import lock_pairs, like_many, unlike_many, insert_ignoring_conflicts
+
+DECISIONS = ('like', 'pass', 'block')
+
+# Upper bound for decisions per request
+MAX_DECISIONS = 100
+
+
+def apply_decisions(user_id, decisions):
+    """
+    Apply [(target user id, decision)] in order (caller validates and commits).
+    Returns (results, new_mutual_ids, blocked_ids): one result dict per
+    decision, in order, with 'status' applied / unchanged / superseded /
+    not_found and, for likes, 'is_mutual'; the ids whose like just became a
+    mutual match; and the ids newly blocked.
+    """
+    last_index = {target_id: index for index, (target_id, _) in enumerate(decisions)}
+
+    target_ids = [target_id for target_id in last_index if target_id != user_id]
+    existing = {row[0] for row in db.session.query(User.id).filter(
+        User.id.in_(target_ids), User.deleted_at.is_(None)
+    )} if target_ids else set()
+
+    final = {}
+    for target_id, index in last_index.items():
+        if target_id in existing:
+            final.setdefault(decisions[index][1], []).append(target_id)
+
+    like_ids = final.get('like', [])
+    pass_ids = final.get('pass', [])
+    block_ids = final.get('block', [])
+    now = datetime.utcnow()
+
+    # Take every pair lock up front, in one sorted order, so concurrent batches can't deadlock
+    lock_pairs(user_id, like_ids + pass_ids + block_ids)
+
+    if like_ids:
+        db.session.query(Pass).filter(
+            Pass.user_id == user_id, Pass.passed_user_id.in_(like_ids)
+        ).delete(synchronize_session=False)
+    liked, new_mutual = like_many(user_id, like_ids)
+
+    # Likes that already existed report their current state
+    mutual = set(new_mutual)
+    already_liked = [target_id for target_id in like_ids if target_id not in liked]
+    if already_liked:
+        mutual.update(row[0] for row in db.session.query(Match.liked_user_id).filter(
+            Match.user_id == user_id, Match.liked_user_id.in_(already_liked), Match.is_mutual == True
+        ))
+
+    unlike_many(user_id, pass_ids + block_ids)
+
+    passed = set()
+    if pass_ids:
+        passed = set(db.session.execute(
+            insert_ignoring_conflicts(Pass, [
+                {'user_id': user_id, 'passed_user_id': target_id, 'created_at': now} for target_id in pass_ids
+            ], 'user_id', 'passed_user_id').returning(Pass.passed_user_id)
+        ).scalars())
+
+    blocked = set()
+    if block_ids:
+        blocked = set(db.session.execute(
+            insert_ignoring_conflicts(Block, [
+                {'blocker_id': user_id, 'blocked_id': target_id, 'created_at': now} for target_id in block_ids
+            ], 'blocker_id', 'blocked_id').returning(Block.blocked_id)
+        ).scalars())
+
+    changed = {'like': liked, 'pass': passed, 'block': blocked}
+    results = []
+    for index, (target_id, decision) in enumerate(decisions):
+        result = {'user_id': target_id, 'decision': decision}
+        if target_id not in existing:
+            result['status'] = 'not_found'
+        elif last_index[target_id] != index:
+            result['status'] = 'superseded'
+        else:
+            result['status'] = 'applied' if target_id in changed[decision] else 'unchanged'
+            if decision == 'like':
+                result['is_mutual'] = target_id in mutual
+        results.append(result)
+
+    return results, sorted(new_mutual), sorted(blocked)
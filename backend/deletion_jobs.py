@@ -0,0 +1,216 @@
+"""
+Background deletion of chats and users.
+
+Deleting a heavy chat or user used to run inside the HTTP request as a few
+unbounded DELETE statements. Now the request only tombstones the data
+(deleted_at, which every read path filters on) and records a DeletionJob;
+a worker thread then deletes the rows in chunks of CHUNK_SIZE, one short
+transaction per chunk, updating the job's progress as it goes.
+
+Jobs are claimed with a conditional UPDATE, so several processes can run
+workers safely. A running job refreshes updated_at after every chunk; one
+whose heartbeat is older than LEASE_SECONDS was interrupted by a restart and
+is picked up again at startup (or with run_deletion_jobs.py), along with any
+jobs left pending.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import or_, update
+from models import db, User, Chat, Message, Match, Pass, Block, DiscoveryQueue, DeletionJob
+from chat_state import forget_chats
+from message_archive import delete_chat_archives, remove_archive_files
+
+# Rows deleted per transaction
+CHUNK_SIZE = 500
+
+# Pause between chunks so deletions don't starve interactive traffic
+CHUNK_PAUSE = 0.05
+
+# A running job whose updated_at is older than this is presumed abandoned
+LEASE_SECONDS = 300
+
+
+def tombstone_chat(chat, requested_by=None):
+    """Hide a chat right away and queue its deletion (caller commits)"""
+    forget_chats([chat])
+    chat.deleted_at = datetime.utcnow()
+    job = DeletionJob(kind='chat', target_id=chat.id, requested_by=requested_by)
+    db.session.add(job)
+    return job
+
+
+def tombstone_user(user, requested_by=None):
+    """
+    Hide a user and their chats right away and queue the deletion of their
+    data (caller commits). The user can no longer log in or be found.
+    """
+    now = datetime.utcnow()
+    user.deleted_at = now
+    user.is_suspended = True
+
+    user_chats = Chat.query.filter(
+        or_(Chat.user1_id == user.id, Chat.user2_id == user.id),
+        Chat.deleted_at.is_(None)
+    ).all()
+    forget_chats(user_chats)
+    for chat in user_chats:
+        chat.deleted_at = now
+
+    job = DeletionJob(kind='user', target_id=user.id, requested_by=requested_by)
+    db.session.add(job)
+    return job
+
+
+def _delete_chunk(model, *criteria):
+    """Delete up to CHUNK_SIZE matching rows and commit; returns the number deleted"""
+    chunk_ids = [row[0] for row in db.session.query(model.id).filter(*criteria).limit(CHUNK_SIZE)]
+    if not chunk_ids:
+        return 0
+    model.query.filter(model.id.in_(chunk_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(chunk_ids)
+
+
+def _report(job_id, deleted):
+    """Add to the job's progress and renew its lease"""
+    db.session.execute(
+        update(DeletionJob).where(DeletionJob.id == job_id)
+        .values(deleted_rows=DeletionJob.deleted_rows + deleted, updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+def _delete_all(job_id, model, *criteria):
+    while True:
+        deleted = _delete_chunk(model, *criteria)
+        if not deleted:
+            return
+        _report(job_id, deleted)
+        time.sleep(CHUNK_PAUSE)
+
+
+def _delete_chat(job_id, chat_id):
+    _delete_all(job_id, Message, Message.chat_id == chat_id)
+
+    archive_paths = delete_chat_archives([chat_id])
+    Chat.query.filter(Chat.id == chat_id).delete(synchronize_session=False)
+    db.session.commit()
+    remove_archive_files(archive_paths)
+    _report(job_id, 1)
+
+
+def _delete_user(job_id, user_id):
+    chat_ids = [row[0] for row in db.session.query(Chat.id).filter(
+        or_(Chat.user1_id == user_id, Chat.user2_id == user_id)
+    )]
+    for chat_id in chat_ids:
+        _delete_chat(job_id, chat_id)
+
+    _delete_all(job_id, Match, or_(Match.user_id == user_id, Match.liked_user_id == user_id))
+    _delete_all(job_id, Pass, or_(Pass.user_id == user_id, Pass.passed_user_id == user_id))
+    _delete_all(job_id, Block, or_(Block.blocker_id == user_id, Block.blocked_id == user_id))
+
+    # Other users' queues may still hold the id - popped pages are re-checked (see discovery.py)
+    DiscoveryQueue.query.filter(DiscoveryQueue.user_id == user_id).delete(synchronize_session=False)
+    User.query.filter(User.id == user_id).delete(synchronize_session=False)
+    db.session.commit()
+    _report(job_id, 1)
+
+
+def _claim(job_id):
+    """Move a job to running unless another worker already has it"""
+    claimed = db.session.execute(
+        update(DeletionJob).where(DeletionJob.id == job_id, DeletionJob.status == 'pending')
+        .values(status='running', updated_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return claimed == 1
+
+
+def run_job(job_id):
+    """Run one pending job to completion (safe to retry - every step is idempotent)"""
+    if not _claim(job_id):
+        return
+    job = DeletionJob.query.get(job_id)
+    try:
+        if job.kind == 'chat':
+            _delete_chat(job.id, job.target_id)
+        elif job.kind == 'user':
+            _delete_user(job.id, job.target_id)
+        else:
+            raise ValueError(f"Unknown deletion job kind: {job.kind}")
+        status, error = 'done', None
+    except Exception as e:
+        db.session.rollback()
+        print(f"[DELETION] Job {job_id} failed: {e}")
+        status, error = 'failed', str(e)
+
+    db.session.execute(
+        update(DeletionJob).where(DeletionJob.id == job_id)
+        .values(status=status, error=error, updated_at=datetime.utcnow(), finished_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+def requeue_jobs(include_failed=False):
+    """
+    Put jobs whose lease ran out while running (and optionally failed ones)
+    back in the queue. Running jobs with a fresh heartbeat belong to a live
+    worker and are left alone.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=LEASE_SECONDS)
+    abandoned = (DeletionJob.status == 'running') & (DeletionJob.updated_at < cutoff)
+    if include_failed:
+        abandoned = abandoned | (DeletionJob.status == 'failed')
+    return db.session.execute(
+        update(DeletionJob).where(abandoned).values(status='pending', error=None)
+    ).rowcount
+
+
+def run_pending_jobs():
+    """Run every pending job, oldest first. Returns the number of jobs processed."""
+    processed = 0
+    while True:
+        job_id = db.session.query(DeletionJob.id).filter(
+            DeletionJob.status == 'pending'
+        ).order_by(DeletionJob.id).limit(1).scalar()
+        if job_id is None:
+            return processed
+        run_job(job_id)
+        processed += 1
+
+
+class DeletionWorker:
+    """Background thread that drains the pending jobs, woken when a job is queued"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.app = None
+
+    def notify(self, app):
+        """Wake (or start) the worker after committing a new job"""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.app = app
+                self.thread = threading.Thread(target=self._run, name='deletion-jobs', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.app.app_context():
+                try:
+                    run_pending_jobs()
+                except Exception as e:
+                    print(f"[DELETION] Worker error: {e}")
+                finally:
+                    db.session.remove()
+
+
+# Singleton instance (one per worker process)
+deletion_worker = DeletionWorker()
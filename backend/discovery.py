@@ -0,0 +1,148 @@
+"""
+Per-user discovery queues.
+
+Search recomputes "everyone except me, suspended users and blocks in either
+direction" on every request. Discovery instead builds a queue per user:
+one anti-join query selects up to QUEUE_SIZE candidates (newest users first)
+that aren't suspended, deleted, blocked in either direction, already liked or
+passed, and stores their ids as a packed int32 array in discovery_queues.
+
+A page is popped with a single UPDATE ... RETURNING that advances the
+position and slices the page's bytes out of the array in the database, so
+its cost doesn't depend on the queue or user base size. The popped page is
+re-checked against the current state in one page-sized query, which covers
+blocks, likes and suspensions since the build.
+
+A queue is rebuilt when it is older than REFRESH_SECONDS (from the top) or
+runs out (continuing below the last id it held, then wrapping around).
+refresh_discovery_queues.py rebuilds stale queues ahead of time.
+"""
+import sys
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import update, func, exists
+from models import db, User, Match, Pass, Block, DiscoveryQueue
+from likes import insert_ignoring_conflicts
+
+# Candidates per build (4 bytes each)
+QUEUE_SIZE = 2000
+
+# Queues older than this are rebuilt from the top
+REFRESH_SECONDS = 3600
+
+ID_BYTES = 4
+
+
+def _pack(ids):
+    packed = array('i', ids)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(data):
+    ids = array('i')
+    ids.frombytes(bytes(data or b''))
+    if sys.byteorder != 'little':
+        ids.byteswap()
+    return ids.tolist()
+
+
+def _is_stale(built_at):
+    return built_at is None or built_at < datetime.utcnow() - timedelta(seconds=REFRESH_SECONDS)
+
+
+def candidate_filters(user_id):
+    """Criteria on User for someone user_id can be shown"""
+    return (
+        User.id != user_id,
+        User.is_suspended == False,
+        User.deleted_at.is_(None),
+        ~exists().where(Block.blocker_id == user_id, Block.blocked_id == User.id),
+        ~exists().where(Block.blocker_id == User.id, Block.blocked_id == user_id),
+        ~exists().where(Match.user_id == user_id, Match.liked_user_id == User.id),
+        ~exists().where(Pass.user_id == user_id, Pass.passed_user_id == User.id)
+    )
+
+
+def build_queue(user_id, below_id=None):
+    """(Re)build a user's queue from the top, or continuing below an id (caller commits). Returns its size."""
+    query = db.session.query(User.id).filter(*candidate_filters(user_id))
+    if below_id is not None:
+        query = query.filter(User.id < below_id)
+    ids = [row[0] for row in query.order_by(User.id.desc()).limit(QUEUE_SIZE)]
+
+    values = {
+        'candidate_ids': _pack(ids),
+        'position': 0,
+        'cursor_id': ids[-1] if len(ids) == QUEUE_SIZE else None,
+        'built_at': datetime.utcnow()
+    }
+    # Concurrent first builds both insert - the loser overwrites the winner's row instead of failing
+    inserted = db.session.execute(
+        insert_ignoring_conflicts(DiscoveryQueue, [dict(values, user_id=user_id)], 'user_id')
+    ).rowcount
+    if not inserted:
+        db.session.execute(update(DiscoveryQueue).where(DiscoveryQueue.user_id == user_id).values(**values))
+    return len(ids)
+
+
+def _pop(user_id, count):
+    """Advance the queue by count; returns (popped ids, remaining, cursor_id, built_at), or None without a queue"""
+    queues = DiscoveryQueue.__table__
+    start = queues.c.position - count  # RETURNING sees the advanced position
+    row = db.session.execute(
+        update(queues).where(queues.c.user_id == user_id)
+        .values(position=queues.c.position + count)
+        .returning(
+            func.substr(queues.c.candidate_ids, start * ID_BYTES + 1, count * ID_BYTES).label('page'),
+            (func.length(queues.c.candidate_ids) // ID_BYTES - queues.c.position).label('remaining'),
+            queues.c.cursor_id,
+            queues.c.built_at
+        )
+    ).first()
+    if row is None:
+        return None
+    return _unpack(row.page), max(row.remaining, 0), row.cursor_id, row.built_at
+
+
+def pop_candidates(user_id, count):
+    """
+    Take the next page of the user's queue (caller commits), rebuilding it
+    when missing, stale or used up. Returns (candidate ids in queue order,
+    remaining in the queue); a page can come back short after re-checking.
+    """
+    popped = _pop(user_id, count)
+    if popped is None or _is_stale(popped[3]):
+        build_queue(user_id)
+        popped = _pop(user_id, count)
+    elif not popped[0]:
+        # Used up: continue below the last id built, or start over from the top
+        if build_queue(user_id, below_id=popped[2]) == 0 and popped[2] is not None:
+            build_queue(user_id)
+        popped = _pop(user_id, count)
+
+    ids, remaining = popped[0], popped[1]
+    if not ids:
+        return [], 0
+
+    # Drop anyone blocked, liked, passed, suspended or deleted since the build
+    still_valid = {row[0] for row in db.session.query(User.id).filter(
+        User.id.in_(ids), *candidate_filters(user_id)
+    )}
+    return [candidate_id for candidate_id in ids if candidate_id in still_valid], remaining
+
+
+def refresh_stale_queues(limit=None):
+    """Rebuild queues older than REFRESH_SECONDS, one commit each. Returns the number rebuilt."""
+    cutoff = datetime.utcnow() - timedelta(seconds=REFRESH_SECONDS)
+    query = db.session.query(DiscoveryQueue.user_id).filter(DiscoveryQueue.built_at < cutoff).order_by(DiscoveryQueue.built_at)
+    if limit:
+        query = query.limit(limit)
+
+    rebuilt = 0
+    for user_id in [row[0] for row in query]:
+        build_queue(user_id)
+        db.session.commit()
+        rebuilt += 1
+    return rebuilt
@@ -1,6 +1,11 @@
 from cryptography.fernet import Fernet
 from config import Config
 import hashlib
+import hmac
+import unicodedata
+
+# Longest n-gram stored in the name blind index
+NAME_INDEX_NGRAM_SIZE = 3
 
 class EncryptionService:
     """Service for encrypting and decrypting sensitive data"""
@@ -15,6 +20,13 @@ class EncryptionService:
             encryption_key = encryption_key.encode()
         
         self.cipher = Fernet(encryption_key)
+        
+        # Key for the name blind index (never the Fernet key itself)
+        name_index_key = Config.NAME_INDEX_KEY
+        if name_index_key:
+            self.name_index_key = name_index_key.encode() if isinstance(name_index_key, str) else name_index_key
+        else:
+            self.name_index_key = hashlib.sha256(b'name-index:' + encryption_key).digest()
     
     def encrypt(self, data: str) -> str:
         """Encrypt a string and return as base64 encoded string"""
@@ -40,6 +52,41 @@ class EncryptionService:
         # Use SHA256 for deterministic hashing
         return hashlib.sha256(email.encode()).hexdigest()
 
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        """Normalize a name for indexing: unicode-normalized, lowercase, single spaces"""
+        if not name:
+            return ''
+        return ' '.join(unicodedata.normalize('NFKC', name).lower().split())
+    
+    def _name_token(self, gram: str) -> str:
+        """Keyed HMAC of a single n-gram (truncated to 16 hex chars)"""
+        return hmac.new(self.name_index_key, gram.encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+    
+    def name_index_tokens(self, name: str) -> set:
+        """Create the blind-index tokens for a full name (all 1..3 character n-grams)"""
+        normalized = self.normalize_name(name)
+        grams = set()
+        for size in range(1, NAME_INDEX_NGRAM_SIZE + 1):
+            for i in range(len(normalized) - size + 1):
+                grams.add(normalized[i:i + size])
+        return {self._name_token(gram) for gram in grams}
+    
+    def name_query_tokens(self, query: str) -> set:
+        """
+        Create the tokens a name must contain to match a substring query.
+        Short queries map to a single n-gram; longer ones to all their trigrams.
+        """
+        normalized = self.normalize_name(query)
+        if not normalized:
+            return set()
+        if len(normalized) <= NAME_INDEX_NGRAM_SIZE:
+            return {self._name_token(normalized)}
+        return {
+            self._name_token(normalized[i:i + NAME_INDEX_NGRAM_SIZE])
+            for i in range(len(normalized) - NAME_INDEX_NGRAM_SIZE + 1)
+        }
+
 # Singleton instance
 encryption_service = EncryptionService()
 
@@ -0,0 +1,234 @@
+"""
+Publish/subscribe for domain events, across worker processes.
+
+Route handlers publish typed domain events (EVENT_FIELDS) after committing;
+consumers (event_handlers.py) push them to open chat streams and keep
+in-memory caches in step. Two backends, chosen with EVENT_BUS_BACKEND:
+
+- memory: events are delivered to this process's handlers right away, in
+  the publishing thread. For tests, development and a single worker.
+- postgres: events are sent with NOTIFY on CHANNEL, over one autocommit
+  connection per process kept for publishing. Every process runs a LISTEN
+  thread and delivers each event to its own handlers, including the
+  process that published it, so a write handled by one worker reaches
+  streams, caches and presence (users_active, typing) in all of them.
+
+Delivery is at most once: events published while a listener is reconnecting
+are lost, so consumers must only hold state that can be reloaded (clients
+resync, caches refresh).
+"""
+import json
+import select
+import threading
+import time
+from models import db
+
+CHANNEL = 'tree_matching_events'
+
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_BYTES = 7900
+
+# Listener wait per poll, and pause before reconnecting after an error
+LISTEN_POLL_SECONDS = 5
+LISTEN_RECONNECT_SECONDS = 3
+
+# Domain events and their required payload fields
+MESSAGE_SENT = 'message_sent'  # Optional 'message': the message dict, omitted when too large
+MESSAGES_READ = 'messages_read'
+TYPING = 'typing'
+CHAT_DELETED = 'chat_deleted'
+PROFILE_UPDATED = 'profile_updated'
+USER_BLOCKED = 'user_blocked'
+USER_UNBLOCKED = 'user_unblocked'
+USER_SUSPENDED = 'user_suspended'
+USER_UNSUSPENDED = 'user_unsuspended'
+USER_DELETED = 'user_deleted'
+USERS_ACTIVE = 'users_active'  # Users seen by the publishing process (see presence.py)
+
+EVENT_FIELDS = {
+    MESSAGE_SENT: ('chat_id', 'message_id', 'sender_id', 'recipient_id'),
+    MESSAGES_READ: ('chat_id', 'reader_id', 'other_user_id', 'last_read_message_id'),
+    TYPING: ('chat_id', 'user_id', 'recipient_id', 'typing'),
+    CHAT_DELETED: ('chat_id', 'user_ids'),
+    PROFILE_UPDATED: ('user_id',),
+    USER_BLOCKED: ('blocker_id', 'blocked_id'),
+    USER_UNBLOCKED: ('blocker_id', 'blocked_id'),
+    USER_SUSPENDED: ('user_id',),
+    USER_UNSUSPENDED: ('user_id',),
+    USER_DELETED: ('user_id',),
+    USERS_ACTIVE: ('user_ids',),
+}
+
+
+class InMemoryBackend:
+    """Delivers events to this process's handlers in the publishing thread"""
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def start(self, app):
+        pass
+
+    def publish(self, event_type, payload, compact):
+        self.bus.dispatch(event_type, payload)
+
+
+class PostgresBackend:
+    """NOTIFY on publish; a LISTEN thread per process delivers to that process's handlers"""
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.lock = threading.Lock()
+        self.thread = None
+        self.app = None
+        self.notify_lock = threading.Lock()
+        self.notify_connection = None  # Autocommit driver connection outside the pool, reused by every publish
+
+    def start(self, app):
+        with self.lock:
+            self.app = app
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._listen, name='event-bus-listener', daemon=True)
+                self.thread.start()
+
+    def publish(self, event_type, payload, compact):
+        message = json.dumps({'type': event_type, 'payload': payload}, default=str)
+        if len(message.encode('utf-8')) > MAX_NOTIFY_BYTES:
+            if compact is None:
+                raise ValueError(f"Event {event_type} is too large for NOTIFY")
+            message = json.dumps({'type': event_type, 'payload': compact}, default=str)
+
+        with self.notify_lock:
+            try:
+                self._notify(message)
+            except Exception:
+                # Stale connection (server restart, network) - reconnect once
+                self._close_notify_connection()
+                self._notify(message)
+
+    def _notify(self, message):
+        """NOTIFY on this process's publishing connection (the caller has committed; autocommit sends it right away)"""
+        if self.notify_connection is None:
+            with self.app.app_context():
+                connection = db.engine.raw_connection()
+            raw = connection.driver_connection  # Read before detach() drops the pool record that exposes it
+            connection.detach()  # Kept for the life of the process, outside the pool
+            raw.autocommit = True
+            self.notify_connection = raw
+        with self.notify_connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, message))
+
+    def _close_notify_connection(self):
+        if self.notify_connection is not None:
+            try:
+                self.notify_connection.close()
+            except Exception:
+                pass
+            self.notify_connection = None
+
+    def _listen(self):
+        while True:
+            connection = None
+            try:
+                with self.app.app_context():
+                    connection = db.engine.raw_connection()
+                raw = connection.driver_connection  # Read before detach() drops the pool record that exposes it
+                connection.detach()  # Never hand a LISTENing connection back to the pool
+                raw.autocommit = True
+                with raw.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+
+                while True:
+                    if select.select([raw], [], [], LISTEN_POLL_SECONDS) == ([], [], []):
+                        continue
+                    raw.poll()
+                    while raw.notifies:
+                        self._deliver(raw.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"[EVENTS] Listener error, reconnecting: {e}")
+                time.sleep(LISTEN_RECONNECT_SECONDS)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _deliver(self, message):
+        try:
+            event = json.loads(message)
+        except ValueError:
+            print(f"[EVENTS] Ignoring malformed notification: {message[:200]}")
+            return
+        with self.app.app_context():
+            try:
+                self.bus.dispatch(event['type'], event['payload'])
+            finally:
+                db.session.remove()
+
+
+BACKENDS = {
+    'memory': InMemoryBackend,
+    'postgres': PostgresBackend,
+}
+
+
+class EventBus:
+    """Typed domain events with pluggable delivery (see BACKENDS)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handlers = {}  # event type -> list of handlers
+        self.backend = InMemoryBackend(self)
+
+    def init_app(self, app):
+        """Pick and start the backend named by EVENT_BUS_BACKEND"""
+        name = app.config.get('EVENT_BUS_BACKEND', 'memory')
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown EVENT_BUS_BACKEND: {name}")
+        if not isinstance(self.backend, BACKENDS[name]):
+            self.backend = BACKENDS[name](self)
+        self.backend.start(app)
+
+    def subscribe(self, event_type, handler=None):
+        """Register handler(payload) for an event type; usable as a decorator"""
+        if event_type not in EVENT_FIELDS:
+            raise ValueError(f"Unknown event type: {event_type}")
+
+        def register(handler):
+            with self.lock:
+                handlers = self.handlers.setdefault(event_type, [])
+                if handler not in handlers:
+                    handlers.append(handler)
+            return handler
+
+        return register(handler) if handler is not None else register
+
+    def publish(self, event_type, payload, compact=None):
+        """
+        Publish an event (after committing the change it describes). compact is a
+        smaller payload to send instead when payload is too large for the backend.
+        """
+        fields = EVENT_FIELDS.get(event_type)
+        if fields is None:
+            raise ValueError(f"Unknown event type: {event_type}")
+        missing = [field for field in fields if field not in payload]
+        if missing:
+            raise ValueError(f"Event {event_type} is missing {', '.join(missing)}")
+
+        try:
+            self.backend.publish(event_type, payload, compact)
+        except Exception as e:
+            # The change is already committed - a lost event only delays streams and caches
+            print(f"[EVENTS] Could not publish {event_type}: {e}")
+
+    def dispatch(self, event_type, payload):
+        """Run this process's handlers for an event; a failing handler doesn't stop the others"""
+        with self.lock:
+            handlers = list(self.handlers.get(event_type, ()))
+        for handler in handlers:
+            try:
+                handler(payload)
+            except Exception as e:
+                print(f"[EVENTS] Handler {handler.__name__} failed for {event_type}: {e}")
+
+
+# Singleton instance (one per worker process)
+event_bus = EventBus()
@@ -0,0 +1,99 @@
+"""
+Consumers of domain events (see event_bus.py).
+
+Each process runs these for every event, whichever worker published it:
+they push to the chat streams open in this process and keep this process's
+in-memory state (presence, referral forest, block sets) in step. Imported
+once by app.py, which registers them.
+"""
+from models import Chat, Message
+from chat_events import chat_events
+from chat_state import get_unread_total
+from presence import presence
+from referral_graph import referral_forest
+from block_cache import block_cache
+from event_bus import (
+    event_bus, MESSAGE_SENT, MESSAGES_READ, TYPING, CHAT_DELETED, USER_BLOCKED, USER_UNBLOCKED,
+    USER_SUSPENDED, USER_DELETED, USERS_ACTIVE
+)
+
+
+def publish_unread_count(user_id):
+    """Push a user's total unread count to their open streams (skips the query if there are none)"""
+    if chat_events.is_connected(user_id):
+        chat_events.publish(user_id, 'unread_count', {'unread_count': get_unread_total(user_id)})
+
+
+@event_bus.subscribe(MESSAGE_SENT)
+def push_message(event):
+    participant_ids = (event['recipient_id'], event['sender_id'])
+    if not any(chat_events.is_connected(user_id) for user_id in participant_ids):
+        return
+
+    message_data = event.get('message')
+    if message_data is None:
+        # Published without the message (too large for the backend) - load it
+        message = Message.query.get(event['message_id'])
+        if message is None:
+            return
+        message_data = message.to_dict(Chat.query.get(message.chat_id))
+
+    # Both participants (the sender may have other tabs open)
+    for user_id in participant_ids:
+        chat_events.publish(user_id, 'message', message_data)
+    publish_unread_count(event['recipient_id'])
+
+
+@event_bus.subscribe(MESSAGES_READ)
+def push_read(event):
+    chat_events.publish(event['other_user_id'], 'read', {
+        'chat_id': event['chat_id'],
+        'reader_id': event['reader_id'],
+        'last_read_message_id': event['last_read_message_id']
+    })
+    publish_unread_count(event['reader_id'])
+
+
+@event_bus.subscribe(TYPING)
+def push_typing(event):
+    chat_events.publish(event['recipient_id'], 'typing', {
+        'chat_id': event['chat_id'],
+        'user_id': event['user_id'],
+        'typing': event['typing']
+    })
+
+
+@event_bus.subscribe(TYPING)
+def track_typing(event):
+    presence.record_typing(event['chat_id'], event['user_id'], event['typing'])
+
+
+@event_bus.subscribe(USERS_ACTIVE)
+def track_active_users(event):
+    presence.mark_seen(event['user_ids'])
+
+
+@event_bus.subscribe(CHAT_DELETED)
+def push_unread_after_chat_deleted(event):
+    for user_id in event['user_ids']:
+        publish_unread_count(user_id)
+
+
+@event_bus.subscribe(USER_BLOCKED)
+@event_bus.subscribe(USER_UNBLOCKED)
+def invalidate_block_sets(event):
+    block_cache.invalidate(event['blocker_id'], event['blocked_id'])
+
+
+@event_bus.subscribe(USER_SUSPENDED)
+@event_bus.subscribe(USER_DELETED)
+def disconnect_user(event):
+    """Take the user offline and close their streams (they can't reconnect while suspended)"""
+    presence.forget(event['user_id'])
+    chat_events.disconnect(event['user_id'])
+
+
+@event_bus.subscribe(USER_DELETED)
+def reload_referral_forest(event):
+    # The user's referrals were removed - rebuild this process's forest on next use
+    referral_forest.invalidate()
@@ -0,0 +1,131 @@
+"""
+Batched hydration of user data for list endpoints.
+
+List endpoints used to look up each row's user, referrer, decrypted name and
+image URL one by one (N+1 queries). These helpers take a whole page of ids
+and load everything in a fixed number of queries.
+"""
+from models import db, User, Referral
+from encryption import encryption_service
+from referral_index import get_connection_distances
+from presence import presence
+import cloudinary
+import os
+
+# Configure Cloudinary
+cloudinary.config(
+    cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+    api_key=os.getenv('CLOUDINARY_API_KEY'),
+    api_secret=os.getenv('CLOUDINARY_API_SECRET'),
+    secure=True
+)
+
+UNAVAILABLE_NAME = "שם לא זמין"
+
+def get_cloudinary_url(public_id):
+    """Convert Cloudinary public_id to full URL"""
+    if not public_id:
+        return None
+    if public_id.startswith('http'):
+        return public_id
+    return cloudinary.CloudinaryImage(public_id).build_url(
+        secure=True,
+        transformation=[
+            {'quality': 'auto:good'},
+            {'fetch_format': 'auto'}
+        ]
+    )
+
+
+def decrypt_name(full_name_encrypted):
+    """Decrypt a full name, falling back to a placeholder so one bad row doesn't fail a page"""
+    try:
+        return encryption_service.decrypt(full_name_encrypted)
+    except Exception as e:
+        print(f"[HYDRATION] Error decrypting name: {e}")
+        return UNAVAILABLE_NAME
+
+
+def _unique(ids):
+    """Drop None and duplicates, keep order"""
+    return list(dict.fromkeys(i for i in ids if i is not None))
+
+
+def get_user_summaries(user_ids):
+    """Get {user_id: {'id', 'name', 'profile_image'}} for a list of ids in one query"""
+    user_ids = _unique(user_ids)
+    if not user_ids:
+        return {}
+
+    rows = db.session.query(
+        User.id, User.full_name_encrypted, User.profile_image
+    ).filter(User.id.in_(user_ids)).all()
+
+    return {
+        row.id: {
+            'id': row.id,
+            'name': decrypt_name(row.full_name_encrypted),
+            'profile_image': get_cloudinary_url(row.profile_image)
+        }
+        for row in rows
+    }
+
+
+def get_referrer_summaries(user_ids):
+    """
+    Get {user_id: referrer summary} for a list of ids in one query.
+    Users without a referral row (roots) are missing from the result; users whose
+    referrer row no longer exists map to None.
+    """
+    user_ids = _unique(user_ids)
+    if not user_ids:
+        return {}
+
+    rows = db.session.query(
+        Referral.referred_id, Referral.referrer_id, User.full_name_encrypted, User.profile_image
+    ).outerjoin(User, User.id == Referral.referrer_id).filter(
+        Referral.referred_id.in_(user_ids)
+    ).all()
+
+    referrers = {}
+    for row in rows:
+        if row.full_name_encrypted is None:
+            referrers[row.referred_id] = None
+            continue
+        referrers[row.referred_id] = {
+            'id': row.referrer_id,
+            'name': decrypt_name(row.full_name_encrypted),
+            'profile_image': get_cloudinary_url(row.profile_image)
+        }
+    return referrers
+
+
+def hydrate_users(users, include_referrer=True, viewer_id=None):
+    """
+    Turn a page of User rows into response dicts: to_dict() plus decrypted
+    full_name, profile image URL, online (from memory, see presence.py),
+    (optionally) referred_by and, when viewer_id is given, connection_distance -
+    referral hops from the viewer.
+    Costs one extra query each for referrers and distances, regardless of page size.
+    """
+    user_ids = [user.id for user in users]
+    referrers = get_referrer_summaries(user_ids) if include_referrer else {}
+    distances = get_connection_distances(viewer_id, user_ids) if viewer_id is not None else None
+    online_ids = presence.online_user_ids(user_ids)
+
+    users_data = []
+    for user in users:
+        user_dict = user.to_dict()
+        user_dict['full_name'] = decrypt_name(user.full_name_encrypted)
+        user_dict['profile_image'] = get_cloudinary_url(user.profile_image)
+        user_dict['online'] = user.id in online_ids
+
+        referrer = referrers.get(user.id)
+        if referrer:
+            user_dict['referred_by'] = referrer
+
+        if distances is not None:
+            user_dict['connection_distance'] = distances.get(user.id)
+
+        users_data.append(user_dict)
+    return users_data
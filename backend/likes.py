@@ -0,0 +1,113 @@
+"""
+Atomic like/unlike with mutual-match detection, for one user or a batch.
+
+A like used to be a read for an existing row, an insert, a read for the
+reverse row and an update of both rows. Two users liking each other at the
+same moment could each miss the other's uncommitted row, leaving both
+likes with is_mutual = false.
+
+Now both directions of a pair are serialized with a transaction-level
+advisory lock on (smaller id, larger id) (PostgreSQL; SQLite serializes
+writers anyway). Batches take their locks in sorted order, so they cannot
+deadlock. After that, the likes are one INSERT ... ON CONFLICT DO NOTHING
+plus one conditional UPDATE that sets is_mutual on both rows of every
+pair where both exist and returns them. Because each statement starts a
+fresh snapshot after the locks are granted, the second of two concurrent
+likes always sees the first one.
+
+The callers commit (which releases the locks).
+"""
+from datetime import datetime
+from sqlalchemy import text, update, delete, exists, or_, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Match
+from message_partitions import is_postgres
+
+
+def insert_ignoring_conflicts(model, rows, *conflict_columns):
+    """INSERT rows ... ON CONFLICT (conflict_columns) DO NOTHING, for PostgreSQL or SQLite"""
+    dialect = postgresql if is_postgres() else sqlite
+    return dialect.insert(model).values(rows).on_conflict_do_nothing(index_elements=list(conflict_columns))
+
+
+def lock_pairs(user_id, other_user_ids):
+    """Advisory-lock the pairs (user_id, other) in sorted order; re-locking a held pair doesn't wait"""
+    if not is_postgres() or not other_user_ids:
+        return
+    pairs = sorted({(min(user_id, other_id), max(user_id, other_id)) for other_id in other_user_ids})
+    db.session.execute(text("""
+        SELECT pg_advisory_xact_lock(pair.low, pair.high)
+        FROM unnest(CAST(:lows AS integer[]), CAST(:highs AS integer[])) AS pair(low, high)
+    """), {'lows': [low for low, _ in pairs], 'highs': [high for _, high in pairs]})
+
+
+def like_many(user_id, liked_user_ids):
+    """
+    Record user_id liking each of liked_user_ids. Returns (created, mutual):
+    the ids that weren't liked before, and those of them that are now mutual.
+    """
+    liked_user_ids = list(dict.fromkeys(liked_user_ids))
+    if not liked_user_ids:
+        return set(), set()
+    lock_pairs(user_id, liked_user_ids)
+
+    now = datetime.utcnow()
+    created = set(db.session.execute(
+        insert_ignoring_conflicts(Match, [
+            {'user_id': user_id, 'liked_user_id': liked_user_id, 'is_mutual': False, 'created_at': now}
+            for liked_user_id in liked_user_ids
+        ], 'user_id', 'liked_user_id').returning(Match.liked_user_id)
+    ).scalars())
+    if not created:
+        return created, set()
+
+    matches = Match.__table__
+    reverse = matches.alias('reverse')
+    mutual_rows = db.session.execute(
+        update(matches).where(
+            or_(
+                and_(matches.c.user_id == user_id, matches.c.liked_user_id.in_(created)),
+                and_(matches.c.liked_user_id == user_id, matches.c.user_id.in_(created))
+            ),
+            exists().where(reverse.c.user_id == matches.c.liked_user_id, reverse.c.liked_user_id == matches.c.user_id)
+        ).values(is_mutual=True).returning(matches.c.user_id, matches.c.liked_user_id)
+    ).all()
+
+    return created, {row.liked_user_id for row in mutual_rows if row.user_id == user_id}
+
+
+def unlike_many(user_id, liked_user_ids):
+    """Remove user_id's likes of liked_user_ids and clear the reverse rows' mutual flags. Returns the ids unliked."""
+    liked_user_ids = list(dict.fromkeys(liked_user_ids))
+    if not liked_user_ids:
+        return set()
+    lock_pairs(user_id, liked_user_ids)
+
+    removed = db.session.execute(
+        delete(Match).where(Match.user_id == user_id, Match.liked_user_id.in_(liked_user_ids))
+        .returning(Match.liked_user_id, Match.is_mutual)
+    ).all()
+
+    was_mutual = [row.liked_user_id for row in removed if row.is_mutual]
+    if was_mutual:
+        db.session.execute(
+            update(Match).where(Match.user_id.in_(was_mutual), Match.liked_user_id == user_id)
+            .values(is_mutual=False)
+        )
+    return {row.liked_user_id for row in removed}
+
+
+def like(user_id, liked_user_id):
+    """
+    Record user_id liking liked_user_id. Returns (created, is_mutual);
+    created is False (and is_mutual None) when the like already existed.
+    """
+    created, mutual = like_many(user_id, [liked_user_id])
+    if not created:
+        return False, None
+    return True, liked_user_id in mutual
+
+
+def unlike(user_id, liked_user_id):
+    """Remove user_id's like of liked_user_id; returns whether a like was removed"""
+    return liked_user_id in unlike_many(user_id, [liked_user_id])
@@ -0,0 +1,178 @@
+"""
+Cold archive for old chat messages.
+
+Months older than MESSAGE_ARCHIVE_AFTER_MONTHS are moved out of the database
+into gzipped JSON-lines files under MESSAGE_ARCHIVE_DIR, one file per chat
+per month (YYYY-MM/<chat_id>-<first message id>.jsonl.gz), each recorded in
+message_archives. On PostgreSQL the month's partition is then dropped whole;
+elsewhere its rows are deleted.
+
+Scrolling back past the oldest message still in the database reads through
+to the chat's archive files, newest first, so clients see one continuous
+history.
+"""
+import gzip
+import json
+import os
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func
+from models import db, Message, MessageArchive
+from message_partitions import is_partitioned, list_partitions, drop_partition, month_start, add_months
+
+# Rows fetched per round trip while exporting / deleted per statement on unpartitioned tables
+BATCH_SIZE = 1000
+
+
+def _archive_dir():
+    return current_app.config['MESSAGE_ARCHIVE_DIR']
+
+
+def _row_to_dict(message):
+    return {
+        'id': message.id,
+        'chat_id': message.chat_id,
+        'sender_id': message.sender_id,
+        'content': message.content,
+        'sent_at': message.sent_at.isoformat() if message.sent_at else None,
+        'is_read': message.is_read
+    }
+
+
+def _dict_to_message(row):
+    """Transient (never added to the session) Message for an archived row, so to_dict() works as usual"""
+    return Message(
+        id=row['id'],
+        chat_id=row['chat_id'],
+        sender_id=row['sender_id'],
+        content=row['content'],
+        sent_at=datetime.fromisoformat(row['sent_at']) if row['sent_at'] else None,
+        is_read=row['is_read']
+    )
+
+
+def _write_chat_file(month, chat_id, rows):
+    relative_path = os.path.join(f"{month:%Y-%m}", f"{chat_id}-{rows[0]['id']}.jsonl.gz")
+    path = os.path.join(_archive_dir(), relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, 'wt', encoding='utf-8') as archive_file:
+        for row in rows:
+            archive_file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    db.session.add(MessageArchive(
+        chat_id=chat_id,
+        month=f"{month:%Y-%m}",
+        min_message_id=rows[0]['id'],
+        max_message_id=rows[-1]['id'],
+        message_count=len(rows),
+        path=relative_path
+    ))
+
+
+def archive_month(month):
+    """
+    Export one month of messages to archive files and remove it from the
+    database (commits). Returns the number of messages archived.
+    """
+    start, end = month_start(month), add_months(month, 1)
+    in_month = (Message.sent_at >= start, Message.sent_at < end)
+
+    # Ordered by chat so each chat's rows are written as one file
+    archived = 0
+    chat_id, rows = None, []
+    query = Message.query.filter(*in_month).order_by(Message.chat_id, Message.id)
+    for message in query.yield_per(BATCH_SIZE):
+        if message.chat_id != chat_id and rows:
+            _write_chat_file(start, chat_id, rows)
+            archived += len(rows)
+            rows = []
+        chat_id = message.chat_id
+        rows.append(_row_to_dict(message))
+    if rows:
+        _write_chat_file(start, chat_id, rows)
+        archived += len(rows)
+
+    partition = next((name for name, partition_month in list_partitions() if partition_month == start), None) \
+        if is_partitioned() else None
+    if partition:
+        drop_partition(partition)
+    else:
+        while Message.query.filter(
+            Message.id.in_(db.session.query(Message.id).filter(*in_month).limit(BATCH_SIZE))
+        ).delete(synchronize_session=False):
+            pass
+
+    db.session.commit()
+    return archived
+
+
+def months_to_archive():
+    """Month starts older than the retention window that still hold messages"""
+    cutoff = add_months(datetime.utcnow(), -current_app.config['MESSAGE_ARCHIVE_AFTER_MONTHS'])
+    if is_partitioned():
+        return [month for _, month in list_partitions() if month < cutoff]
+
+    oldest = db.session.query(func.min(Message.sent_at)).scalar()
+    months = []
+    month = month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def _read_file(relative_path):
+    try:
+        with gzip.open(os.path.join(_archive_dir(), relative_path), 'rt', encoding='utf-8') as archive_file:
+            return [json.loads(line) for line in archive_file]
+    except FileNotFoundError:
+        print(f"[ARCHIVE] Missing archive file: {relative_path}")
+        return []
+
+
+def read_archived_messages(chat_id, before_id, limit):
+    """
+    Read-through for scroll-back: up to `limit` archived messages of a chat
+    with id < before_id, oldest first, as transient Message objects.
+    Returns (messages, has_more).
+    """
+    archives = MessageArchive.query.filter(
+        MessageArchive.chat_id == chat_id,
+        MessageArchive.min_message_id < before_id
+    ).order_by(MessageArchive.max_message_id.desc())
+
+    if limit <= 0:
+        return [], db.session.query(archives.exists()).scalar()
+
+    rows = []
+    for archive in archives:
+        older = [row for row in _read_file(archive.path) if row['id'] < before_id]
+        rows = older + rows
+        if len(rows) > limit:
+            break
+
+    has_more = len(rows) > limit
+    return [_dict_to_message(row) for row in rows[-limit:]], has_more
+
+
+def delete_chat_archives(chat_ids):
+    """Delete the archive rows of chats (in the caller's transaction); returns their file paths for remove_archive_files"""
+    if not chat_ids:
+        return []
+    archives = MessageArchive.query.filter(MessageArchive.chat_id.in_(chat_ids))
+    paths = [archive.path for archive in archives]
+    archives.delete(synchronize_session=False)
+    return paths
+
+
+def remove_archive_files(paths):
+    """Remove archive files after the transaction that deleted their rows has committed"""
+    for relative_path in paths:
+        try:
+            os.remove(os.path.join(_archive_dir(), relative_path))
+        except FileNotFoundError:
+            pass
+
+
+def count_archived_messages():
+    return db.session.query(func.coalesce(func.sum(MessageArchive.message_count), 0)).scalar()
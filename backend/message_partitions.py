@@ -0,0 +1,180 @@
+"""
+Monthly range partitioning of the messages table on sent_at (PostgreSQL only).
+
+Partitions are named messages_yYYYYmMM and cover one calendar month each;
+a default partition catches anything outside them. Recent months stay hot
+while old ones can be detached and archived whole (see message_archive.py).
+On other databases (SQLite in development) messages stays a plain table and
+these helpers do nothing.
+"""
+from datetime import datetime
+from sqlalchemy import text
+from models import db
+
+# Partitions are created this many months ahead of the current month
+MONTHS_AHEAD = 2
+
+MESSAGE_COLUMNS = 'id, chat_id, sender_id, content, sent_at, is_read'
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def is_partitioned():
+    """Whether messages is a partitioned table"""
+    if not is_postgres():
+        return False
+    relkind = db.session.execute(text(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass('messages')"
+    )).scalar()
+    return relkind == 'p'
+
+
+def month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+
+def add_months(dt, months):
+    """First day of the month `months` after dt's month"""
+    index = dt.year * 12 + dt.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"messages_y{month.year:04d}m{month.month:02d}"
+
+
+def _create_partition(month, table='messages'):
+    db.session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    ))
+
+
+def _months_in_default():
+    """Month starts of the rows that landed in messages_default"""
+    months = db.session.execute(text(
+        "SELECT DISTINCT date_trunc('month', sent_at) FROM messages_default"
+    )).scalars().all()
+    return [month_start(month) for month in months if month is not None]
+
+
+def _split_from_default(month):
+    """
+    Create the partition of a month whose rows are already in messages_default.
+    PostgreSQL refuses CREATE ... PARTITION OF while the default partition
+    holds rows of the new range, so the default partition is detached, the
+    month created, its rows moved over and the default reattached - one
+    transaction that locks messages while the rows move.
+    """
+    name = partition_name(month)
+    bounds = {'start': month, 'end': add_months(month, 1)}
+    db.session.execute(text("ALTER TABLE messages DETACH PARTITION messages_default"))
+    _create_partition(month)
+    db.session.execute(text(f"""
+        INSERT INTO {name} ({MESSAGE_COLUMNS})
+        SELECT {MESSAGE_COLUMNS} FROM messages_default WHERE sent_at >= :start AND sent_at < :end
+    """), bounds)
+    db.session.execute(text("DELETE FROM messages_default WHERE sent_at >= :start AND sent_at < :end"), bounds)
+    db.session.execute(text("ALTER TABLE messages ATTACH PARTITION messages_default DEFAULT"))
+
+
+def ensure_partitions():
+    """
+    Create the monthly partitions of messages from this month to MONTHS_AHEAD
+    months ahead, plus earlier months whose rows landed in messages_default
+    (e.g. after the cron stopped for a while), moving those rows over.
+    Each month is committed on its own so one failure doesn't hold back the
+    rest. Returns the names of the partitions that could not be created.
+    """
+    db.session.execute(text("CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT"))
+    db.session.commit()
+
+    existing = {name for name, _ in list_partitions()}
+    in_default = set(_months_in_default())
+    months = set(in_default)
+    month, last = month_start(datetime.utcnow()), add_months(datetime.utcnow(), MONTHS_AHEAD)
+    while month <= last:
+        months.add(month)
+        month = add_months(month, 1)
+
+    failed = []
+    for month in sorted(months):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        try:
+            if month in in_default:
+                _split_from_default(month)
+            else:
+                _create_partition(month)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[PARTITIONS] Creating {name} failed: {e}")
+            failed.append(name)
+    return failed
+
+
+def list_partitions():
+    """[(partition name, month start)] of the monthly partitions, oldest first"""
+    names = db.session.execute(text("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass('messages')
+    """)).scalars().all()
+
+    partitions = []
+    for name in names:
+        try:
+            partitions.append((name, datetime.strptime(name, 'messages_y%Ym%m')))
+        except ValueError:
+            continue  # messages_default
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def drop_partition(name):
+    """Detach and drop one monthly partition (after its rows are archived)"""
+    db.session.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+    db.session.execute(text(f"DROP TABLE {name}"))
+
+
+def convert_to_partitioned():
+    """
+    Rebuild messages as a partitioned table, copying all rows. Ids and their
+    sequence are kept. Locks the table for the duration - run when idle.
+    Returns the number of rows copied.
+    """
+    sequence = db.session.execute(text("SELECT pg_get_serial_sequence('messages', 'id')")).scalar()
+    oldest = db.session.execute(text("SELECT MIN(sent_at) FROM messages")).scalar()
+
+    db.session.execute(text(f"""
+        CREATE TABLE messages_partitioned (
+            id INTEGER NOT NULL DEFAULT nextval('{sequence}'),
+            chat_id INTEGER NOT NULL REFERENCES chats(id),
+            sender_id INTEGER NOT NULL REFERENCES users(id),
+            content TEXT NOT NULL,
+            sent_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            is_read BOOLEAN DEFAULT FALSE,
+            PRIMARY KEY (id, sent_at)
+        ) PARTITION BY RANGE (sent_at)
+    """))
+    month, last = month_start(oldest or datetime.utcnow()), add_months(datetime.utcnow(), MONTHS_AHEAD)
+    while month <= last:
+        _create_partition(month, table='messages_partitioned')
+        month = add_months(month, 1)
+    db.session.execute(text("CREATE TABLE messages_default PARTITION OF messages_partitioned DEFAULT"))
+
+    copied = db.session.execute(text(f"""
+        INSERT INTO messages_partitioned ({MESSAGE_COLUMNS})
+        SELECT id, chat_id, sender_id, content, COALESCE(sent_at, now() AT TIME ZONE 'utc'), is_read
+        FROM messages
+    """)).rowcount
+
+    # Keep the id sequence alive when the old table goes away
+    db.session.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY messages_partitioned.id"))
+    db.session.execute(text("DROP TABLE messages"))
+    db.session.execute(text("ALTER TABLE messages_partitioned RENAME TO messages"))
+    db.session.execute(text("CREATE INDEX idx_messages_chat_id_id ON messages(chat_id, id)"))
+    return copied
@@ -0,0 +1,97 @@
+"""
+Full-text search over a user's own chat history.
+
+On PostgreSQL messages are matched with to_tsvector('simple', content),
+served by a GIN index (see ensure_search_index). The 'simple' configuration
+lowercases and splits on word boundaries without language-specific stemming,
+which suits Hebrew; query terms match as prefixes so partial words (and
+words with a suffix) are found. Other databases (SQLite in development) fall
+back to a LIKE scan.
+
+Only messages still in the database are searched - archived months are not.
+"""
+import re
+from sqlalchemy import text, func, and_, or_
+from models import db, Chat, Message
+from message_partitions import is_postgres
+
+TS_CONFIG = 'simple'
+
+# Query terms beyond this are ignored
+MAX_TERMS = 8
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def query_terms(query):
+    """Lowercased words of a search query (letters/digits only, so they are safe in a tsquery)"""
+    return list(dict.fromkeys(word.lower() for word in WORD.findall(query or '')))[:MAX_TERMS]
+
+
+def ensure_search_index():
+    """
+    Create the full-text index (PostgreSQL only). Prefers a (chat_id, tsvector)
+    GIN index via btree_gin so the per-user chat filter is applied inside the
+    index; falls back to a tsvector-only GIN index without the extension.
+    """
+    if not is_postgres():
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gin"))
+            db.session.execute(text(f"""
+                CREATE INDEX IF NOT EXISTS idx_messages_chat_content_fts
+                ON messages USING GIN (chat_id, to_tsvector('{TS_CONFIG}', content))
+            """))
+    except Exception as e:
+        print(f"[SEARCH] btree_gin unavailable, using a content-only index: {e}")
+        db.session.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_messages_content_fts
+            ON messages USING GIN (to_tsvector('{TS_CONFIG}', content))
+        """))
+
+
+def search_messages(user_id, terms, before_id=None, limit=20):
+    """
+    Messages in the user's (non-deleted) chats matching every term, newest first,
+    with id < before_id. Returns up to limit + 1 rows so callers can tell if there is more.
+    """
+    chat_ids = db.session.query(Chat.id).filter(
+        or_(Chat.user1_id == user_id, Chat.user2_id == user_id),
+        Chat.deleted_at.is_(None)
+    )
+
+    query = Message.query.filter(Message.chat_id.in_(chat_ids))
+    if is_postgres():
+        tsquery = ' & '.join(f"{term}:*" for term in terms)
+        query = query.filter(
+            func.to_tsvector(TS_CONFIG, Message.content).op('@@')(func.to_tsquery(TS_CONFIG, tsquery))
+        )
+    else:
+        query = query.filter(and_(*[Message.content.ilike(f"%{term}%") for term in terms]))
+
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+
+    return query.order_by(Message.id.desc()).limit(limit + 1).all()
+
+
+def highlight(content, terms):
+    """
+    Split content into [{'text', 'match'}] segments, marking words that start
+    with one of the terms. Returned as data (not HTML) so clients render it safely.
+    """
+    if not terms:
+        return [{'text': content, 'match': False}]
+
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(term) for term in terms) + r')\w*', re.IGNORECASE)
+    segments = []
+    position = 0
+    for found in pattern.finditer(content):
+        if found.start() > position:
+            segments.append({'text': content[position:found.start()], 'match': False})
+        segments.append({'text': found.group(0), 'match': True})
+        position = found.end()
+    if position < len(content):
+        segments.append({'text': content[position:], 'match': False})
+    return segments
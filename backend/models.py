@@ -34,6 +34,14 @@ class User(db.Model):
     bio = db.Column(db.Text, nullable=True)  # Open text field
     profile_image = db.Column(db.String(500), nullable=True)  # URL or path
     is_suspended = db.Column(db.Boolean, default=False, nullable=False)  # Suspended users cannot login
+    deleted_at = db.Column(db.DateTime, nullable=True)  # Tombstone - hidden while a deletion job removes the user's data
+    
+    # Referral tree counters (maintained with the referral closure index)
+    direct_referrals = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    subtree_size = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    
+    # Unread messages across all chats (sum of the user's per-chat unread counts, see chat_state.py)
+    unread_messages_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
     
     # Referral code for this user (for others to register through them)
     referral_code = db.Column(db.String(20), unique=True, nullable=False)
@@ -97,12 +105,26 @@ class User(db.Model):
         return data
 
 
+class UserNameToken(db.Model):
+    """Blind index for name search - keyed HMAC tokens of full name n-grams"""
+    __tablename__ = 'user_name_tokens'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    token = db.Column(db.String(16), nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'token', name='unique_user_name_token'),
+        db.Index('idx_user_name_tokens_token', 'token', 'user_id'),
+    )
+
+
 class Referral(db.Model):
     """Referral model - tracks who referred whom (tree structure)"""
     __tablename__ = 'referrals'
     
     id = db.Column(db.Integer, primary_key=True)
-    referrer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    referrer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     referred_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
     referral_code_used = db.Column(db.String(20), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -117,6 +139,22 @@ class Referral(db.Model):
         }
 
 
+class ReferralClosure(db.Model):
+    """Closure table for the referral tree - one row per (ancestor, descendant) pair, including self"""
+    __tablename__ = 'referral_closure'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    depth = db.Column(db.Integer, nullable=False)  # 0 for the self row, 1 for direct referrals, ...
+    
+    __table_args__ = (
+        db.UniqueConstraint('ancestor_id', 'descendant_id', name='unique_referral_closure'),
+        db.Index('idx_referral_closure_ancestor', 'ancestor_id', 'depth'),
+        db.Index('idx_referral_closure_descendant', 'descendant_id', 'depth'),
+    )
+
+
 class Chat(db.Model):
     """Chat model - represents a conversation between two users"""
     __tablename__ = 'chats'
@@ -127,6 +165,20 @@ class Chat(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Denormalized last message and per-participant unread counts (see chat_state.py)
+    last_message_id = db.Column(db.Integer, nullable=True)
+    last_message_sender_id = db.Column(db.Integer, nullable=True)
+    last_message_preview = db.Column(db.String(200), nullable=True)
+    user1_unread_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    user2_unread_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    
+    # Read watermarks: id of the last message each participant has read
+    user1_last_read_message_id = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    user2_last_read_message_id = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    
+    # Tombstone - hidden while a deletion job removes the chat's messages
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    
     # Relationships
     messages = db.relationship('Message', backref='chat', lazy='dynamic', 
                               order_by='Message.sent_at.desc()')
@@ -134,11 +186,24 @@ class Chat(db.Model):
     # Ensure unique chat between two users
     __table_args__ = (
         db.UniqueConstraint('user1_id', 'user2_id', name='unique_chat'),
+        db.Index('idx_chats_user1_last_message', 'user1_id', 'last_message_at'),
+        db.Index('idx_chats_user2_last_message', 'user2_id', 'last_message_at'),
     )
     
+    def unread_count_for(self, user_id):
+        """Unread messages in this chat for one of its participants"""
+        return self.user1_unread_count if user_id == self.user1_id else self.user2_unread_count
+    
+    def last_read_message_id_for(self, user_id):
+        """Read watermark of one of the participants"""
+        return self.user1_last_read_message_id if user_id == self.user1_id else self.user2_last_read_message_id
+    
+    def is_message_read(self, message_id, sender_id):
+        """Whether the recipient of a message (the participant who didn't send it) has read it"""
+        recipient_id = self.user1_id if sender_id == self.user2_id else self.user2_id
+        return message_id <= self.last_read_message_id_for(recipient_id)
+    
     def to_dict(self, current_user_id=None):
-        last_message = self.messages.first()
-        
         # Ensure UTC timezone is indicated in ISO format
         def format_datetime(dt):
             if dt is None:
@@ -147,14 +212,29 @@ class Chat(db.Model):
                 return dt.isoformat() + 'Z'
             return dt.isoformat()
         
+        other_user_id = self.user2_id if current_user_id == self.user1_id else self.user1_id
+        
+        # Last message is built from the denormalized columns - no query
+        last_message = None
+        if self.last_message_id:
+            last_message = {
+                'id': self.last_message_id,
+                'chat_id': self.id,
+                'sender_id': self.last_message_sender_id,
+                'content': self.last_message_preview,
+                'sent_at': format_datetime(self.last_message_at),
+                'is_read': self.is_message_read(self.last_message_id, self.last_message_sender_id)
+            }
+        
         return {
             'id': self.id,
             'user1_id': self.user1_id,
             'user2_id': self.user2_id,
-            'other_user_id': self.user2_id if current_user_id == self.user1_id else self.user1_id,
+            'other_user_id': other_user_id,
             'created_at': format_datetime(self.created_at),
             'last_message_at': format_datetime(self.last_message_at),
-            'last_message': last_message.to_dict() if last_message else None
+            'last_message': last_message,
+            'unread_count': self.unread_count_for(current_user_id) if current_user_id else None
         }
 
 
@@ -167,9 +247,15 @@ class Message(db.Model):
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     sent_at = db.Column(db.DateTime, default=datetime.utcnow)
-    is_read = db.Column(db.Boolean, default=False)
+    is_read = db.Column(db.Boolean, default=False)  # Legacy - read state now comes from the chat's watermarks
     
-    def to_dict(self):
+    # Keyset reads of a chat's messages (after_id / before_id)
+    __table_args__ = (
+        db.Index('idx_messages_chat_id_id', 'chat_id', 'id'),
+    )
+    
+    def to_dict(self, chat=None):
+        """Pass the message's chat to derive is_read from its read watermarks"""
         # Ensure UTC timezone is indicated in ISO format
         sent_at_iso = None
         if self.sent_at:
@@ -185,10 +271,72 @@ class Message(db.Model):
             'sender_id': self.sender_id,
             'content': self.content,
             'sent_at': sent_at_iso,
-            'is_read': self.is_read
+            'is_read': chat.is_message_read(self.id, self.sender_id) if chat else self.is_read
+        }
+
+
+class DeletionJob(db.Model):
+    """Background deletion of a chat or user, processed in chunks (see deletion_jobs.py)"""
+    __tablename__ = 'deletion_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'chat' or 'user'
+    target_id = db.Column(db.Integer, nullable=False)
+    requested_by = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    deleted_rows = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('idx_deletion_jobs_status', 'status', 'id'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'target_id': self.target_id,
+            'status': self.status,
+            'deleted_rows': self.deleted_rows,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
         }
 
 
+class MessageArchive(db.Model):
+    """One archived file of old messages: a chat's messages from one month (see message_archive.py)"""
+    __tablename__ = 'message_archives'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, nullable=False)  # No FK - archive rows are removed together with their chat
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    min_message_id = db.Column(db.Integer, nullable=False)
+    max_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    path = db.Column(db.String(500), nullable=False)  # Relative to MESSAGE_ARCHIVE_DIR
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_message_archives_chat', 'chat_id', 'max_message_id'),
+    )
+
+
+class DiscoveryQueue(db.Model):
+    """A user's precomputed discovery candidates, popped a page at a time (see discovery.py)"""
+    __tablename__ = 'discovery_queues'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    candidate_ids = db.Column(db.LargeBinary, nullable=False)  # Packed little-endian int32 user ids
+    position = db.Column(db.Integer, nullable=False, default=0)  # Candidates already handed out
+    cursor_id = db.Column(db.Integer, nullable=True)  # Next build continues below this id (None: from the top)
+    built_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class Match(db.Model):
     """Match model - tracks likes/matches between users"""
     __tablename__ = 'matches'
@@ -202,6 +350,7 @@ class Match(db.Model):
     # Ensure a user can only like another user once
     __table_args__ = (
         db.UniqueConstraint('user_id', 'liked_user_id', name='unique_match'),
+        db.Index('idx_matches_user_mutual_created', 'user_id', 'is_mutual', 'created_at'),
     )
     
     def to_dict(self):
@@ -214,6 +363,29 @@ class Match(db.Model):
         }
 
 
+class Pass(db.Model):
+    """Pass model - users skipped while browsing (not liked, but not blocked either)"""
+    __tablename__ = 'passes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)  # User who passed
+    passed_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)  # User who was passed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Ensure a user can only pass another user once
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'passed_user_id', name='unique_pass'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'passed_user_id': self.passed_user_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
 class Block(db.Model):
     """Block model - tracks blocked users (unlike/block)"""
     __tablename__ = 'blocks'
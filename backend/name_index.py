@@ -0,0 +1,71 @@
+"""
+Blind index for searching users by (encrypted) full name.
+
+Names are stored encrypted, so they cannot be searched in SQL directly.
+Instead every user gets a set of keyed HMAC tokens of the n-grams of their
+normalized name, and a search becomes an indexed lookup on those tokens.
+
+Queries of up to NAME_INDEX_NGRAM_SIZE characters are a single token, so the
+lookup is exact. Longer queries match every name holding all their trigrams,
+in any order ("abcab" finds "cabxabcx"), so filter_users_by_name decrypts
+just those candidates and keeps the names that really contain the query.
+"""
+from sqlalchemy import select, func, false
+from models import db, User, UserNameToken
+from encryption import encryption_service, NAME_INDEX_NGRAM_SIZE
+
+
+def update_name_index(user_id, full_name):
+    """Replace the name tokens of a user (call inside the transaction that sets the name)"""
+    UserNameToken.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
+    tokens = encryption_service.name_index_tokens(full_name)
+    if tokens:
+        db.session.execute(
+            UserNameToken.__table__.insert(),
+            [{'user_id': user_id, 'token': token} for token in tokens]
+        )
+
+
+def name_match_user_ids(name):
+    """
+    Build a SELECT of user ids whose name may contain `name` (case-insensitive):
+    exact up to NAME_INDEX_NGRAM_SIZE characters, a superset for longer names.
+    Use filter_users_by_name for an exact match.
+    """
+    tokens = encryption_service.name_query_tokens(name)
+    if not tokens:
+        return select(UserNameToken.user_id).where(false())
+
+    return (
+        select(UserNameToken.user_id)
+        .where(UserNameToken.token.in_(tokens))
+        .group_by(UserNameToken.user_id)
+        .having(func.count(UserNameToken.token) == len(tokens))
+    )
+
+
+def _name_contains(full_name_encrypted, normalized_query):
+    try:
+        full_name = encryption_service.decrypt(full_name_encrypted)
+    except Exception as e:
+        print(f"[NAME INDEX] Error decrypting name: {e}")
+        return False
+    return normalized_query in encryption_service.normalize_name(full_name)
+
+
+def filter_users_by_name(users_query, name):
+    """
+    Narrow a User query to users whose name contains `name` (case-insensitive).
+    Apply it after the other filters: for queries longer than
+    NAME_INDEX_NGRAM_SIZE, the remaining candidates' names are decrypted and
+    re-checked, so the result (and a count of it) is exact.
+    """
+    users_query = users_query.filter(User.id.in_(name_match_user_ids(name)))
+    normalized = encryption_service.normalize_name(name)
+    if len(normalized) <= NAME_INDEX_NGRAM_SIZE:
+        return users_query
+
+    candidates = users_query.order_by(None).with_entities(User.id, User.full_name_encrypted).all()
+    matching_ids = [row.id for row in candidates if _name_contains(row.full_name_encrypted, normalized)]
+    return users_query.filter(User.id.in_(matching_ids))
@@ -0,0 +1,31 @@
+"""
+Convert the messages table to monthly partitions (PostgreSQL only)
+Run once, while the app is idle - the table is locked while rows are copied.
+Empty tables are converted automatically at startup.
+"""
+from app import create_app
+from models import db
+from message_partitions import is_postgres, is_partitioned, convert_to_partitioned
+
+def partition_messages():
+    app = create_app()
+    
+    with app.app_context():
+        if not is_postgres():
+            print("ℹ️  Partitioning needs PostgreSQL - nothing to do")
+            return
+        if is_partitioned():
+            print("ℹ️  messages is already partitioned")
+            return
+        
+        print("Converting messages to a partitioned table...")
+        try:
+            copied = convert_to_partitioned()
+            db.session.commit()
+            print(f"✅ messages partitioned by month ({copied} rows copied)")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Conversion failed: {e}")
+
+if __name__ == '__main__':
+    partition_messages()
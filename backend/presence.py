@@ -0,0 +1,184 @@
+"""
+In-memory presence: who is online, who is typing, and when users were last active.
+
+Every authenticated request (and every open chat stream, on each heartbeat)
+touches the user's entry. A user is online while their entry is younger than
+ONLINE_TTL. Typing entries are per chat and expire after TYPING_TTL.
+
+Nothing is written per touch. users.last_active is updated by a flusher
+thread every FLUSH_INTERVAL seconds, in one batched UPDATE for all users
+touched since the last flush.
+
+The state lives in each worker process. To keep it the same in all of them
+(EVENT_BUS_BACKEND=postgres), the same thread publishes the users touched
+here as users_active events every BROADCAST_INTERVAL seconds, in chunks of
+BROADCAST_CHUNK ids, and typing changes go out as typing events; every
+process applies both (see event_handlers.py). A user active on another
+worker therefore shows as online here at most BROADCAST_INTERVAL seconds late.
+"""
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import update, bindparam
+from models import db, User
+from event_bus import event_bus, USERS_ACTIVE
+
+# A user counts as online this long after their last request or stream heartbeat
+ONLINE_TTL = 60
+
+# A typing indicator lasts this long unless refreshed
+TYPING_TTL = 6
+
+# Minimum gap between 'typing' events published for the same user and chat
+TYPING_REPUBLISH = 2
+
+# How often last_active is written to the database
+FLUSH_INTERVAL = 30
+
+# How often the users touched here are announced to the other processes, and ids per event
+BROADCAST_INTERVAL = 10
+BROADCAST_CHUNK = 500
+
+
+class PresenceService:
+    """TTL-expiring presence and typing state, with batched last_active writes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = {}  # user_id -> monotonic time of last activity
+        self.typing = {}  # (chat_id, user_id) -> monotonic time the indicator was last published
+        self.pending = {}  # user_id -> last activity (UTC) not yet written to users.last_active
+        self.unannounced = set()  # Users touched here since the last users_active broadcast
+        self.thread = None
+        self.app = None
+
+    def init_app(self, app):
+        """Remember the app for the flusher thread (started on the first touch)"""
+        self.app = app
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.app is None or (self.thread is not None and self.thread.is_alive()):
+                return
+            self.thread = threading.Thread(target=self._run, name='presence-flush', daemon=True)
+            self.thread.start()
+
+    def touch(self, user_id):
+        """Record activity for a user (memory only)"""
+        if user_id is None:
+            return
+        with self.lock:
+            self.seen[user_id] = time.monotonic()
+            self.pending[user_id] = datetime.utcnow()
+            self.unannounced.add(user_id)
+        if self.thread is None:
+            self._ensure_started()
+
+    def mark_seen(self, user_ids):
+        """Record activity announced by another process (or this one)"""
+        now = time.monotonic()
+        with self.lock:
+            for user_id in user_ids:
+                self.seen[user_id] = now
+
+    def is_online(self, user_id):
+        with self.lock:
+            last_seen = self.seen.get(user_id)
+        return last_seen is not None and time.monotonic() - last_seen < ONLINE_TTL
+
+    def online_user_ids(self, user_ids):
+        """The subset of user_ids that are online"""
+        cutoff = time.monotonic() - ONLINE_TTL
+        with self.lock:
+            return {user_id for user_id in user_ids if self.seen.get(user_id, cutoff) > cutoff}
+
+    def start_typing(self, chat_id, user_id):
+        """
+        Mark a user as typing in a chat. Returns True when a 'typing' event
+        should be published (not already published in the last TYPING_REPUBLISH seconds).
+        """
+        now = time.monotonic()
+        with self.lock:
+            published = self.typing.get((chat_id, user_id))
+            if published is not None and now - published < TYPING_REPUBLISH:
+                return False
+            self.typing[(chat_id, user_id)] = now
+            return True
+
+    def stop_typing(self, chat_id, user_id):
+        """Clear a typing indicator; returns True if one was active"""
+        with self.lock:
+            published = self.typing.pop((chat_id, user_id), None)
+        return published is not None and time.monotonic() - published < TYPING_TTL
+
+    def record_typing(self, chat_id, user_id, typing):
+        """Apply a typing event published by any process"""
+        with self.lock:
+            if typing:
+                self.typing[(chat_id, user_id)] = time.monotonic()
+            else:
+                self.typing.pop((chat_id, user_id), None)
+
+    def forget(self, user_id):
+        """Take a user offline right away (suspended or deleted)"""
+        with self.lock:
+            self.seen.pop(user_id, None)
+            self.unannounced.discard(user_id)
+            self.typing = {key: t for key, t in self.typing.items() if key[1] != user_id}
+
+    def _expire(self):
+        now = time.monotonic()
+        with self.lock:
+            self.seen = {user_id: t for user_id, t in self.seen.items() if now - t < ONLINE_TTL}
+            self.typing = {key: t for key, t in self.typing.items() if now - t < TYPING_TTL}
+
+    def flush(self):
+        """Write pending last_active values in one batched UPDATE (needs an app context). Returns the number of users."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+
+        try:
+            # Core executemany: users deleted in the meantime simply match no row
+            users = User.__table__
+            db.session.execute(
+                update(users).where(users.c.id == bindparam('user_id')).values(last_active=bindparam('last_active')),
+                [{'user_id': user_id, 'last_active': last_active} for user_id, last_active in pending.items()]
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Keep the values for the next attempt, unless newer activity arrived meanwhile
+            with self.lock:
+                for user_id, last_active in pending.items():
+                    self.pending.setdefault(user_id, last_active)
+            raise
+        return len(pending)
+
+    def broadcast(self):
+        """Publish the users touched here since the last broadcast (needs an app context)"""
+        with self.lock:
+            user_ids, self.unannounced = sorted(self.unannounced), set()
+        for start in range(0, len(user_ids), BROADCAST_CHUNK):
+            event_bus.publish(USERS_ACTIVE, {'user_ids': user_ids[start:start + BROADCAST_CHUNK]})
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            time.sleep(BROADCAST_INTERVAL)
+            with self.app.app_context():
+                try:
+                    self.broadcast()
+                    if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                        last_flush = time.monotonic()
+                        self._expire()
+                        self.flush()
+                except Exception as e:
+                    print(f"[PRESENCE] Flush error: {e}")
+                finally:
+                    db.session.remove()
+
+
+# Singleton instance (one per worker process)
+presence = PresenceService()
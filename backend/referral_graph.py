@@ -0,0 +1,275 @@
+"""
+In-memory snapshot of the referral forest, one per worker process.
+
+Referral data is tiny (one parent per user) and read constantly, so it is
+kept as compact arrays indexed by user id:
+- parent and depth arrays
+- a CSR (compressed sparse row) child index: child_offsets/child_ids
+- binary-lifting ancestor tables (up[k][u] is the 2^k-th ancestor of u)
+
+The tree, chain, referrer and root/admin checks run as in-memory traversals.
+The snapshot loads at startup and refreshes incrementally from a high-water
+mark on Referral.id (bounded staleness of REFRESH_INTERVAL seconds); it is
+rebuilt from scratch when rows disappear (admin deletions).
+"""
+from array import array
+from collections import deque
+import threading
+import time
+from sqlalchemy import func
+from models import db, User, Referral
+
+# How often (seconds) to check the referrals table for changes from other workers
+REFRESH_INTERVAL = 2.0
+
+NONE = -1
+
+# Only these users can be roots - a deleted user loses its referrals before its row is removed
+_LIVE_USER = (User.deleted_at.is_(None), User.is_suspended == False)
+
+
+class ReferralForest:
+    """Array-backed referral forest with CSR child index and LCA tables"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.parent = array('i')  # user_id -> referrer id, NONE for roots/unknown
+        self.depth = array('i')  # user_id -> depth below its root
+        self.child_offsets = array('i', [0])  # CSR: children of u are child_ids[offsets[u]:offsets[u + 1]]
+        self.child_ids = array('i')
+        self.extra_children = {}  # Children added since the last full build
+        self.up = []  # up[k][u] = 2^k-th ancestor of u
+        self.roots = set()  # Live users without a referrer
+        self.edge_count = 0
+        self.high_water = 0  # Highest Referral.id loaded
+        self.loaded = False
+        self.checked_at = 0.0
+
+    def _ensure_capacity(self, user_id):
+        """Grow all per-user arrays so user_id is a valid index"""
+        missing = user_id + 1 - len(self.parent)
+        if missing <= 0:
+            return
+        missing = max(missing, len(self.parent) // 4)  # Amortized growth
+        self.parent.extend(array('i', [NONE]) * missing)
+        self.depth.extend(array('i', [0]) * missing)
+        self.child_offsets.extend(array('i', [self.child_offsets[-1]]) * missing)
+        for level in self.up:
+            level.extend(array('i', [NONE]) * missing)
+
+    def _build(self):
+        """Full build from the users and referrals tables"""
+        self._reset()
+        edges = db.session.query(
+            Referral.id, Referral.referred_id, Referral.referrer_id
+        ).order_by(Referral.id).all()
+        user_ids = [row[0] for row in db.session.query(User.id).filter(*_LIVE_USER).all()]
+
+        size = max([0] + user_ids + [max(row[1], row[2]) for row in edges]) + 1
+        self.parent = array('i', [NONE]) * size
+        self.depth = array('i', [0]) * size
+        child_counts = array('i', [0]) * (size + 1)
+
+        # Parents register before their referrals, so id order gives parents' depth first
+        for row_id, referred_id, referrer_id in edges:
+            self.parent[referred_id] = referrer_id
+            self.depth[referred_id] = self.depth[referrer_id] + 1
+            child_counts[referrer_id + 1] += 1
+            self.high_water = row_id
+        self.edge_count = len(edges)
+
+        # CSR child index
+        for i in range(1, size + 1):
+            child_counts[i] += child_counts[i - 1]
+        self.child_offsets = child_counts
+        self.child_ids = array('i', [0]) * len(edges)
+        fill = array('i', child_counts[:size])
+        for _, referred_id, referrer_id in edges:
+            self.child_ids[fill[referrer_id]] = referred_id
+            fill[referrer_id] += 1
+
+        # Binary-lifting tables, one level per power of two up to the max depth
+        max_depth = max(self.depth) if size else 0
+        self.up = [array('i', self.parent)]
+        while (1 << len(self.up)) <= max_depth:
+            previous = self.up[-1]
+            self.up.append(array('i', (previous[a] if a != NONE else NONE for a in previous)))
+
+        self.roots = {user_id for user_id in user_ids if self.parent[user_id] == NONE}
+        self.loaded = True
+
+    def _add(self, child_id, parent_id):
+        """Append one edge (the parent must already be present or be a root)"""
+        self._ensure_capacity(max(child_id, parent_id))
+        if self.parent[child_id] != NONE:
+            return
+
+        self.parent[child_id] = parent_id
+        self.depth[child_id] = self.depth[parent_id] + 1
+        self.extra_children.setdefault(parent_id, []).append(child_id)
+        self.roots.discard(child_id)
+        self.edge_count += 1
+
+        while (1 << len(self.up)) <= self.depth[child_id]:
+            self.up.append(array('i', [NONE]) * len(self.parent))
+        ancestor = parent_id
+        for level in self.up:
+            level[child_id] = ancestor
+            if ancestor == NONE:
+                break
+            ancestor = level[ancestor]
+
+    def refresh(self, force=False):
+        """Bring the snapshot up to date (at most every REFRESH_INTERVAL seconds)"""
+        with self.lock:
+            now = time.monotonic()
+            if self.loaded and not force and now - self.checked_at < REFRESH_INTERVAL:
+                return
+
+            if self.loaded:
+                max_id, count = db.session.query(func.max(Referral.id), func.count(Referral.id)).one()
+                if (max_id or 0) > self.high_water:
+                    rows = db.session.query(
+                        Referral.id, Referral.referred_id, Referral.referrer_id
+                    ).filter(Referral.id > self.high_water).order_by(Referral.id).all()
+                    for row_id, referred_id, referrer_id in rows:
+                        self._add(referred_id, referrer_id)
+                        self.high_water = row_id
+
+                # Rows were deleted - rebuild from scratch
+                if self.edge_count != count:
+                    self._build()
+            else:
+                self._build()
+
+            self.checked_at = now
+
+    def add_referral(self, referred_id, referrer_id):
+        """Record a referral committed by this worker, without waiting for the next refresh"""
+        with self.lock:
+            if self.loaded:
+                self._add(referred_id, referrer_id)
+
+    def invalidate(self):
+        """Force a full rebuild on next use (after deleting referrals)"""
+        with self.lock:
+            self._reset()
+
+    def _known(self, user_id):
+        return 0 <= user_id < len(self.parent) and (self.parent[user_id] != NONE or user_id in self.roots)
+
+    def _children(self, user_id):
+        if not 0 <= user_id < len(self.parent):
+            return []
+        start, end = self.child_offsets[user_id], self.child_offsets[user_id + 1]
+        return list(self.child_ids[start:end]) + self.extra_children.get(user_id, [])
+
+    def _lift(self, user_id, steps):
+        k = 0
+        while steps:
+            if steps & 1:
+                user_id = self.up[k][user_id]
+            steps >>= 1
+            k += 1
+        return user_id
+
+    def _lowest_common_ancestor(self, a, b):
+        # Users past the end of the arrays are newer than the snapshot - treat them as roots
+        if not (0 <= a < len(self.parent) and 0 <= b < len(self.parent)):
+            return a if a == b else None
+
+        depth_a, depth_b = self.depth[a], self.depth[b]
+        if depth_a < depth_b:
+            a, b, depth_a, depth_b = b, a, depth_b, depth_a
+
+        a = self._lift(a, depth_a - depth_b)
+        if a == b:
+            return a
+
+        for level in reversed(self.up):
+            if level[a] != level[b]:
+                a, b = level[a], level[b]
+
+        parent_a, parent_b = self.parent[a], self.parent[b]
+        return parent_a if parent_a != NONE and parent_a == parent_b else None
+
+    def lowest_common_ancestor(self, a, b):
+        """Lowest common ancestor of two users, or None if they are in different trees"""
+        self.refresh()
+        with self.lock:
+            return self._lowest_common_ancestor(a, b)
+
+    def distance(self, a, b):
+        """Number of referral hops between two users through their lowest common ancestor"""
+        self.refresh()
+        with self.lock:
+            ancestor = self._lowest_common_ancestor(a, b)
+            if ancestor is None:
+                return None
+            if not 0 <= a < len(self.parent):
+                return 0  # Same user, newer than the snapshot
+            return self.depth[a] + self.depth[b] - 2 * self.depth[ancestor]
+
+    def get_parent(self, user_id):
+        """Referrer of a user, or None"""
+        self.refresh()
+        with self.lock:
+            if 0 <= user_id < len(self.parent) and self.parent[user_id] != NONE:
+                return self.parent[user_id]
+            return None
+
+    def get_ancestors(self, user_id):
+        """Chain of ids from user_id up to its root (user_id first)"""
+        self.refresh()
+        with self.lock:
+            chain = [user_id]
+            while 0 <= chain[-1] < len(self.parent) and self.parent[chain[-1]] != NONE:
+                chain.append(self.parent[chain[-1]])
+            return chain
+
+    def count_children(self, user_id):
+        """Number of direct referrals of a user"""
+        self.refresh()
+        with self.lock:
+            return len(self._children(user_id))
+
+    def get_subtree(self, user_id, max_depth, max_nodes):
+        """
+        Breadth-first walk of the subtree rooted at user_id. Returns up to
+        max_nodes tuples of (id, depth, parent_id, children_count) with nodes
+        at most max_depth levels below user_id.
+        """
+        self.refresh()
+        with self.lock:
+            nodes = []
+            queue = deque([(user_id, 0, None)])
+            while queue and len(nodes) < max_nodes:
+                node_id, depth, parent_id = queue.popleft()
+                children = self._children(node_id)
+                nodes.append((node_id, depth, parent_id, len(children)))
+                if depth < max_depth:
+                    queue.extend((child_id, depth + 1, node_id) for child_id in children)
+            return nodes
+
+    def is_root(self, user_id):
+        """
+        Whether a user exists, is live and has no referrer (the root/admin).
+        Users the snapshot doesn't know yet are checked against the database.
+        """
+        self.refresh()
+        with self.lock:
+            if user_id in self.roots:
+                return True
+            if self._known(user_id):
+                return False
+
+        exists = db.session.query(User.id).filter(User.id == user_id, *_LIVE_USER).first() is not None
+        has_referrer = db.session.query(Referral.id).filter(Referral.referred_id == user_id).first() is not None
+        return exists and not has_referrer
+
+
+# Singleton instance (one per worker process)
+referral_forest = ReferralForest()
@@ -0,0 +1,151 @@
+"""
+Closure-table index for the referral tree.
+
+Every user has a self row (depth 0) plus one row per ancestor, so subtree
+sizes and distances between a viewer and a page of users are each one
+indexed query instead of a recursive walk with a query per node.
+
+The per-user counters users.direct_referrals and users.subtree_size are kept
+in step with the closure table along the ancestor path.
+"""
+from sqlalchemy import select, func, update
+from sqlalchemy.orm import aliased
+from models import db, User, Referral, ReferralClosure
+
+BATCH_SIZE = 1000
+
+
+def add_user_to_closure(user_id, referrer_id=None):
+    """Index a new user and bump their ancestors' counters (call in the same transaction as the Referral insert)"""
+    rows = [{'ancestor_id': user_id, 'descendant_id': user_id, 'depth': 0}]
+    if referrer_id is not None:
+        ancestors = db.session.query(
+            ReferralClosure.ancestor_id, ReferralClosure.depth
+        ).filter(ReferralClosure.descendant_id == referrer_id).all()
+        rows.extend(
+            {'ancestor_id': ancestor_id, 'descendant_id': user_id, 'depth': depth + 1}
+            for ancestor_id, depth in ancestors
+        )
+
+    db.session.execute(ReferralClosure.__table__.insert(), rows)
+
+    if referrer_id is not None:
+        ancestor_ids = [row['ancestor_id'] for row in rows if row['depth'] > 0]
+        db.session.execute(
+            update(User).where(User.id.in_(ancestor_ids))
+            .values(subtree_size=User.subtree_size + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(User).where(User.id == referrer_id)
+            .values(direct_referrals=User.direct_referrals + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def remove_user_from_closure(user_id):
+    """
+    Remove a user from the index. Their referrals become roots of their own
+    subtrees, mirroring the deletion of the user's Referral rows.
+    """
+    ancestors = db.session.execute(
+        select(ReferralClosure.ancestor_id, ReferralClosure.depth).where(ReferralClosure.descendant_id == user_id)
+    ).all()
+    descendant_ids = select(ReferralClosure.descendant_id).where(ReferralClosure.ancestor_id == user_id)
+
+    # Materialize both sides first - some databases can't delete from a table they subquery
+    ancestor_ids = [ancestor_id for ancestor_id, _ in ancestors]
+    descendant_ids = [row[0] for row in db.session.execute(descendant_ids)]
+
+    # The whole subtree (including the user) leaves every strict ancestor
+    strict_ancestor_ids = [ancestor_id for ancestor_id, depth in ancestors if depth > 0]
+    parent_ids = [ancestor_id for ancestor_id, depth in ancestors if depth == 1]
+    if strict_ancestor_ids:
+        db.session.execute(
+            update(User).where(User.id.in_(strict_ancestor_ids))
+            .values(subtree_size=User.subtree_size - len(descendant_ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(User).where(User.id.in_(parent_ids))
+            .values(direct_referrals=User.direct_referrals - 1)
+            .execution_options(synchronize_session=False)
+        )
+
+    for i in range(0, len(descendant_ids), BATCH_SIZE):
+        ReferralClosure.query.filter(
+            ReferralClosure.ancestor_id.in_(ancestor_ids),
+            ReferralClosure.descendant_id.in_(descendant_ids[i:i + BATCH_SIZE])
+        ).delete(synchronize_session=False)
+
+
+def get_connection_distances(viewer_id, user_ids):
+    """
+    Get {user_id: referral hops to viewer_id} for a page of users in one query.
+    Joins the viewer's ancestor set with the users' ancestor sets; the closest
+    shared ancestor gives the distance. Users in another tree are missing.
+    """
+    if not user_ids:
+        return {}
+
+    viewer = aliased(ReferralClosure)
+    other = aliased(ReferralClosure)
+    rows = db.session.query(
+        other.descendant_id, func.min(viewer.depth + other.depth)
+    ).join(
+        viewer, viewer.ancestor_id == other.ancestor_id
+    ).filter(
+        viewer.descendant_id == viewer_id,
+        other.descendant_id.in_(set(user_ids))
+    ).group_by(other.descendant_id).all()
+
+    return {user_id: distance for user_id, distance in rows}
+
+
+def get_referral_counters(user_id):
+    """Get (direct_referrals, subtree_size) for a user - a primary key read"""
+    return db.session.query(User.direct_referrals, User.subtree_size).filter(User.id == user_id).first()
+
+
+def recompute_referral_counters():
+    """Recompute every user's referral counters from the referrals and closure tables"""
+    direct = select(func.count(Referral.id)).where(Referral.referrer_id == User.id).scalar_subquery()
+    subtree = select(func.count(ReferralClosure.id)).where(
+        ReferralClosure.ancestor_id == User.id,
+        ReferralClosure.depth > 0
+    ).scalar_subquery()
+
+    db.session.execute(
+        update(User).values(direct_referrals=direct, subtree_size=subtree)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def build_closure():
+    """Rebuild the whole index from the referrals table. Returns the number of rows written."""
+    parents = dict(db.session.query(Referral.referred_id, Referral.referrer_id).all())
+    user_ids = [row[0] for row in db.session.query(User.id).all()]
+    existing_ids = set(user_ids)
+
+    ReferralClosure.query.delete(synchronize_session=False)
+
+    rows = []
+    written = 0
+    for user_id in user_ids:
+        ancestor, depth, seen = user_id, 0, set()
+        while ancestor in existing_ids and ancestor not in seen:
+            seen.add(ancestor)
+            rows.append({'ancestor_id': ancestor, 'descendant_id': user_id, 'depth': depth})
+            ancestor = parents.get(ancestor)
+            depth += 1
+
+        if len(rows) >= BATCH_SIZE:
+            db.session.execute(ReferralClosure.__table__.insert(), rows)
+            written += len(rows)
+            rows = []
+
+    if rows:
+        db.session.execute(ReferralClosure.__table__.insert(), rows)
+        written += len(rows)
+
+    return written
@@ -0,0 +1,19 @@
+"""
+Rebuild discovery queues older than discovery.REFRESH_SECONDS
+Queues are also rebuilt on demand when a stale one is popped; run this
+periodically (e.g. hourly) so /users/discover rarely has to wait for a build.
+Usage: python refresh_discovery_queues.py [max_queues]
+"""
+import sys
+from app import create_app
+from discovery import refresh_stale_queues
+
+def refresh_discovery_queues(limit=None):
+    app = create_app()
+    
+    with app.app_context():
+        rebuilt = refresh_stale_queues(limit)
+        print(f"✅ Rebuilt {rebuilt} stale discovery queues")
+
+if __name__ == '__main__':
+    refresh_discovery_queues(int(sys.argv[1]) if len(sys.argv) > 1 else None)
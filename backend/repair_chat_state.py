@@ -0,0 +1,27 @@
+"""
+Recompute chat state (last message, unread counts) from the messages table,
+then every user's unread total from the chat counters
+Run if the conversations list or unread badge drifts, e.g. after manual edits to messages
+"""
+from app import create_app
+from models import db
+from chat_state import recompute_chat_state, recompute_unread_totals
+
+def repair_chat_state():
+    app = create_app()
+    
+    with app.app_context():
+        print("Recomputing chat state...")
+        
+        try:
+            recompute_chat_state()
+            recompute_unread_totals()
+            db.session.commit()
+            print("✅ Chat state recomputed")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Repair failed: {e}")
+
+if __name__ == '__main__':
+    repair_chat_state()
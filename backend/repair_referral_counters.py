@@ -0,0 +1,25 @@
+"""
+Recompute the referral counters (users.direct_referrals, users.subtree_size) from scratch
+Run if counters drift, e.g. after manual edits to the referrals table
+"""
+from app import create_app
+from models import db
+from referral_index import recompute_referral_counters
+
+def repair_referral_counters():
+    app = create_app()
+    
+    with app.app_context():
+        print("Recomputing referral counters...")
+        
+        try:
+            recompute_referral_counters()
+            db.session.commit()
+            print("✅ Referral counters recomputed")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Repair failed: {e}")
+
+if __name__ == '__main__':
+    repair_referral_counters()
@@ -1,14 +1,43 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, current_app
 from flask_jwt_extended import jwt_required
 from models import db, User, Chat, Message
 from encryption import encryption_service
 from utils import get_current_user_id
+from hydration import decrypt_name
+from chat_state import record_message, mark_chat_read, get_unread_total
+from chat_events import chat_events, format_event
+from chat_writer import chat_writer, CommitOutcomeUnknown
+from message_archive import read_archived_messages
+from deletion_jobs import tombstone_chat, deletion_worker
+from message_search import query_terms, search_messages, highlight
+from presence import presence
+from block_cache import block_cache
+from event_bus import event_bus, MESSAGE_SENT, MESSAGES_READ, TYPING, CHAT_DELETED
+from sqlalchemy import case, or_, and_
 from datetime import datetime
+import queue
+import time
 import cloudinary
 import os
 
 chat_bp = Blueprint('chat', __name__, url_prefix='/chat')
 
+# Upper bound for per_page in the conversations list
+MAX_CONVERSATIONS_PER_PAGE = 100
+
+# Upper bound for per_page when reading messages
+MAX_MESSAGES_PER_PAGE = 200
+
+# Upper bound for per_page in message search
+MAX_SEARCH_RESULTS_PER_PAGE = 50
+
+# Stream keepalive interval, and lifetime after which the client reconnects (re-checking its token)
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_MAX_SECONDS = 300
+
+# Retry-After for clients turned away because the process is at its stream cap (they poll meanwhile)
+STREAM_RETRY_AFTER_SECONDS = 60
+
 # Configure Cloudinary
 cloudinary.config(
     cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
@@ -31,81 +60,257 @@ def get_cloudinary_url(public_id):
         ]
     )
 
+@chat_bp.route('/stream', methods=['GET'])
+@jwt_required()
+def stream_events():
+    """
+    Server-sent events for the current user: 'message', 'read', 'unread_count',
+    'typing', 'resync' (reload everything) and 'close' (account suspended).
+    The user counts as online while it is open. Closes after STREAM_MAX_SECONDS; clients
+    reconnect, and poll while the stream is unavailable. Each stream holds a worker
+    thread, so past STREAM_MAX_CONNECTIONS per process new streams get a 503 with
+    Retry-After and the client polls until then.
+    """
+    current_user_id = get_current_user_id()
+    
+    user = db.session.query(User.is_suspended, User.deleted_at).filter(User.id == current_user_id).first()
+    if not user or user.is_suspended or user.deleted_at is not None:
+        return jsonify({'error': 'Account not available'}), 403
+    
+    events = chat_events.subscribe(current_user_id)
+    if events is None:
+        response = jsonify({'error': 'Too many open streams, poll instead', 'retry_after': STREAM_RETRY_AFTER_SECONDS})
+        response.headers['Retry-After'] = str(STREAM_RETRY_AFTER_SECONDS)
+        return response, 503
+    
+    # Release the database connection - the stream only reads from the broker
+    db.session.remove()
+    
+    def generate():
+        try:
+            yield "retry: 3000\n" + format_event('ready', {'user_id': current_user_id})
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event_type, data = events.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    presence.touch(current_user_id)
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(event_type, data)
+                if event_type == 'close':
+                    return
+        finally:
+            chat_events.unsubscribe(current_user_id, events)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def conversation_dict(chat, current_user_id, full_name_encrypted, profile_image):
+    """A chat as listed in conversations, with the other participant if they still exist"""
+    chat_dict = chat.to_dict(current_user_id)
+    if full_name_encrypted:
+        chat_dict['other_user'] = {
+            'id': chat_dict['other_user_id'],
+            'name': decrypt_name(full_name_encrypted),
+            'profile_image': get_cloudinary_url(profile_image),
+            'online': presence.is_online(chat_dict['other_user_id'])
+        }
+    return chat_dict
+
+
 @chat_bp.route('/conversations', methods=['GET'])
 @jwt_required()
 def get_conversations():
-    """Get all conversations for current user"""
+    """Get conversations for current user, most recent first (query params: per_page, cursor)"""
     try:
         current_user_id = get_current_user_id()
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), MAX_CONVERSATIONS_PER_PAGE)
+        cursor = request.args.get('cursor')  # "<last_message_at ISO>,<chat id>" of the previous page's last chat
+        
+        # One query: chats joined with the other participant, newest activity first
+        other_user_id = case((Chat.user1_id == current_user_id, Chat.user2_id), else_=Chat.user1_id)
+        query = db.session.query(Chat, User.full_name_encrypted, User.profile_image).outerjoin(
+            User, User.id == other_user_id
+        ).filter(
+            (Chat.user1_id == current_user_id) | (Chat.user2_id == current_user_id),
+            Chat.deleted_at.is_(None)
+        )
         
-        # Find all chats where user is participant
-        chats = Chat.query.filter(
-            (Chat.user1_id == current_user_id) | (Chat.user2_id == current_user_id)
-        ).order_by(Chat.last_message_at.desc()).all()
+        if cursor:
+            try:
+                cursor_time, cursor_id = cursor.rsplit(',', 1)
+                cursor_time = datetime.fromisoformat(cursor_time.rstrip('Z'))
+                cursor_id = int(cursor_id)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.filter(or_(
+                Chat.last_message_at < cursor_time,
+                and_(Chat.last_message_at == cursor_time, Chat.id < cursor_id)
+            ))
+        
+        rows = query.order_by(Chat.last_message_at.desc(), Chat.id.desc()).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        
+        conversations = [
+            conversation_dict(chat, current_user_id, full_name_encrypted, profile_image)
+            for chat, full_name_encrypted, profile_image in rows
+        ]
         
-        conversations = []
-        for chat in chats:
-            chat_dict = chat.to_dict(current_user_id)
-            
-            # Get other user info
-            other_user_id = chat_dict['other_user_id']
-            other_user = User.query.get(other_user_id)
-            if other_user:
-                chat_dict['other_user'] = {
-                    'id': other_user.id,
-                    'name': encryption_service.decrypt(other_user.full_name_encrypted),
-                    'profile_image': get_cloudinary_url(other_user.profile_image)
-                }
-            
-            conversations.append(chat_dict)
+        next_cursor = None
+        if has_more and rows:
+            last_chat = rows[-1][0]
+            next_cursor = f"{last_chat.last_message_at.isoformat()},{last_chat.id}"
         
-        return jsonify({'conversations': conversations}), 200
+        return jsonify({'conversations': conversations, 'next_cursor': next_cursor}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-@chat_bp.route('/messages/<int:chat_id>', methods=['GET'])
+@chat_bp.route('/conversations/<int:chat_id>', methods=['GET'])
 @jwt_required()
-def get_messages(chat_id):
-    """Get all messages in a chat"""
+def get_conversation(chat_id):
+    """A single conversation (for opening one that isn't on the loaded pages)"""
     try:
         current_user_id = get_current_user_id()
         
-        # Verify user is part of this chat
         chat = Chat.query.get(chat_id)
-        if not chat:
+        if not chat or chat.deleted_at is not None:
             return jsonify({'error': 'Chat not found'}), 404
         
         if chat.user1_id != current_user_id and chat.user2_id != current_user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        # Get messages with pagination
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
+        other_user_id = chat.user2_id if chat.user1_id == current_user_id else chat.user1_id
+        other_user = db.session.query(User.full_name_encrypted, User.profile_image).filter(User.id == other_user_id).first()
+        full_name_encrypted, profile_image = other_user if other_user else (None, None)
+        
+        return jsonify({'conversation': conversation_dict(chat, current_user_id, full_name_encrypted, profile_image)}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@chat_bp.route('/messages/<int:chat_id>', methods=['GET'])
+@jwt_required()
+def get_messages(chat_id):
+    """
+    Get messages in a chat, oldest first.
+    Keyset mode (ordered by id): after_id returns messages newer than a known
+    message (incremental sync), before_id returns the page just before it
+    (scroll-back, reading through to archived months). Without either, the
+    legacy page/per_page pagination is used (database only).
+    """
+    try:
+        current_user_id = get_current_user_id()
         
-        pagination = Message.query.filter_by(chat_id=chat_id).order_by(
-            Message.sent_at.asc()
-        ).paginate(page=page, per_page=per_page, error_out=False)
+        # Verify user is part of this chat
+        chat = Chat.query.get(chat_id)
+        if not chat or chat.deleted_at is not None:
+            return jsonify({'error': 'Chat not found'}), 404
         
-        messages = [msg.to_dict() for msg in pagination.items]
+        if chat.user1_id != current_user_id and chat.user2_id != current_user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
         
-        # Mark messages as read
-        Message.query.filter(
-            Message.chat_id == chat_id,
-            Message.sender_id != current_user_id,
-            Message.is_read == False
-        ).update({'is_read': True})
-        db.session.commit()
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), MAX_MESSAGES_PER_PAGE)
+        after_id = request.args.get('after_id', type=int)
+        before_id = request.args.get('before_id', type=int)
         
-        return jsonify({
-            'messages': messages,
-            'pagination': {
+        if after_id is not None or before_id is not None:
+            query = Message.query.filter(Message.chat_id == chat_id)
+            if after_id is not None:
+                query = query.filter(Message.id > after_id).order_by(Message.id.asc())
+            else:
+                query = query.filter(Message.id < before_id).order_by(Message.id.desc())
+            
+            rows = query.limit(per_page + 1).all()
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+            if after_id is None:
+                rows.reverse()
+                
+                # Scrolled back past the oldest message in the database - continue from the archive
+                if not has_more:
+                    oldest_id = rows[0].id if rows else before_id
+                    archived, has_more = read_archived_messages(chat_id, oldest_id, per_page - len(rows))
+                    rows = archived + rows
+            
+            messages = [msg.to_dict(chat) for msg in rows]
+            pagination_data = {'per_page': per_page, 'has_more': has_more}
+        else:
+            page = request.args.get('page', 1, type=int)
+            pagination = Message.query.filter_by(chat_id=chat_id).order_by(
+                Message.sent_at.asc()
+            ).paginate(page=page, per_page=per_page, error_out=False)
+            
+            messages = [msg.to_dict(chat) for msg in pagination.items]
+            pagination_data = {
                 'page': page,
                 'per_page': per_page,
                 'total': pagination.total,
                 'pages': pagination.pages
             }
+        
+        # Mark the chat as read: one watermark update, and only when something is unread
+        if mark_chat_read(chat, current_user_id):
+            db.session.commit()
+            
+            event_bus.publish(MESSAGES_READ, {
+                'chat_id': chat_id,
+                'reader_id': current_user_id,
+                'other_user_id': chat.user2_id if chat.user1_id == current_user_id else chat.user1_id,
+                'last_read_message_id': chat.last_read_message_id_for(current_user_id)
+            })
+        
+        return jsonify({
+            'messages': messages,
+            'pagination': pagination_data
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@chat_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_chat_messages():
+    """
+    Full-text search in the current user's conversations, newest first
+    (query params: q, per_page, before_id - the next_cursor of the previous page).
+    Each result carries 'highlight' segments marking the matched words.
+    """
+    try:
+        current_user_id = get_current_user_id()
+        terms = query_terms(request.args.get('q', ''))
+        if not terms:
+            return jsonify({'error': 'q is required'}), 400
+        
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), MAX_SEARCH_RESULTS_PER_PAGE)
+        before_id = request.args.get('before_id', type=int)
+        
+        rows = search_messages(current_user_id, terms, before_id=before_id, limit=per_page)
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        
+        # One query for the chats of the page (read state and the other participant)
+        chats = {chat.id: chat for chat in Chat.query.filter(Chat.id.in_({msg.chat_id for msg in rows}))} if rows else {}
+        
+        results = []
+        for msg in rows:
+            chat = chats[msg.chat_id]
+            result = msg.to_dict(chat)
+            result['other_user_id'] = chat.user2_id if chat.user1_id == current_user_id else chat.user1_id
+            result['highlight'] = highlight(msg.content, terms)
+            results.append(result)
+        
+        return jsonify({
+            'results': results,
+            'next_cursor': rows[-1].id if has_more else None
         }), 200
         
     except Exception as e:
@@ -127,15 +332,21 @@ def send_message():
         
         # Check if recipient exists
         recipient = User.query.get(recipient_id)
-        if not recipient:
+        if not recipient or recipient.deleted_at is not None:
             return jsonify({'error': 'Recipient not found'}), 404
         
+        if block_cache.is_blocked(current_user_id, recipient.id):
+            return jsonify({'error': 'Cannot message this user'}), 403
+        
         # Find or create chat
         chat = Chat.query.filter(
             ((Chat.user1_id == current_user_id) & (Chat.user2_id == recipient_id)) |
             ((Chat.user1_id == recipient_id) & (Chat.user2_id == current_user_id))
         ).first()
         
+        if chat and chat.deleted_at is not None:
+            return jsonify({'error': 'Previous chat is still being deleted, try again shortly'}), 409
+        
         if not chat:
             # Create new chat (ensure user1_id < user2_id for consistency)
             user1_id = min(current_user_id, recipient_id)
@@ -148,29 +359,93 @@ def send_message():
             db.session.add(chat)
             db.session.flush()
         
-        # Create message
-        message = Message(
-            chat_id=chat.id,
-            sender_id=current_user_id,
-            content=data['content']
-        )
-        
-        # Update chat's last_message_at
-        chat.last_message_at = datetime.utcnow()
+        if current_app.config.get('CHAT_GROUP_COMMIT'):
+            # Commit the chat (if new) and end this transaction, then let the writer batch the message
+            chat_id = chat.id
+            db.session.commit()
+            message_data = chat_writer.send(current_app._get_current_object(), chat_id, current_user_id, data['content'])
+        else:
+            # Create message
+            message = Message(
+                chat_id=chat.id,
+                sender_id=current_user_id,
+                content=data['content'],
+                sent_at=datetime.utcnow()
+            )
+            db.session.add(message)
+            db.session.flush()
+            
+            # Update chat's last message and the recipient's unread count
+            record_message(chat, message)
+            message_data = message.to_dict(chat)
+            db.session.commit()
         
-        db.session.add(message)
-        db.session.commit()
+        if presence.stop_typing(message_data['chat_id'], current_user_id):
+            event_bus.publish(TYPING, {
+                'chat_id': message_data['chat_id'], 'user_id': current_user_id,
+                'recipient_id': recipient.id, 'typing': False
+            })
+        event = {
+            'chat_id': message_data['chat_id'],
+            'message_id': message_data['id'],
+            'sender_id': current_user_id,
+            'recipient_id': recipient.id
+        }
+        event_bus.publish(MESSAGE_SENT, dict(event, message=message_data), compact=event)
         
         return jsonify({
             'message': 'Message sent successfully',
-            'data': message.to_dict()
+            'data': message_data
         }), 201
         
+    except TimeoutError as e:
+        # Group commit backlog - the message was withdrawn, so a retry won't duplicate it
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503
+    except CommitOutcomeUnknown as e:
+        # Claimed by the writer but never confirmed - the client should reload before resending
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 504
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+@chat_bp.route('/typing/<int:chat_id>', methods=['POST'])
+@jwt_required()
+def send_typing(chat_id):
+    """
+    Report that the current user is typing in a chat (body: {"typing": false} to clear it).
+    Clients call this every few seconds while typing; the other participant gets a
+    'typing' event, at most once per presence.TYPING_REPUBLISH seconds.
+    """
+    try:
+        current_user_id = get_current_user_id()
+        typing = (request.get_json(silent=True) or {}).get('typing', True)
+        
+        chat = db.session.query(Chat.user1_id, Chat.user2_id).filter(
+            Chat.id == chat_id, Chat.deleted_at.is_(None)
+        ).first()
+        if not chat:
+            return jsonify({'error': 'Chat not found'}), 404
+        
+        if chat.user1_id != current_user_id and chat.user2_id != current_user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        other_user_id = chat.user2_id if chat.user1_id == current_user_id else chat.user1_id
+        changed = presence.start_typing(chat_id, current_user_id) if typing else presence.stop_typing(chat_id, current_user_id)
+        if changed:
+            event_bus.publish(TYPING, {
+                'chat_id': chat_id, 'user_id': current_user_id,
+                'recipient_id': other_user_id, 'typing': bool(typing)
+            })
+        
+        return '', 204
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @chat_bp.route('/start/<int:user_id>', methods=['POST'])
 @jwt_required()
 def start_chat(user_id):
@@ -183,15 +458,21 @@ def start_chat(user_id):
         
         # Check if user exists
         other_user = User.query.get(user_id)
-        if not other_user:
+        if not other_user or other_user.deleted_at is not None:
             return jsonify({'error': 'User not found'}), 404
         
+        if block_cache.is_blocked(current_user_id, user_id):
+            return jsonify({'error': 'Cannot chat with this user'}), 403
+        
         # Find existing chat
         chat = Chat.query.filter(
             ((Chat.user1_id == current_user_id) & (Chat.user2_id == user_id)) |
             ((Chat.user1_id == user_id) & (Chat.user2_id == current_user_id))
         ).first()
         
+        if chat and chat.deleted_at is not None:
+            return jsonify({'error': 'Previous chat is still being deleted, try again shortly'}), 409
+        
         if not chat:
             # Create new chat
             user1_id = min(current_user_id, user_id)
@@ -208,7 +489,8 @@ def start_chat(user_id):
         chat_dict['other_user'] = {
             'id': other_user.id,
             'name': encryption_service.decrypt(other_user.full_name_encrypted),
-            'profile_image': get_cloudinary_url(other_user.profile_image)
+            'profile_image': get_cloudinary_url(other_user.profile_image),
+            'online': presence.is_online(other_user.id)
         }
         
         return jsonify({'chat': chat_dict}), 200
@@ -225,19 +507,7 @@ def get_unread_count():
     try:
         current_user_id = get_current_user_id()
         
-        # Get all chats where user is participant
-        chats = Chat.query.filter(
-            (Chat.user1_id == current_user_id) | (Chat.user2_id == current_user_id)
-        ).all()
-        
-        chat_ids = [chat.id for chat in chats]
-        
-        # Count unread messages
-        unread_count = Message.query.filter(
-            Message.chat_id.in_(chat_ids),
-            Message.sender_id != current_user_id,
-            Message.is_read == False
-        ).count()
+        unread_count = get_unread_total(current_user_id)
         
         return jsonify({'unread_count': unread_count}), 200
         
@@ -248,28 +518,32 @@ def get_unread_count():
 @chat_bp.route('/delete/<int:chat_id>', methods=['DELETE'])
 @jwt_required()
 def delete_chat(chat_id):
-    """Delete a chat conversation and all its messages"""
+    """
+    Delete a chat conversation and all its messages. The chat disappears
+    immediately; its messages are deleted in the background (202 + job id).
+    """
     try:
         current_user_id = get_current_user_id()
         
         # Get the chat
         chat = Chat.query.get(chat_id)
         
-        if not chat:
+        if not chat or chat.deleted_at is not None:
             return jsonify({'error': 'Chat not found'}), 404
         
         # Check if user is part of this chat
         if chat.user1_id != current_user_id and chat.user2_id != current_user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        # Delete all messages in this chat
-        Message.query.filter_by(chat_id=chat_id).delete()
-        
-        # Delete the chat
-        db.session.delete(chat)
+        # Hide the chat (and its unread messages from both participants' totals) and queue the deletion
+        participant_ids = (chat.user1_id, chat.user2_id)
+        job = tombstone_chat(chat, requested_by=current_user_id)
         db.session.commit()
+        deletion_worker.notify(current_app._get_current_object())
+        
+        event_bus.publish(CHAT_DELETED, {'chat_id': chat_id, 'user_ids': list(participant_ids)})
         
-        return jsonify({'message': 'Chat deleted successfully'}), 200
+        return jsonify({'message': 'Chat deletion started', 'job_id': job.id}), 202
         
     except Exception as e:
         db.session.rollback()
@@ -3,11 +3,20 @@ from flask_jwt_extended import jwt_required
 from models import db, User, Referral
 from encryption import encryption_service
 from utils import get_current_user_id
+from hydration import decrypt_name, get_user_summaries
+from referral_graph import referral_forest
+from referral_index import get_referral_counters
 import cloudinary
 import os
 
 referrals_bp = Blueprint('referrals', __name__, url_prefix='/referrals')
 
+# Limits for /referrals/tree - depth counts levels including the current user
+TREE_DEFAULT_DEPTH = 3
+TREE_MAX_DEPTH = 10
+TREE_DEFAULT_MAX_NODES = 500
+TREE_MAX_NODES = 5000
+
 # Configure Cloudinary
 cloudinary.config(
     cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
@@ -37,23 +46,23 @@ def get_my_referrals():
     try:
         current_user_id = get_current_user_id()
         
-        # Get all referrals made by this user
-        referrals = Referral.query.filter_by(referrer_id=current_user_id).all()
+        # Get all referrals made by this user together with the referred users
+        rows = db.session.query(Referral, User).join(
+            User, User.id == Referral.referred_id
+        ).filter(Referral.referrer_id == current_user_id).all()
         
         referrals_data = []
-        for referral in referrals:
-            user = User.query.get(referral.referred_id)
-            if user:
-                user_dict = {
-                    'id': user.id,
-                    'name': encryption_service.decrypt(user.full_name_encrypted),
-                    'profile_image': get_cloudinary_url(user.profile_image),
-                    'age': user.age,
-                    'gender': user.gender,
-                    'location': user.location,
-                    'referred_at': referral.created_at.isoformat()
-                }
-                referrals_data.append(user_dict)
+        for referral, user in rows:
+            user_dict = {
+                'id': user.id,
+                'name': decrypt_name(user.full_name_encrypted),
+                'profile_image': get_cloudinary_url(user.profile_image),
+                'age': user.age,
+                'gender': user.gender,
+                'location': user.location,
+                'referred_at': referral.created_at.isoformat()
+            }
+            referrals_data.append(user_dict)
         
         return jsonify({'referrals': referrals_data}), 200
         
@@ -64,40 +73,49 @@ def get_my_referrals():
 @referrals_bp.route('/tree', methods=['GET'])
 @jwt_required()
 def get_referral_tree():
-    """Get referral tree starting from current user"""
+    """Get referral tree starting from current user (query params: depth, max_nodes)"""
     try:
         current_user_id = get_current_user_id()
         
-        def build_tree(user_id, depth=0, max_depth=3):
-            """Recursively build referral tree"""
-            if depth >= max_depth:
-                return None
-            
-            user = User.query.get(user_id)
-            if not user:
-                return None
-            
-            # Get direct referrals
-            referrals = Referral.query.filter_by(referrer_id=user_id).all()
+        # Levels to return (including the current user) and a cap on the number of nodes
+        depth = min(max(request.args.get('depth', TREE_DEFAULT_DEPTH, type=int), 1), TREE_MAX_DEPTH)
+        max_nodes = min(max(request.args.get('max_nodes', TREE_DEFAULT_MAX_NODES, type=int), 1), TREE_MAX_NODES)
+        
+        # Breadth-first walk of the in-memory referral forest; fetch one extra
+        # node to know whether the tree was truncated
+        nodes = referral_forest.get_subtree(current_user_id, max_depth=depth - 1, max_nodes=max_nodes + 1)
+        truncated = len(nodes) > max_nodes
+        nodes = nodes[:max_nodes]
+        
+        # Names, images and codes for all nodes in one query
+        node_ids = [node_id for node_id, _, _, _ in nodes]
+        users = {
+            row.id: row for row in db.session.query(
+                User.id, User.full_name_encrypted, User.profile_image, User.referral_code
+            ).filter(User.id.in_(node_ids)).all()
+        } if node_ids else {}
+        
+        # Assemble nested tree - nodes come in breadth-first order so parents come first
+        tree_nodes = {}
+        for node_id, node_depth, parent_id, children_count in nodes:
+            user = users.get(node_id)
+            if not user or (node_depth > 0 and parent_id not in tree_nodes):
+                continue
             
-            children = []
-            for referral in referrals:
-                child_tree = build_tree(referral.referred_id, depth + 1, max_depth)
-                if child_tree:
-                    children.append(child_tree)
-            
-            return {
+            tree_nodes[node_id] = {
                 'id': user.id,
-                'name': encryption_service.decrypt(user.full_name_encrypted),
+                'name': decrypt_name(user.full_name_encrypted),
                 'profile_image': get_cloudinary_url(user.profile_image),
                 'referral_code': user.referral_code,
-                'children': children,
-                'children_count': len(referrals)
+                'children': [],
+                'children_count': children_count
             }
+            if node_depth > 0:
+                tree_nodes[parent_id]['children'].append(tree_nodes[node_id])
         
-        tree = build_tree(current_user_id)
+        tree = tree_nodes.get(current_user_id)
         
-        return jsonify({'tree': tree}), 200
+        return jsonify({'tree': tree, 'truncated': truncated}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -110,13 +128,13 @@ def get_my_referrer():
     try:
         current_user_id = get_current_user_id()
         
-        # Find referral record
-        referral = Referral.query.filter_by(referred_id=current_user_id).first()
+        # Find referrer in the in-memory referral forest
+        referrer_id = referral_forest.get_parent(current_user_id)
         
-        if not referral:
+        if referrer_id is None:
             return jsonify({'referrer': None}), 200
         
-        referrer = User.query.get(referral.referrer_id)
+        referrer = User.query.get(referrer_id)
         if not referrer:
             return jsonify({'referrer': None}), 200
         
@@ -144,45 +162,13 @@ def get_referral_chain(user_id):
     try:
         current_user_id = get_current_user_id()
         
-        def build_chain(uid, chain=None, max_depth=10):
-            """Build chain of referrers going backwards"""
-            if chain is None:
-                chain = []
-            
-            if len(chain) >= max_depth:
-                return chain
-            
-            user = User.query.get(uid)
-            if not user:
-                return chain
-            
-            chain.append({
-                'id': user.id,
-                'name': encryption_service.decrypt(user.full_name_encrypted),
-                'profile_image': get_cloudinary_url(user.profile_image)
-            })
-            
-            # Find who referred this user
-            referral = Referral.query.filter_by(referred_id=uid).first()
-            if referral:
-                return build_chain(referral.referrer_id, chain, max_depth)
-            
-            return chain
-        
-        chain = build_chain(user_id)
+        # Root-ward chain from the in-memory referral forest
+        chain_ids = referral_forest.get_ancestors(user_id)
+        summaries = get_user_summaries(chain_ids)
+        chain = [summaries[uid] for uid in chain_ids if uid in summaries]
         
-        # Calculate connection distance to current user
-        current_chain = build_chain(current_user_id)
-        
-        # Find common ancestor
-        connection_distance = None
-        for i, user1 in enumerate(chain):
-            for j, user2 in enumerate(current_chain):
-                if user1['id'] == user2['id']:
-                    connection_distance = i + j
-                    break
-            if connection_distance is not None:
-                break
+        # Distance through the lowest common ancestor (in-memory, O(log n))
+        connection_distance = referral_forest.distance(user_id, current_user_id)
         
         return jsonify({
             'chain': chain,
@@ -200,27 +186,9 @@ def get_referral_stats():
     try:
         current_user_id = get_current_user_id()
         
-        # Count direct referrals
-        direct_count = Referral.query.filter_by(referrer_id=current_user_id).count()
-        
-        # Count total referrals in tree (recursive)
-        def count_tree_referrals(user_id, counted=None):
-            if counted is None:
-                counted = set()
-            
-            if user_id in counted:
-                return 0
-            
-            counted.add(user_id)
-            referrals = Referral.query.filter_by(referrer_id=user_id).all()
-            
-            total = len(referrals)
-            for referral in referrals:
-                total += count_tree_referrals(referral.referred_id, counted)
-            
-            return total
-        
-        total_count = count_tree_referrals(current_user_id)
+        # Both counts are maintained incrementally - a single primary key read
+        counters = get_referral_counters(current_user_id)
+        direct_count, total_count = counters if counters else (0, 0)
         
         return jsonify({
             'direct_referrals': direct_count,
@@ -1,15 +1,40 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required
-from models import db, User, Match, Referral, Chat, Message, Block
+from models import db, User, Match, Referral, Chat, Message, Block, UserNameToken, DeletionJob
 from encryption import encryption_service
+from name_index import update_name_index, filter_users_by_name
+from referral_index import remove_user_from_closure, get_connection_distances
+from referral_graph import referral_forest
+from message_archive import count_archived_messages
+from deletion_jobs import tombstone_user, deletion_worker
+from hydration import hydrate_users
+from likes import like, unlike
+from decisions import apply_decisions, DECISIONS, MAX_DECISIONS
+from discovery import pop_candidates
+from block_cache import block_cache
 from utils import get_current_user_id
-from sqlalchemy import or_, and_
+from presence import presence
+from event_bus import (
+    event_bus, PROFILE_UPDATED, USER_BLOCKED, USER_UNBLOCKED, USER_SUSPENDED, USER_UNSUSPENDED, USER_DELETED
+)
+from sqlalchemy import or_, and_, func
+from datetime import datetime
 import cloudinary
 import cloudinary.utils
 import os
 
 users_bp = Blueprint('users', __name__, url_prefix='/users')
 
+# Upper bound for per_page in search
+MAX_SEARCH_PER_PAGE = 100
+
+# Upper bound for per_page in discovery
+MAX_DISCOVER_PER_PAGE = 50
+
+# Upper bound for per_page in the matches list, and its sort orders
+MAX_MATCHES_PER_PAGE = 100
+MATCH_SORTS = ('matched', 'activity')
+
 # Configure Cloudinary
 cloudinary.config(
     cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
@@ -49,7 +74,7 @@ def get_user_profile(user_id):
         user = User.query.get(user_id)
         print(f"[GET PROFILE] User query result: {user}")
         
-        if not user:
+        if not user or user.deleted_at is not None:
             print(f"[GET PROFILE] ❌ User not found for ID: {user_id}")
             return jsonify({'error': 'User not found'}), 404
         
@@ -68,6 +93,9 @@ def get_user_profile(user_id):
         # Convert Cloudinary public_id to full URL
         user_data['profile_image'] = get_cloudinary_url(user.profile_image)
         
+        # Online now (in-memory presence, no query)
+        user_data['online'] = presence.is_online(user.id)
+        
         # Get referrer info
         try:
             referral = Referral.query.filter_by(referred_id=user.id).first()
@@ -89,6 +117,13 @@ def get_user_profile(user_id):
             print(f"[GET PROFILE] Error getting referrer info: {e}")
             # Continue without referrer info
         
+        # Degrees of separation from the current user through the referral tree
+        try:
+            user_data['connection_distance'] = get_connection_distances(current_user_id, [user.id]).get(user.id)
+        except Exception as e:
+            print(f"[GET PROFILE] Error getting connection distance: {e}")
+            user_data['connection_distance'] = None
+        
         # Check if current user has liked this user
         try:
             match = Match.query.filter_by(
@@ -104,11 +139,7 @@ def get_user_profile(user_id):
         
         # Check if current user has blocked this user
         try:
-            block = Block.query.filter_by(
-                blocker_id=current_user_id,
-                blocked_id=user_id
-            ).first()
-            user_data['blocked_by_me'] = block is not None
+            user_data['blocked_by_me'] = block_cache.get(current_user_id).blocks(user_id)
         except Exception as e:
             print(f"[GET PROFILE] Error checking block: {e}")
             user_data['blocked_by_me'] = False
@@ -141,88 +172,56 @@ def search_users():
         min_age = request.args.get('min_age', type=int)
         max_age = request.args.get('max_age', type=int)
         location = request.args.get('location')
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), MAX_SEARCH_PER_PAGE)
+        cursor = request.args.get('cursor', type=int)  # Last user id of the previous page
         
         # Build query - exclude suspended users and blocked users
         users_query = User.query.filter(User.id != current_user_id).filter(User.is_suspended == False)
         
-        # Get list of blocked user IDs (both ways - users I blocked and users who blocked me)
-        blocked_by_me = [b.blocked_id for b in Block.query.filter_by(blocker_id=current_user_id).all()]
-        blocked_me = [b.blocker_id for b in Block.query.filter_by(blocked_id=current_user_id).all()]
-        all_blocked_ids = set(blocked_by_me + blocked_me)
+        # Blocked user IDs, both ways - users I blocked and users who blocked me (cached, see block_cache.py)
+        all_blocked_ids = block_cache.get(current_user_id).ids()
         
         # Exclude blocked users
         if all_blocked_ids:
             users_query = users_query.filter(~User.id.in_(all_blocked_ids))
         
         # Debug
-        total_users = User.query.count()
-        print(f"[SEARCH DEBUG] Total users in DB: {total_users}")
         print(f"[SEARCH DEBUG] Current user ID: {current_user_id}")
         print(f"[SEARCH DEBUG] Filters - name: '{name_search}', gender: {gender}, min_age: {min_age}, max_age: {max_age}, location: {location}")
         
-        # Filter by name if provided (requires decryption - must be done before other filters)
+        if gender:
+            users_query = users_query.filter(User.gender == gender)
+        
+        if min_age:
+            users_query = users_query.filter(User.age >= min_age)
+        
+        if max_age:
+            users_query = users_query.filter(User.age <= max_age)
+        
+        if location:
+            users_query = users_query.filter(User.location.ilike(f'%{location}%'))
+        
+        # Filter by name using the blind index (last, so only the remaining candidates' names are re-checked)
         if name_search:
-            name_search_lower = name_search.lower().strip()
-            print(f"[SEARCH DEBUG] Searching for name: '{name_search_lower}'")
-            
-            # Get all users that match basic criteria (not suspended, not blocked, not current user)
-            base_query = User.query.filter(User.id != current_user_id).filter(User.is_suspended == False)
-            
-            # Exclude blocked users
-            if all_blocked_ids:
-                base_query = base_query.filter(~User.id.in_(all_blocked_ids))
-            
-            all_candidates = base_query.all()
-            print(f"[SEARCH DEBUG] Found {len(all_candidates)} candidate users before name filter")
-            
-            # Filter by name (decrypt and check)
-            filtered_users = []
-            for user in all_candidates:
-                try:
-                    full_name = encryption_service.decrypt(user.full_name_encrypted)
-                    full_name_lower = full_name.lower()
-                    if name_search_lower in full_name_lower:
-                        filtered_users.append(user)
-                        print(f"[SEARCH DEBUG] Match found: user {user.id} - '{full_name}' contains '{name_search_lower}'")
-                except Exception as e:
-                    print(f"[SEARCH DEBUG] Error decrypting name for user {user.id}: {e}")
-                    # Skip users with decryption errors
-            print(f"[SEARCH DEBUG] After name filter: {len(filtered_users)} users match")
-            all_users = filtered_users
-            
-            # Now apply other filters on the name-filtered results
-            if gender:
-                all_users = [u for u in all_users if u.gender == gender]
-            if min_age:
-                all_users = [u for u in all_users if u.age and u.age >= min_age]
-            if max_age:
-                all_users = [u for u in all_users if u.age and u.age <= max_age]
-            if location:
-                location_lower = location.lower()
-                all_users = [u for u in all_users if u.location and location_lower in u.location.lower()]
+            print(f"[SEARCH DEBUG] Searching for name: '{name_search}'")
+            users_query = filter_users_by_name(users_query, name_search)
+        
+        # Total count as a separate COUNT query
+        total_filtered = users_query.order_by(None).count()
+        
+        # Pagination in SQL - keyset on user id when a cursor is given, offset by page otherwise
+        page_query = users_query.order_by(User.id.asc())
+        if cursor:
+            page_query = page_query.filter(User.id > cursor)
         else:
-            # No name search - apply filters normally using SQL query
-            if gender:
-                users_query = users_query.filter(User.gender == gender)
-            
-            if min_age:
-                users_query = users_query.filter(User.age >= min_age)
-            
-            if max_age:
-                users_query = users_query.filter(User.age <= max_age)
-            
-            if location:
-                users_query = users_query.filter(User.location.ilike(f'%{location}%'))
-            
-            all_users = users_query.all()
+            page_query = page_query.offset((page - 1) * per_page)
         
-        # Pagination (manual since we filtered by name)
-        total_filtered = len(all_users)
-        start_idx = (page - 1) * per_page
-        end_idx = start_idx + per_page
-        users = all_users[start_idx:end_idx]
+        # Fetch one extra row to know whether there is a next page
+        users = page_query.limit(per_page + 1).all()
+        has_more = len(users) > per_page
+        users = users[:per_page]
+        next_cursor = users[-1].id if has_more and users else None
         
         print(f"[SEARCH DEBUG] Users found after filters: {len(users)}")
         print(f"[SEARCH DEBUG] Total matching users: {total_filtered}")
@@ -230,26 +229,8 @@ def search_users():
         # Calculate total pages
         total_pages = (total_filtered + per_page - 1) // per_page if total_filtered > 0 else 1
         
-        # Prepare response
-        users_data = []
-        for user in users:
-            user_dict = user.to_dict()
-            user_dict['full_name'] = encryption_service.decrypt(user.full_name_encrypted)
-            
-            # Convert Cloudinary public_id to full URL
-            user_dict['profile_image'] = get_cloudinary_url(user.profile_image)
-            
-            # Get referrer info
-            referral = Referral.query.filter_by(referred_id=user.id).first()
-            if referral:
-                referrer = User.query.get(referral.referrer_id)
-                if referrer:
-                    user_dict['referred_by'] = {
-                        'id': referrer.id,
-                        'name': encryption_service.decrypt(referrer.full_name_encrypted)
-                    }
-            
-            users_data.append(user_dict)
+        # Prepare response (names, images, referrers and distances loaded in one batch)
+        users_data = hydrate_users(users, viewer_id=current_user_id)
         
         return jsonify({
             'users': users_data,
@@ -257,7 +238,8 @@ def search_users():
                 'page': page,
                 'per_page': per_page,
                 'total': total_filtered,
-                'pages': total_pages
+                'pages': total_pages,
+                'next_cursor': next_cursor
             }
         }), 200
         
@@ -265,6 +247,33 @@ def search_users():
         return jsonify({'error': str(e)}), 500
 
 
+@users_bp.route('/discover', methods=['GET'])
+@jwt_required()
+def discover_users():
+    """
+    Next page of the current user's discovery queue (query param: per_page).
+    Each call advances the queue; decisions go to POST /users/decisions.
+    """
+    try:
+        current_user_id = get_current_user_id()
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), MAX_DISCOVER_PER_PAGE)
+        
+        candidate_ids, remaining = pop_candidates(current_user_id, per_page)
+        db.session.commit()
+        
+        users_by_id = {user.id: user for user in User.query.filter(User.id.in_(candidate_ids))} if candidate_ids else {}
+        users = [users_by_id[user_id] for user_id in candidate_ids if user_id in users_by_id]
+        
+        return jsonify({
+            'users': hydrate_users(users, viewer_id=current_user_id),
+            'remaining': remaining
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
 @users_bp.route('/like/<int:user_id>', methods=['POST'])
 @jwt_required()
 def like_user(user_id):
@@ -277,41 +286,83 @@ def like_user(user_id):
         
         # Check if user exists
         target_user = User.query.get(user_id)
-        if not target_user:
+        if not target_user or target_user.deleted_at is not None:
             return jsonify({'error': 'User not found'}), 404
         
-        # Check if already liked
-        existing_match = Match.query.filter_by(
-            user_id=current_user_id,
-            liked_user_id=user_id
-        ).first()
-        
-        if existing_match:
+        # Insert the like and set the mutual flag on both rows, race-free (see likes.py)
+        created, is_mutual = like(current_user_id, user_id)
+        if not created:
+            db.session.rollback()
             return jsonify({'error': 'Already liked this user'}), 400
         
-        # Create match
-        new_match = Match(
-            user_id=current_user_id,
-            liked_user_id=user_id
-        )
+        db.session.commit()
         
-        # Check if mutual (the other user already liked this user)
-        reverse_match = Match.query.filter_by(
-            user_id=user_id,
-            liked_user_id=current_user_id
-        ).first()
+        return jsonify({
+            'message': 'User liked successfully',
+            'is_mutual': is_mutual
+        }), 201
         
-        if reverse_match:
-            new_match.is_mutual = True
-            reverse_match.is_mutual = True
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@users_bp.route('/like/<int:user_id>', methods=['DELETE'])
+@jwt_required()
+def unlike_user(user_id):
+    """Remove a like (a mutual match goes back to a one-sided like from the other user)"""
+    try:
+        current_user_id = get_current_user_id()
+        
+        if not unlike(current_user_id, user_id):
+            db.session.rollback()
+            return jsonify({'error': 'User is not liked'}), 404
         
-        db.session.add(new_match)
         db.session.commit()
         
+        return jsonify({'message': 'User unliked successfully'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@users_bp.route('/decisions', methods=['POST'])
+@jwt_required()
+def submit_decisions():
+    """
+    Apply an ordered batch of decisions in one transaction.
+    Body: {"decisions": [{"user_id": 5, "decision": "like" | "pass" | "block"}, ...]}
+    Returns a result per decision and mutual_user_ids - the likes that became matches.
+    """
+    try:
+        current_user_id = get_current_user_id()
+        data = request.get_json(silent=True) or {}
+        items = data.get('decisions')
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'decisions must be a non-empty list'}), 400
+        if len(items) > MAX_DECISIONS:
+            return jsonify({'error': f'At most {MAX_DECISIONS} decisions per request'}), 400
+        
+        decisions = []
+        for item in items:
+            target_id = item.get('user_id') if isinstance(item, dict) else None
+            decision = item.get('decision') if isinstance(item, dict) else None
+            if not isinstance(target_id, int) or isinstance(target_id, bool) or decision not in DECISIONS:
+                return jsonify({'error': f'Each decision needs an integer user_id and a decision in {", ".join(DECISIONS)}'}), 400
+            decisions.append((target_id, decision))
+        
+        results, mutual_user_ids, blocked_ids = apply_decisions(current_user_id, decisions)
+        db.session.commit()
+        
+        for blocked_id in blocked_ids:
+            event_bus.publish(USER_BLOCKED, {'blocker_id': current_user_id, 'blocked_id': blocked_id})
+        
         return jsonify({
-            'message': 'User liked successfully',
-            'is_mutual': new_match.is_mutual
-        }), 201
+            'results': results,
+            'mutual_user_ids': mutual_user_ids
+        }), 200
         
     except Exception as e:
         db.session.rollback()
@@ -321,32 +372,66 @@ def like_user(user_id):
 @users_bp.route('/matches', methods=['GET'])
 @jwt_required()
 def get_matches():
-    """Get all mutual matches for current user"""
+    """
+    Mutual matches of the current user, one page at a time (query params:
+    sort=matched|activity, per_page, cursor). 'matched' orders by match time,
+    'activity' by the last message with that user (match time if they never chatted).
+    """
     try:
         current_user_id = get_current_user_id()
+        sort = request.args.get('sort', 'matched')
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), MAX_MATCHES_PER_PAGE)
+        cursor = request.args.get('cursor')  # "<sort time ISO>,<match id>" of the previous page's last match
+        
+        if sort not in MATCH_SORTS:
+            return jsonify({'error': f'sort must be one of {", ".join(MATCH_SORTS)}'}), 400
+        
+        # One query: matches joined with the matched users and, if any, our chat with them
+        query = db.session.query(Match, User, Chat.id, Chat.last_message_at).join(
+            User, User.id == Match.liked_user_id
+        ).outerjoin(Chat, and_(
+            or_(
+                and_(Chat.user1_id == current_user_id, Chat.user2_id == Match.liked_user_id),
+                and_(Chat.user2_id == current_user_id, Chat.user1_id == Match.liked_user_id)
+            ),
+            Chat.deleted_at.is_(None)
+        )).filter(
+            Match.user_id == current_user_id,
+            Match.is_mutual == True,
+            User.deleted_at.is_(None)
+        )
         
-        # Get all mutual matches
-        matches = Match.query.filter(
-            and_(
-                Match.user_id == current_user_id,
-                Match.is_mutual == True
-            )
-        ).all()
-        
-        matches_data = []
-        for match in matches:
-            user = User.query.get(match.liked_user_id)
-            if user:
-                user_dict = user.to_dict()
-                user_dict['full_name'] = encryption_service.decrypt(user.full_name_encrypted)
-                user_dict['matched_at'] = match.created_at.isoformat()
-                
-                # Convert Cloudinary public_id to full URL
-                user_dict['profile_image'] = get_cloudinary_url(user.profile_image)
-                
-                matches_data.append(user_dict)
-        
-        return jsonify({'matches': matches_data}), 200
+        sort_time = Match.created_at if sort == 'matched' else func.coalesce(Chat.last_message_at, Match.created_at)
+        if cursor:
+            try:
+                cursor_time, cursor_id = cursor.rsplit(',', 1)
+                cursor_time = datetime.fromisoformat(cursor_time.rstrip('Z'))
+                cursor_id = int(cursor_id)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.filter(or_(
+                sort_time < cursor_time,
+                and_(sort_time == cursor_time, Match.id < cursor_id)
+            ))
+        
+        rows = query.order_by(sort_time.desc(), Match.id.desc()).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        
+        # Names are decrypted for this page only
+        matches_data = hydrate_users([user for _, user, _, _ in rows], include_referrer=False)
+        for (match, _, chat_id, last_message_at), user_dict in zip(rows, matches_data):
+            user_dict['matched_at'] = match.created_at.isoformat()
+            user_dict['chat_id'] = chat_id
+            user_dict['last_message_at'] = last_message_at.isoformat() if last_message_at else None
+        
+        next_cursor = None
+        if has_more and rows:
+            match, _, _, last_message_at = rows[-1]
+            last_time = match.created_at if sort == 'matched' else (last_message_at or match.created_at)
+            next_cursor = f"{last_time.isoformat()},{match.id}"
+        
+        return jsonify({'matches': matches_data, 'next_cursor': next_cursor}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -442,6 +527,10 @@ def update_profile():
             user.profile_image = data['profile_image'] if data['profile_image'] else None
         
         # Update encrypted fields
+        if 'full_name' in data and data['full_name'] and data['full_name'].strip():
+            full_name = data['full_name'].strip()
+            user.full_name_encrypted = encryption_service.encrypt(full_name)
+            update_name_index(user.id, full_name)
         if 'phone' in data:
             user.phone_encrypted = encryption_service.encrypt(data['phone']) if data['phone'] else None
         if 'address' in data:
@@ -450,6 +539,7 @@ def update_profile():
         print(f"[UPDATE PROFILE] Before commit, user.social_link = '{user.social_link}'")
         db.session.commit()
         print(f"[UPDATE PROFILE] After commit, user.social_link = '{user.social_link}'")
+        event_bus.publish(PROFILE_UPDATED, {'user_id': current_user_id})
         
         # Verify directly from database
         from sqlalchemy import text
@@ -516,8 +606,7 @@ def check_is_admin():
         current_user_id = get_current_user_id()
         
         # Check if user has a referrer - if not, they are the root/admin
-        referral = Referral.query.filter_by(referred_id=current_user_id).first()
-        is_admin = referral is None
+        is_admin = referral_forest.is_root(current_user_id)
         
         return jsonify({'is_admin': is_admin}), 200
         
@@ -533,17 +622,16 @@ def get_admin_stats():
         current_user_id = get_current_user_id()
         
         # Verify user is admin (root)
-        referral = Referral.query.filter_by(referred_id=current_user_id).first()
-        if referral:
+        if not referral_forest.is_root(current_user_id):
             return jsonify({'error': 'Unauthorized - Admin access only'}), 403
         
         # Get statistics
-        total_users = User.query.count()
+        total_users = User.query.filter(User.deleted_at.is_(None)).count()
         total_referrals = Referral.query.count()
         total_matches = Match.query.count()
         total_mutual_matches = Match.query.filter_by(is_mutual=True).count()
-        total_chats = Chat.query.count()
-        total_messages = Message.query.count()
+        total_chats = Chat.query.filter(Chat.deleted_at.is_(None)).count()
+        total_messages = Message.query.count() + count_archived_messages()
         
         # Get users by gender
         from sqlalchemy import func
@@ -586,8 +674,7 @@ def get_all_users():
         current_user_id = get_current_user_id()
         
         # Verify user is admin (root)
-        referral = Referral.query.filter_by(referred_id=current_user_id).first()
-        if referral:
+        if not referral_forest.is_root(current_user_id):
             return jsonify({'error': 'Unauthorized - Admin access only'}), 403
         
         # Get query parameters
@@ -595,22 +682,12 @@ def get_all_users():
         per_page = request.args.get('per_page', 50, type=int)
         search_name = request.args.get('name', '').strip()
         
-        # Build query
-        users_query = User.query
+        # Build query (users being deleted are already gone for the admin)
+        users_query = User.query.filter(User.deleted_at.is_(None))
         
-        # Filter by name if provided
+        # Filter by name using the blind index
         if search_name:
-            search_name_lower = search_name.lower()
-            all_users = users_query.all()
-            filtered_users = []
-            for user in all_users:
-                try:
-                    full_name = encryption_service.decrypt(user.full_name_encrypted)
-                    if search_name_lower in full_name.lower():
-                        filtered_users.append(user)
-                except Exception as e:
-                    print(f"[ADMIN USERS] Error decrypting name for user {user.id}: {e}")
-            users_query = User.query.filter(User.id.in_([u.id for u in filtered_users]))
+            users_query = filter_users_by_name(users_query, search_name)
         
         # Pagination
         pagination = users_query.paginate(page=page, per_page=per_page, error_out=False)
@@ -618,23 +695,14 @@ def get_all_users():
         
         # Prepare response
         users_data = []
-        for user in users:
+        for user_dict, user in zip(hydrate_users(users, include_referrer=False), users):
             try:
-                user_dict = user.to_dict()
-                user_dict['full_name'] = encryption_service.decrypt(user.full_name_encrypted)
                 user_dict['email'] = encryption_service.decrypt(user.email_encrypted)
                 user_dict['is_suspended'] = user.is_suspended
+                user_dict['referrals_count'] = user.direct_referrals
                 
-                # Convert Cloudinary public_id to full URL
-                user_dict['profile_image'] = get_cloudinary_url(user.profile_image)
-                
-                # Get referral count
-                referral_count = Referral.query.filter_by(referrer_id=user.id).count()
-                user_dict['referrals_count'] = referral_count
-                
-                # Check if user is root/admin
-                has_referrer = Referral.query.filter_by(referred_id=user.id).first() is not None
-                user_dict['is_root'] = not has_referrer
+                # User is root/admin if they have no referrer
+                user_dict['is_root'] = referral_forest.is_root(user.id)
                 
                 users_data.append(user_dict)
             except Exception as e:
@@ -663,8 +731,7 @@ def suspend_user(user_id):
         current_user_id = get_current_user_id()
         
         # Verify user is admin (root)
-        referral = Referral.query.filter_by(referred_id=current_user_id).first()
-        if referral:
+        if not referral_forest.is_root(current_user_id):
             return jsonify({'error': 'Unauthorized - Admin access only'}), 403
         
         # Cannot suspend yourself
@@ -677,13 +744,13 @@ def suspend_user(user_id):
             return jsonify({'error': 'User not found'}), 404
         
         # Check if user is root (cannot suspend root)
-        has_referrer = Referral.query.filter_by(referred_id=user_id).first() is not None
-        if not has_referrer:
+        if referral_forest.is_root(user_id):
             return jsonify({'error': 'Cannot suspend root user'}), 400
         
         # Suspend user
         user.is_suspended = True
         db.session.commit()
+        event_bus.publish(USER_SUSPENDED, {'user_id': user_id})
         
         return jsonify({
             'message': 'User suspended successfully',
@@ -703,8 +770,7 @@ def unsuspend_user(user_id):
         current_user_id = get_current_user_id()
         
         # Verify user is admin (root)
-        referral = Referral.query.filter_by(referred_id=current_user_id).first()
-        if referral:
+        if not referral_forest.is_root(current_user_id):
             return jsonify({'error': 'Unauthorized - Admin access only'}), 403
         
         # Get user
@@ -715,6 +781,7 @@ def unsuspend_user(user_id):
         # Unsuspend user
         user.is_suspended = False
         db.session.commit()
+        event_bus.publish(USER_UNSUSPENDED, {'user_id': user_id})
         
         return jsonify({
             'message': 'User unsuspended successfully',
@@ -729,13 +796,16 @@ def unsuspend_user(user_id):
 @users_bp.route('/admin/users/<int:user_id>', methods=['DELETE'])
 @jwt_required()
 def delete_user(user_id):
-    """Delete a user - only accessible to root user"""
+    """
+    Delete a user - only accessible to root user. The user disappears
+    immediately; their chats, messages, matches and blocks are deleted in the
+    background (202 + job id, see /admin/deletion-jobs/<job_id>).
+    """
     try:
         current_user_id = get_current_user_id()
         
         # Verify user is admin (root)
-        referral = Referral.query.filter_by(referred_id=current_user_id).first()
-        if referral:
+        if not referral_forest.is_root(current_user_id):
             return jsonify({'error': 'Unauthorized - Admin access only'}), 403
         
         # Cannot delete yourself
@@ -744,38 +814,60 @@ def delete_user(user_id):
         
         # Get user
         user = User.query.get(user_id)
-        if not user:
+        if not user or user.deleted_at is not None:
             return jsonify({'error': 'User not found'}), 404
         
         # Check if user is root (cannot delete root)
-        has_referrer = Referral.query.filter_by(referred_id=user_id).first() is not None
-        if not has_referrer:
+        if referral_forest.is_root(user_id):
             return jsonify({'error': 'Cannot delete root user'}), 400
         
-        # Delete related data first
-        # Delete messages
-        Message.query.filter_by(sender_id=user_id).delete()
-        # Delete chats
-        Chat.query.filter((Chat.user1_id == user_id) | (Chat.user2_id == user_id)).delete()
-        # Delete matches
-        Match.query.filter((Match.user_id == user_id) | (Match.liked_user_id == user_id)).delete()
+        # Detach the user from the referral tree index
+        remove_user_from_closure(user_id)
         # Delete referrals (both as referrer and referred)
         Referral.query.filter((Referral.referrer_id == user_id) | (Referral.referred_id == user_id)).delete()
+        # Delete name index tokens
+        UserNameToken.query.filter_by(user_id=user_id).delete()
         
-        # Delete user
-        db.session.delete(user)
+        # Hide the user and their chats; the rest is deleted in the background
+        job = tombstone_user(user, requested_by=current_user_id)
         db.session.commit()
+        deletion_worker.notify(current_app._get_current_object())
+        
+        # Referrals were removed - every worker rebuilds its referral forest (see event_handlers.py)
+        event_bus.publish(USER_DELETED, {'user_id': user_id})
         
         return jsonify({
-            'message': 'User deleted successfully',
-            'user_id': user_id
-        }), 200
+            'message': 'User deletion started',
+            'user_id': user_id,
+            'job_id': job.id
+        }), 202
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+@users_bp.route('/admin/deletion-jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_deletion_job(job_id):
+    """Progress of a background deletion - only accessible to root user"""
+    try:
+        current_user_id = get_current_user_id()
+        
+        # Verify user is admin (root)
+        if not referral_forest.is_root(current_user_id):
+            return jsonify({'error': 'Unauthorized - Admin access only'}), 403
+        
+        job = DeletionJob.query.get(job_id)
+        if not job:
+            return jsonify({'error': 'Deletion job not found'}), 404
+        
+        return jsonify({'job': job.to_dict()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @users_bp.route('/block/<int:user_id>', methods=['POST'])
 @jwt_required()
 def block_user(user_id):
@@ -800,23 +892,8 @@ def block_user(user_id):
         if existing_block:
             return jsonify({'error': 'User already blocked'}), 400
         
-        # Remove match if exists (unlike)
-        match = Match.query.filter_by(
-            user_id=current_user_id,
-            liked_user_id=user_id
-        ).first()
-        
-        if match:
-            # If mutual, also remove the mutual flag from reverse match
-            if match.is_mutual:
-                reverse_match = Match.query.filter_by(
-                    user_id=user_id,
-                    liked_user_id=current_user_id
-                ).first()
-                if reverse_match:
-                    reverse_match.is_mutual = False
-            
-            db.session.delete(match)
+        # Remove match if exists (unlike), clearing the mutual flag on the reverse like
+        unlike(current_user_id, user_id)
         
         # Create block
         new_block = Block(
@@ -826,6 +903,7 @@ def block_user(user_id):
         
         db.session.add(new_block)
         db.session.commit()
+        event_bus.publish(USER_BLOCKED, {'blocker_id': current_user_id, 'blocked_id': user_id})
         
         return jsonify({
             'message': 'User blocked successfully'
@@ -855,6 +933,7 @@ def unblock_user(user_id):
         # Remove block
         db.session.delete(block)
         db.session.commit()
+        event_bus.publish(USER_UNBLOCKED, {'blocker_id': current_user_id, 'blocked_id': user_id})
         
         return jsonify({
             'message': 'User unblocked successfully'
@@ -872,22 +951,17 @@ def get_blocked_users():
     try:
         current_user_id = get_current_user_id()
         
-        # Get all blocks
-        blocks = Block.query.filter_by(blocker_id=current_user_id).all()
-        
-        blocked_users = []
-        for block in blocks:
-            user = User.query.get(block.blocked_id)
-            if user and not user.is_suspended:
-                try:
-                    user_dict = user.to_dict()
-                    user_dict['full_name'] = encryption_service.decrypt(user.full_name_encrypted)
-                    user_dict['profile_image'] = get_cloudinary_url(user.profile_image)
-                    user_dict['blocked_at'] = block.created_at.isoformat() if block.created_at else None
-                    blocked_users.append(user_dict)
-                except Exception as e:
-                    print(f"[GET BLOCKED] Error processing user {user.id}: {e}")
-                    continue
+        # Get all blocks together with the blocked users
+        rows = db.session.query(Block, User).join(
+            User, User.id == Block.blocked_id
+        ).filter(
+            Block.blocker_id == current_user_id,
+            User.is_suspended == False
+        ).all()
+        
+        blocked_users = hydrate_users([user for _, user in rows], include_referrer=False)
+        for (block, _), user_dict in zip(rows, blocked_users):
+            user_dict['blocked_at'] = block.created_at.isoformat() if block.created_at else None
         
         return jsonify({'blocked_users': blocked_users}), 200
         
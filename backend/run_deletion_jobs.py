@@ -0,0 +1,22 @@
+"""
+Run background deletion jobs (chats and users) to completion in this process
+Retries failed jobs too. The app resumes interrupted jobs by itself at startup;
+use this to finish a backlog from the command line.
+"""
+from app import create_app
+from models import db
+from deletion_jobs import requeue_jobs, run_pending_jobs
+
+def run_deletion_jobs():
+    app = create_app()
+    
+    with app.app_context():
+        requeued = requeue_jobs(include_failed=True)
+        db.session.commit()
+        print(f"Requeued {requeued} abandoned or failed jobs")
+        
+        processed = run_pending_jobs()
+        print(f"✅ Processed {processed} deletion jobs")
+
+if __name__ == '__main__':
+    run_deletion_jobs()
@@ -0,0 +1,99 @@
+"""
+Concurrency test for likes.like / likes.unlike against a local PostgreSQL
+Creates temporary user pairs, has both users of every pair like each other at
+the same instant (from separate threads and connections) and checks that every
+pair ends up mutual on both rows; then unlikes concurrently and checks that no
+mutual flag is left. Deletes everything it created.
+Run against a scratch database: python test_like_concurrency.py [pairs] [rounds]
+"""
+import sys
+import threading
+import time
+from app import create_app
+from models import db, User, Match
+from likes import like, unlike
+from message_partitions import is_postgres
+from benchmark_send_message import create_users
+
+
+def race(app, calls):
+    """Run each (function, user_id, other_user_id) in its own thread, released together"""
+    barrier = threading.Barrier(len(calls))
+    errors = []
+
+    def worker(function, user_id, other_user_id):
+        with app.app_context():
+            try:
+                barrier.wait()
+                function(user_id, other_user_id)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=call) for call in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def check_pairs(pairs, expected_rows, expected_mutual):
+    """Return the pairs whose rows don't match the expectation"""
+    bad = []
+    for user_id, other_user_id in pairs:
+        rows = Match.query.filter(
+            ((Match.user_id == user_id) & (Match.liked_user_id == other_user_id)) |
+            ((Match.user_id == other_user_id) & (Match.liked_user_id == user_id))
+        ).all()
+        if len(rows) != expected_rows or any(row.is_mutual != expected_mutual for row in rows):
+            bad.append((user_id, other_user_id, [(row.user_id, row.is_mutual) for row in rows]))
+    return bad
+
+
+def run_like_concurrency(pairs=20, rounds=5):
+    app = create_app()
+
+    with app.app_context():
+        if not is_postgres():
+            print("❌ DATABASE_URL must point to a (scratch) PostgreSQL database")
+            return False
+
+        user_ids = create_users(pairs * 2)
+        user_pairs = list(zip(user_ids[::2], user_ids[1::2]))
+        ok = True
+
+        try:
+            for round_number in range(1, rounds + 1):
+                start = time.perf_counter()
+                errors = race(app, [(like, a, b) for a, b in user_pairs] + [(like, b, a) for a, b in user_pairs])
+                bad = check_pairs(user_pairs, expected_rows=2, expected_mutual=True)
+                print(f"{'✅' if not (errors or bad) else '❌'} Round {round_number} like:"
+                      f" {len(user_pairs) * 2} concurrent likes in {time.perf_counter() - start:.2f}s,"
+                      f" {len(bad)} pairs not mutual, {len(errors)} errors")
+
+                errors_unlike = race(app, [(unlike, a, b) for a, b in user_pairs] + [(unlike, b, a) for a, b in user_pairs])
+                bad_unlike = check_pairs(user_pairs, expected_rows=0, expected_mutual=False)
+                print(f"{'✅' if not (errors_unlike or bad_unlike) else '❌'} Round {round_number} unlike:"
+                      f" {len(bad_unlike)} pairs with rows left, {len(errors_unlike)} errors")
+
+                for error in (errors + errors_unlike)[:3]:
+                    print(f"  error: {error}")
+                for pair in (bad + bad_unlike)[:3]:
+                    print(f"  pair: {pair}")
+                ok = ok and not (errors or bad or errors_unlike or bad_unlike)
+        finally:
+            Match.query.filter(Match.user_id.in_(user_ids) | Match.liked_user_id.in_(user_ids)).delete(synchronize_session=False)
+            User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+            db.session.commit()
+            print("ℹ️  Cleaned up test data")
+
+        return ok
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    sys.exit(0 if run_like_concurrency(*args) else 1)
@@ -2,9 +2,11 @@
 Utility functions for the backend
 """
 from flask_jwt_extended import get_jwt_identity
+from presence import presence
 
 def get_current_user_id():
-    """Helper to get current user ID as integer from JWT"""
+    """Helper to get current user ID as integer from JWT (also records the user as active, see presence.py)"""
     identity = get_jwt_identity()
-    return int(identity) if identity else None
-
+    user_id = int(identity) if identity else None
+    presence.touch(user_id)
+    return user_id
@@ -2,6 +2,7 @@ import { Link, useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
 import { useState, useEffect } from 'react';
 import { chatAPI, usersAPI } from '../services/api';
+import { subscribeChatEvents, onStatusChange, isConnected } from '../services/chatStream';
 import './Navbar.css';
 
 const Navbar = () => {
@@ -19,9 +20,22 @@ const Navbar = () => {
       // Check if user is admin
       checkAdminStatus();
       
-      // Poll for new messages every 30 seconds
-      const interval = setInterval(loadUnreadCount, 30000);
-      return () => clearInterval(interval);
+      // Unread count is pushed by the chat stream; poll every 30 seconds only while it is down
+      const unsubscribeEvents = subscribeChatEvents((type, data) => {
+        if (type === 'unread_count') setUnreadCount(data.unread_count || 0);
+        else if (type === 'resync') loadUnreadCount();
+      });
+      const unsubscribeStatus = onStatusChange((connected) => {
+        if (connected) loadUnreadCount(); // Catch up on anything missed while disconnected
+      });
+      const interval = setInterval(() => {
+        if (!isConnected()) loadUnreadCount();
+      }, 30000);
+      return () => {
+        clearInterval(interval);
+        unsubscribeStatus();
+        unsubscribeEvents();
+      };
     } else {
       setIsAdmin(false);
     }
@@ -1,21 +1,34 @@
 import { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { chatAPI } from '../services/api';
+import { subscribeChatEvents, onStatusChange, isConnected } from '../services/chatStream';
 import { useAuth } from '../context/AuthContext';
 import { useToast } from '../context/ToastContext';
 import './Chat.css';
 
+// Send 'typing' at most this often while the user types; hide the other side's indicator after TYPING_TIMEOUT without one
+const TYPING_INTERVAL = 3000;
+const TYPING_TIMEOUT = 6000;
+
 const Chat = () => {
   const { chatId } = useParams();
   const navigate = useNavigate();
   const { user: currentUser } = useAuth();
   const { error: showError, success: showSuccess, showConfirm } = useToast();
   const [conversations, setConversations] = useState([]);
+  const [conversationsCursor, setConversationsCursor] = useState(null);
+  const [loadingMoreConversations, setLoadingMoreConversations] = useState(false);
+  const olderPagesLoadedRef = useRef(false);
   const [selectedChat, setSelectedChat] = useState(null);
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState('');
   const [loading, setLoading] = useState(true);
+  const [streamConnected, setStreamConnected] = useState(isConnected());
   const messagesEndRef = useRef(null);
+  const messagesRef = useRef([]);
+  const [otherTyping, setOtherTyping] = useState(false);
+  const typingTimeoutRef = useRef(null);
+  const lastTypingSentRef = useRef(0);
   
   // Get user's timezone from browser
   const userTimeZone = Intl.DateTimeFormat().resolvedOptions().timeZone;
@@ -189,18 +202,56 @@ const Chat = () => {
     }
   }, [chatId, conversations.length]);
 
-  // Auto-refresh messages every 5 seconds
+  // Live updates from the chat stream
+  useEffect(() => {
+    return subscribeChatEvents((type, data) => {
+      if (type === 'message') {
+        if (selectedChat && data.chat_id === selectedChat.id) {
+          syncChatMessages(selectedChat.id); // Also marks it as read
+          if (data.sender_id !== currentUser.id) setOtherTyping(false);
+        }
+        loadConversations();
+      } else if (type === 'typing') {
+        if (selectedChat && data.chat_id === selectedChat.id) {
+          clearTimeout(typingTimeoutRef.current);
+          setOtherTyping(data.typing);
+          if (data.typing) {
+            typingTimeoutRef.current = setTimeout(() => setOtherTyping(false), TYPING_TIMEOUT);
+          }
+        }
+      } else if (type === 'read') {
+        if (selectedChat && data.chat_id === selectedChat.id) {
+          setMessages(prev => prev.map(msg => (
+            msg.sender_id === currentUser.id && msg.id <= data.last_read_message_id ? { ...msg, is_read: true } : msg
+          )));
+        }
+      } else if (type === 'resync') {
+        if (selectedChat) loadChatMessages(selectedChat.id, false);
+        loadConversations();
+      }
+    });
+  }, [selectedChat]);
+
   useEffect(() => {
-    if (selectedChat) {
+    setOtherTyping(false);
+    return () => clearTimeout(typingTimeoutRef.current);
+  }, [selectedChat?.id]);
+
+  // Fall back to refreshing messages every 5 seconds while the stream is down
+  useEffect(() => onStatusChange(setStreamConnected), []);
+
+  useEffect(() => {
+    if (selectedChat && !streamConnected) {
       const interval = setInterval(() => {
-        loadChatMessages(selectedChat.id, false);
+        syncChatMessages(selectedChat.id);
       }, 5000);
       return () => clearInterval(interval);
     }
-  }, [selectedChat]);
+  }, [selectedChat, streamConnected]);
 
   // Auto-scroll to bottom when messages change
   useEffect(() => {
+    messagesRef.current = messages;
     scrollToBottom();
   }, [messages]);
 
@@ -208,43 +259,96 @@ const Chat = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  // Refresh the first page, keeping older pages already loaded (chats with new activity move up into it)
   const loadConversations = async () => {
     try {
       const response = await chatAPI.getConversations();
-      setConversations(response.data.conversations);
+      const firstPage = response.data.conversations;
+      const firstPageIds = new Set(firstPage.map(c => c.id));
+      setConversations(prev => [...firstPage, ...prev.filter(c => !firstPageIds.has(c.id))]);
+      if (!olderPagesLoadedRef.current) {
+        setConversationsCursor(response.data.next_cursor);
+      }
     } catch (error) {
       console.error('Error loading conversations:', error);
     }
     setLoading(false);
   };
 
+  const loadMoreConversations = async () => {
+    if (!conversationsCursor || loadingMoreConversations) return;
+    setLoadingMoreConversations(true);
+    try {
+      const response = await chatAPI.getConversations({ cursor: conversationsCursor });
+      olderPagesLoadedRef.current = true;
+      setConversations(prev => {
+        const loadedIds = new Set(prev.map(c => c.id));
+        return [...prev, ...response.data.conversations.filter(c => !loadedIds.has(c.id))];
+      });
+      setConversationsCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading more conversations:', error);
+    }
+    setLoadingMoreConversations(false);
+  };
+
+  // Load the next page when the list is scrolled near its end
+  const handleSidebarScroll = (e) => {
+    const { scrollTop, scrollHeight, clientHeight } = e.target;
+    if (scrollHeight - scrollTop - clientHeight < 100) {
+      loadMoreConversations();
+    }
+  };
+
   const loadChatMessages = async (id, setAsSelected = true) => {
     try {
       const response = await chatAPI.getMessages(id);
       setMessages(response.data.messages);
       if (setAsSelected) {
-        // Try to find chat in conversations list
+        // Try to find chat in the loaded conversations
         let chat = conversations.find(c => c.id === parseInt(id));
         
-        // If chat not found in list (new chat), reload conversations to get it
+        // Not on the loaded pages (new or older chat) - fetch it on its own
         if (!chat) {
-          const convResponse = await chatAPI.getConversations();
-          const updatedConversations = convResponse.data.conversations;
-          setConversations(updatedConversations);
-          chat = updatedConversations.find(c => c.id === parseInt(id));
+          const convResponse = await chatAPI.getConversation(id);
+          chat = convResponse.data.conversation;
         }
         
-        if (chat) {
-          setSelectedChat(chat);
-        } else {
-          console.error('Chat not found even after reloading conversations');
-        }
+        setSelectedChat(chat);
       }
     } catch (error) {
       console.error('Error loading messages:', error);
     }
   };
 
+  // Fetch only messages newer than the last one we have
+  const syncChatMessages = async (id) => {
+    const current = messagesRef.current;
+    if (current.length === 0 || current[current.length - 1].chat_id !== parseInt(id)) {
+      loadChatMessages(id, false);
+      return;
+    }
+    try {
+      const afterId = current[current.length - 1].id;
+      const response = await chatAPI.getMessages(id, { after_id: afterId });
+      const newMessages = response.data.messages;
+      if (newMessages.length > 0) {
+        setMessages(prev => [...prev, ...newMessages.filter(msg => msg.id > afterId)]);
+      }
+    } catch (error) {
+      console.error('Error syncing messages:', error);
+    }
+  };
+
+  const handleMessageChange = (e) => {
+    setNewMessage(e.target.value);
+    const now = Date.now();
+    if (selectedChat && e.target.value && now - lastTypingSentRef.current > TYPING_INTERVAL) {
+      lastTypingSentRef.current = now;
+      chatAPI.sendTyping(selectedChat.id).catch(() => {});
+    }
+  };
+
   const handleSendMessage = async (e) => {
     e.preventDefault();
     if (!newMessage.trim() || !selectedChat) return;
@@ -252,8 +356,12 @@ const Chat = () => {
     try {
       await chatAPI.sendMessage(selectedChat.other_user_id, newMessage);
       setNewMessage('');
-      loadChatMessages(selectedChat.id, false);
-      loadConversations(); // Refresh to update last message
+      lastTypingSentRef.current = 0;
+      if (!isConnected()) {
+        // Otherwise the stream echoes the message back
+        syncChatMessages(selectedChat.id);
+        loadConversations(); // Refresh to update last message
+      }
     } catch (error) {
       showError("שגיאה בשליחת הודעה");
     }
@@ -276,6 +384,7 @@ const Chat = () => {
 
     try {
       await chatAPI.deleteChat(selectedChat.id);
+      setConversations(prev => prev.filter(c => c.id !== selectedChat.id));
       setSelectedChat(null);
       setMessages([]);
       loadConversations();
@@ -304,7 +413,14 @@ const Chat = () => {
         ) : (
           <>
             <div className="chat-header">
-              <h3>{selectedChat.other_user?.name}</h3>
+              <div className="chat-header-title">
+                <h3>{selectedChat.other_user?.name}</h3>
+                {otherTyping ? (
+                  <span className="chat-presence typing">מקליד/ה...</span>
+                ) : selectedChat.other_user?.online && (
+                  <span className="chat-presence">מחובר/ת עכשיו</span>
+                )}
+              </div>
               <div className="chat-header-actions">
                 <button 
                   className="chat-header-btn"
@@ -353,7 +469,7 @@ const Chat = () => {
               <input
                 type="text"
                 value={newMessage}
-                onChange={(e) => setNewMessage(e.target.value)}
+                onChange={handleMessageChange}
                 placeholder="כתוב הודעה..."
                 className="message-input"
               />
@@ -365,7 +481,7 @@ const Chat = () => {
         )}
       </div>
 
-      <div className="chat-sidebar">
+      <div className="chat-sidebar" onScroll={handleSidebarScroll}>
         <h2>שיחות</h2>
         {conversations.length === 0 ? (
           <div className="no-conversations">
@@ -396,6 +512,13 @@ const Chat = () => {
                 </div>
               </div>
             ))}
+            {conversationsCursor && (
+              <div className="conversations-load-more">
+                <button className="btn btn-secondary" onClick={loadMoreConversations} disabled={loadingMoreConversations}>
+                  {loadingMoreConversations ? 'טוען...' : 'טען עוד'}
+                </button>
+              </div>
+            )}
           </div>
         )}
       </div>
@@ -6,27 +6,48 @@ import './Matches.css';
 const Matches = () => {
   const [matches, setMatches] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [sort, setSort] = useState('matched');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     loadMatches();
-  }, []);
+  }, [sort]);
 
   const loadMatches = async () => {
     setLoading(true);
     try {
-      const response = await usersAPI.getMatches();
+      const response = await usersAPI.getMatches({ sort });
       setMatches(response.data.matches);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error loading matches:', error);
     }
     setLoading(false);
   };
 
+  const loadMoreMatches = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await usersAPI.getMatches({ sort, cursor: nextCursor });
+      setMatches(prev => [...prev, ...response.data.matches]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading more matches:', error);
+    }
+    setLoadingMore(false);
+  };
+
   return (
     <div className="matches-container">
       <div className="matches-header">
         <h1>ההתאמות שלי</h1>
         <p>משתמשים שאהבתם זה את זה 💚</p>
+        <select className="matches-sort" value={sort} onChange={(e) => setSort(e.target.value)}>
+          <option value="matched">התאמות אחרונות</option>
+          <option value="activity">שיחות אחרונות</option>
+        </select>
       </div>
 
       {loading ? (
@@ -43,6 +64,14 @@ const Matches = () => {
           ))}
         </div>
       )}
+
+      {!loading && nextCursor && (
+        <div className="matches-load-more">
+          <button className="btn btn-secondary" onClick={loadMoreMatches} disabled={loadingMore}>
+            {loadingMore ? 'טוען...' : 'טען עוד'}
+          </button>
+        </div>
+      )}
     </div>
   );
 };
@@ -1,7 +1,7 @@
 import axios from 'axios';
 
 // Base URL for API - change to your Railway URL in production
-const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000';
+export const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000';
 
 // Create axios instance
 const api = axios.create({
@@ -35,8 +35,11 @@ export const authAPI = {
 export const usersAPI = {
   getProfile: (userId) => api.get(`/users/profile/${userId}`),
   search: (params) => api.get('/users/search', { params }),
+  discover: (perPage = 20) => api.get('/users/discover', { params: { per_page: perPage } }),
   likeUser: (userId) => api.post(`/users/like/${userId}`),
-  getMatches: () => api.get('/users/matches'),
+  unlikeUser: (userId) => api.delete(`/users/like/${userId}`),
+  submitDecisions: (decisions) => api.post('/users/decisions', { decisions }),
+  getMatches: (params = {}) => api.get('/users/matches', { params }),
   updateProfile: (data) => api.put('/users/profile', data),
   checkIsAdmin: () => api.get('/users/is-admin'),
   getAdminStats: () => api.get('/users/admin/stats'),
@@ -51,18 +54,21 @@ export const usersAPI = {
 
 // Chat endpoints
 export const chatAPI = {
-  getConversations: () => api.get('/chat/conversations'),
-  getMessages: (chatId, page = 1) => api.get(`/chat/messages/${chatId}`, { params: { page } }),
+  getConversations: (params = {}) => api.get('/chat/conversations', { params }),
+  getConversation: (chatId) => api.get(`/chat/conversations/${chatId}`),
+  getMessages: (chatId, params = { page: 1 }) => api.get(`/chat/messages/${chatId}`, { params }),
   sendMessage: (recipientId, content) => api.post('/chat/send', { recipient_id: recipientId, content }),
   startChat: (userId) => api.post(`/chat/start/${userId}`),
   getUnreadCount: () => api.get('/chat/unread-count'),
+  sendTyping: (chatId, typing = true) => api.post(`/chat/typing/${chatId}`, { typing }),
+  searchMessages: (q, params = {}) => api.get('/chat/search', { params: { q, ...params } }),
   deleteChat: (chatId) => api.delete(`/chat/delete/${chatId}`),
 };
 
 // Referrals endpoints
 export const referralsAPI = {
   getMyReferrals: () => api.get('/referrals/my-referrals'),
-  getTree: () => api.get('/referrals/tree'),
+  getTree: (params) => api.get('/referrals/tree', { params }),
   getMyReferrer: () => api.get('/referrals/my-referrer'),
   getChain: (userId) => api.get(`/referrals/chain/${userId}`),
   getStats: () => api.get('/referrals/stats'),
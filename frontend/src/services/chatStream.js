@@ -0,0 +1,118 @@
+import { API_BASE_URL } from './api';
+
+// Shared server-sent events connection for chat push (/chat/stream).
+// One connection per tab, opened while at least one component listens.
+// Components check isConnected() / onStatusChange to fall back to polling.
+// When the server is at its stream cap (503), wait for its retry_after and poll meanwhile.
+
+const RECONNECT_DELAY = 3000;
+const MAX_RECONNECT_DELAY = 30000;
+
+const listeners = new Set();
+const statusListeners = new Set();
+let controller = null;
+let connected = false;
+let reconnectTimer = null;
+let reconnectDelay = RECONNECT_DELAY;
+
+const setConnected = (value) => {
+  if (connected === value) return;
+  connected = value;
+  statusListeners.forEach((listener) => listener(value));
+};
+
+const dispatch = (rawEvent) => {
+  let type = 'message';
+  let data = '';
+  rawEvent.split('\n').forEach((line) => {
+    if (line.startsWith('event:')) type = line.slice(6).trim();
+    else if (line.startsWith('data:')) data += line.slice(5).trim();
+  });
+  if (!data) return;
+
+  if (type === 'ready') {
+    reconnectDelay = RECONNECT_DELAY;
+    setConnected(true);
+    return;
+  }
+
+  const payload = JSON.parse(data);
+  listeners.forEach((listener) => listener(type, payload));
+};
+
+const scheduleReconnect = (delay = null) => {
+  setConnected(false);
+  if (listeners.size === 0 || reconnectTimer) return;
+  reconnectTimer = setTimeout(() => {
+    reconnectTimer = null;
+    connect();
+  }, delay ?? reconnectDelay);
+  if (delay === null) reconnectDelay = Math.min(reconnectDelay * 2, MAX_RECONNECT_DELAY);
+};
+
+const connect = async () => {
+  const token = localStorage.getItem('token');
+  if (!token || controller) return;
+
+  controller = new AbortController();
+  const { signal } = controller;
+  let retryAfter = null;
+  try {
+    const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+      headers: { Authorization: `Bearer ${token}`, Accept: 'text/event-stream' },
+      signal,
+    });
+    if (response.status === 503) {
+      const body = await response.json().catch(() => ({}));
+      retryAfter = (body.retry_after || MAX_RECONNECT_DELAY / 1000) * 1000;
+    }
+    if (!response.ok || !response.body) throw new Error(`Stream failed: ${response.status}`);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        dispatch(buffer.slice(0, boundary));
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+      }
+    }
+  } catch (error) {
+    if (signal.aborted) return;
+    console.error('Chat stream error:', error);
+  } finally {
+    if (controller?.signal === signal) controller = null;
+  }
+  if (!signal.aborted) scheduleReconnect(retryAfter);
+};
+
+const disconnect = () => {
+  clearTimeout(reconnectTimer);
+  reconnectTimer = null;
+  controller?.abort();
+  controller = null;
+  setConnected(false);
+};
+
+// Listen for chat events: listener(type, data). Returns an unsubscribe function.
+export const subscribeChatEvents = (listener) => {
+  listeners.add(listener);
+  if (listeners.size === 1) connect();
+  return () => {
+    listeners.delete(listener);
+    if (listeners.size === 0) disconnect();
+  };
+};
+
+// Listen for connection changes: listener(connected). Returns an unsubscribe function.
+export const onStatusChange = (listener) => {
+  statusListeners.add(listener);
+  return () => statusListeners.delete(listener);
+};
+
+export const isConnected = () => connected;